@@ -0,0 +1,86 @@
+from typing import Any, Dict, List, Tuple
+
+import argparse
+import multiprocessing
+
+import numpy as np
+from scipy.stats import spearmanr
+
+from qualitylib.tools import import_python_file, read_dataset
+from qualitylib.result import Result
+from qualitylib.cross_validate import random_cross_validation
+
+from funque_plus.feature_extractors import get_fex  # Imports only the module implementing the requested feature extractor
+from funque_plus.feature_extractors.funque_pipeline import precisions
+from crossval_features_on_dataset import ScaledSVR
+
+
+def run_fex(args: Tuple[Any, Dict[str, Any], str]) -> Result:
+    FexClass, asset_dict, precision = args
+    fex = FexClass(use_cache=False, precision=precision)  # Never read or write stored results, which do not record the precision
+    return fex(asset_dict)
+
+
+def get_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description='Compare features of a FUNQUE-family extractor computed in float32 against float64')
+    parser.add_argument('--dataset', help='Path to dataset file for which to extract features', type=str)
+    parser.add_argument('--fex_name', help='Name of feature extractor', type=str)
+    parser.add_argument('--fex_version', help='Version of feature extractor', type=str, default=None)
+    parser.add_argument('--processes', help='Number of parallel processes', type=int, default=1)
+    parser.add_argument('--splits', help='Number of random train-test splits used to compare cross-validated SROCC. 0 to skip', type=int, default=100)
+    parser.add_argument('--out_file', help='Path to output CSV file containing the per-feature report. (Optional)', type=str, default=None)
+    return parser
+
+
+def main() -> None:
+    args = get_parser().parse_args()
+
+    dataset = import_python_file(args.dataset)
+    assets = read_dataset(dataset, shuffle=False)
+    scores = np.array([asset_dict['score'] for asset_dict in assets])
+
+    FexClass = get_fex(args.fex_name, args.fex_version)
+    results = {}
+    with multiprocessing.Pool(args.processes) as pool:
+        for precision in precisions:
+            results[precision] = pool.map(run_fex, [(FexClass, asset_dict, precision) for asset_dict in assets])
+
+    ref_precision, test_precision = precisions[0], precisions[1]
+    feat_names = list(results[ref_precision][0].feat_names)
+
+    # Per-frame deviations, pooled over all videos
+    ref_frame_feats = np.concatenate([result.feats for result in results[ref_precision]], axis=0)
+    test_frame_feats = np.concatenate([result.feats for result in results[test_precision]], axis=0)
+    abs_devs = np.abs(test_frame_feats - ref_frame_feats)
+    rel_devs = abs_devs / np.maximum(np.abs(ref_frame_feats), np.finfo(np.float64).tiny)
+
+    # Per-video features, as used by the quality models
+    ref_feats = np.stack([result.agg_feats for result in results[ref_precision]], axis=0)
+    test_feats = np.stack([result.agg_feats for result in results[test_precision]], axis=0)
+
+    lines = [f'Feature,Max abs dev,Max rel dev,Median rel dev,SROCC {ref_precision},SROCC {test_precision},SROCC change']  # Not using spaces makes parsing text output as csv easier
+    for feat_ind, feat_name in enumerate(feat_names):
+        ref_srocc = spearmanr(ref_feats[:, feat_ind], scores)[0]
+        test_srocc = spearmanr(test_feats[:, feat_ind], scores)[0]
+        lines.append(
+            f'{feat_name},{np.max(abs_devs[:, feat_ind]):.3e},{np.max(rel_devs[:, feat_ind]):.3e},{np.median(rel_devs[:, feat_ind]):.3e},'
+            f'{ref_srocc:.4f},{test_srocc:.4f},{test_srocc - ref_srocc:.2e}'
+        )
+    print('\n'.join(lines))
+
+    if args.out_file is not None:
+        with open(args.out_file, 'w') as out_file:
+            out_file.write('\n'.join(lines) + '\n')
+
+    if args.splits > 0:
+        print('Precision,Median SROCC,Std SROCC')
+        for precision in precisions:
+            np.random.seed(0)  # Same train-test splits for both precisions
+            agg_stats = random_cross_validation(ScaledSVR, results[precision], splits=args.splits, test_fraction=0.2, processes=args.processes)
+            stats: List[Dict[str, Any]] = agg_stats['stats']
+            sroccs = np.array([stat['SROCC'] for stat in stats])
+            print(f'{precision},{np.median(sroccs):.4f},{np.std(sroccs):.4f}')
+
+
+if __name__ == '__main__':
+    main()
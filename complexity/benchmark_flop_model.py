@@ -0,0 +1,256 @@
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+import numpy as np
+import cv2
+
+from funque_plus.feature_extractors import get_fex
+from funque_plus.feature_extractors.funque_pipeline import SsimAtom, MsSsimAtom, DlmAtom, VifApproxAtom, MadAtom, TemporalMadAtom, StrredAtom, SaiAtom, BlurEdgeAtom
+from funque_plus.features.funque_atoms.filter_utils import SpatialFilter, spatial_filter_keys
+from funque_plus.profiling import StageTimer
+from funque_plus.utils import get_standard
+
+# The analytical models in complexity/analysis import each other as top-level modules
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'analysis'))
+from filt import sep_filt_opp  # noqa: E402
+from csf import sw_csf_opp  # noqa: E402
+from dwt import haar_opp  # noqa: E402
+from ssim import wd_essim_opp, wd_ms_essim_opp  # noqa: E402
+from dlm import dlm_opp  # noqa: E402
+from vif import vif_scale_opp  # noqa: E402
+from motion import motion_opp  # noqa: E402
+from strred import srred_opp, trred_opp  # noqa: E402
+from sai import sai_opp  # noqa: E402
+from blur_edge import blur_opp, edge_opp  # noqa: E402
+from funque import funque_opp  # noqa: E402
+from y_funque_plus import y_funque_plus_opp  # noqa: E402
+from three_channel_funque_plus import three_channel_funque_plus_opp  # noqa: E402
+
+
+resolutions = {'1080p': (1080, 1920), '2160p': (2160, 3840)}
+
+# Whole-model op counts of complexity_analysis.py, per pixel of the input frame
+model_opps = {
+    'FUNQUE_fex': funque_opp,
+    'Y_FUNQUE_Plus_fex': y_funque_plus_opp,
+    '3C_FUNQUE_Plus_fex': three_channel_funque_plus_opp,
+}
+
+
+def atom_opp(atom):
+    # Ops per pixel of the (SAST-downscaled) channel, composed as in the whole-model functions. None if not modeled.
+    l = atom.levels
+    if isinstance(atom, MsSsimAtom):
+        return wd_ms_essim_opp(l)
+    if isinstance(atom, SsimAtom):
+        return wd_essim_opp(l)
+    if isinstance(atom, DlmAtom):
+        return dlm_opp(1, opt_cm=True) / 4**(l-1)  # Only the coarsest level
+    if isinstance(atom, VifApproxAtom):
+        return sum([vif_scale_opp(i, atom.k, opt_filt=True) for i in range(1, l+1)])
+    if isinstance(atom, (MadAtom, TemporalMadAtom)):
+        return motion_opp(0) / 4**l  # Motion without smoothing
+    if isinstance(atom, StrredAtom):
+        return srred_opp(l) + trred_opp(l)
+    if isinstance(atom, SaiAtom):
+        return sai_opp(l)
+    if isinstance(atom, BlurEdgeAtom):
+        return edge_opp(l) if atom.mode == 'edge' else blur_opp(l)
+    return None
+
+
+def stage_opps(pipeline):
+    '''
+    Analytical ops per input pixel of each stage timed by the pipeline (see funque_plus.profiling), or None for stages that are not modeled
+    (decoding, resizing, normalization and caching). Transforms are counted for every channel of both sides.
+    '''
+    transform = pipeline.transform
+    transforms = 2 * len(transform.channels)
+    opps = {'decode': None, 'resize': None, 'normalize': None}
+    if transform.csf_stage == 'image' and transform.csf in spatial_filter_keys:
+        opps['filter'] = transforms * sep_filt_opp(len(SpatialFilter(transform.csf).taps))
+    elif transform.csf_stage == 'pyramid' and transform.csf is not None:
+        opps['filter'] = transforms * sw_csf_opp(transform.levels)
+    else:
+        opps['filter'] = None
+    opps['wavedec'] = transforms * haar_opp(transform.levels) if transform.wavelet == 'haar' else None
+    for atom in pipeline.atoms:
+        opps[atom.stage_name] = atom_opp(atom)
+
+    sast_scale = 0.25 if transform.sast else 1
+    return {name: opp * sast_scale if opp is not None else None for name, opp in opps.items()}
+
+
+def smooth_noise(rng, shape, scale):
+    # Random texture with detail at all scales, in [0, 1]
+    img = np.zeros(shape, dtype='float32')
+    for octave in range(4):
+        low_res = rng.random((max(shape[0] // (scale >> octave), 2), max(shape[1] // (scale >> octave), 2)), dtype='float32')
+        img += cv2.resize(low_res, (shape[1], shape[0]), interpolation=cv2.INTER_CUBIC) / 2**octave
+    return (img - img.min()) / (img.max() - img.min())
+
+
+def write_video_pair(ref_path, dis_path, shape, frames, rng):
+    '''
+    Writes a synthetic 8-bit 4:2:0 YUV video pair. The reference pans across a random texture, and the distorted video is a
+    blurred, noisy copy of it.
+    '''
+    height, width = shape
+    pad = 2 * frames
+    texture = smooth_noise(rng, (height + pad, width + pad), 64)
+    with open(ref_path, 'wb') as ref_file, open(dis_path, 'wb') as dis_file:
+        for frame_ind in range(frames):
+            y_ref = 16 + 219 * texture[frame_ind:frame_ind+height, 2*frame_ind:2*frame_ind+width]
+            y_dis = cv2.GaussianBlur(y_ref, (5, 5), 1.0) + rng.normal(0, 3, shape).astype('float32')
+            for y, out_file in [(y_ref, ref_file), (y_dis, dis_file)]:
+                uv = cv2.resize(y, (width // 2, height // 2), interpolation=cv2.INTER_AREA)
+                for plane in [y, 128 + 0.25 * (uv - 128), 128 - 0.25 * (uv - 128)]:
+                    out_file.write(np.clip(np.round(plane), 0, 255).astype('uint8').tobytes())
+
+
+def time_pipeline(pipeline, asset_dict, repeats):
+    '''
+    Minimum over runs of the wall time of the pipeline, and of the total wall time of each stage, and the number of frames.
+    '''
+    run_times = []
+    stage_times = {}
+    for _ in range(repeats):
+        timer = StageTimer(trace_memory=False)
+        start = time.perf_counter()
+        pipeline.run(asset_dict, 1, timer=timer)
+        run_times.append(time.perf_counter() - start)
+        table = timer.frame_table()
+        for name, stage_time in zip(table['stages'], np.sum(table['wall_time'], axis=0)):
+            stage_times[name] = min(stage_times.get(name, np.inf), stage_time)
+    return np.min(run_times), stage_times, len(table['frame_inds'])
+
+
+def benchmark_extractor(fex_name, asset_dict, args):
+    fex = get_fex(fex_name)(use_cache=False, precision=args.precision, prefetch_depth=0)
+    run_time, stage_times, frames = time_pipeline(fex.pipeline, asset_dict, args.repeats)
+    pixels = asset_dict['width'] * asset_dict['height']
+    opps = stage_opps(fex.pipeline)
+
+    modeled_stages = [name for name in stage_times if opps.get(name) is not None]
+    modeled_opp = sum([opps[name] for name in modeled_stages])
+    modeled_time = sum([stage_times[name] for name in modeled_stages])
+    stages = []
+    for name, stage_time in stage_times.items():
+        opp = opps.get(name)
+        stage = {
+            'stage': name,
+            'time_per_frame_ms': 1e3 * stage_time / frames,
+            'ns_per_pixel': 1e9 * stage_time / (frames * pixels),
+            'ops_per_pixel': opp,
+            'flop_share': opp / modeled_opp if opp is not None else None,
+            'time_share': stage_time / modeled_time if opp is not None else None,
+        }
+        # Measured cost relative to the FLOP model: 1 if the stage takes the share of time that its ops predict
+        stage['cost_ratio'] = stage['time_share'] / stage['flop_share'] if opp else None
+        stage['flagged'] = bool(stage['cost_ratio'] is not None and stage['cost_ratio'] > args.flag_ratio)
+        stages.append(stage)
+
+    return {
+        'extractor': fex_name,
+        'frames': frames,
+        'frames_per_s': frames / run_time,
+        'ns_per_pixel': 1e9 * run_time / (frames * pixels),
+        'model_gflops_per_frame': 1e-9 * pixels * modeled_opp,
+        'paper_gflops_per_frame': 1e-9 * pixels * model_opps[fex_name]() if fex_name in model_opps else None,
+        'measured_gflops_per_s': 1e-9 * pixels * modeled_opp * frames / modeled_time,
+        'stages': stages,
+    }
+
+
+def format_optional(val, fmt):
+    return format(val, fmt) if val is not None else ''
+
+
+def print_results(results, baseline):
+    # baseline maps (resolution, extractor, stage) to a previous time per frame, with stage None for the whole extractor
+    print('Resolution,Extractor,Frames/s,ns/pixel,Model GFLOPs/frame,Paper GFLOPs/frame,Measured GFLOP/s,Speedup vs baseline')
+    for result in results:
+        base_time = baseline.get((result['resolution'], result['extractor'], None))
+        speedup = format_optional(base_time * result['frames_per_s'] if base_time is not None else None, '.2f')
+        print(f'{result["resolution"]},{result["extractor"]},{result["frames_per_s"]:.3f},{result["ns_per_pixel"]:.2f},{result["model_gflops_per_frame"]:.4f},{format_optional(result["paper_gflops_per_frame"], ".4f")},{result["measured_gflops_per_s"]:.3f},{speedup}')
+
+    print()
+    print('Resolution,Extractor,Stage,Time per frame (ms),ns/pixel,Ops/pixel,FLOP share,Time share,Cost ratio,Flag,Speedup vs baseline')
+    for result in results:
+        for stage in result['stages']:
+            base_time = baseline.get((result['resolution'], result['extractor'], stage['stage']))
+            speedup = format_optional(base_time / stage['time_per_frame_ms'] if base_time is not None else None, '.2f')
+            print(
+                f'{result["resolution"]},{result["extractor"]},{stage["stage"]},{stage["time_per_frame_ms"]:.3f},{stage["ns_per_pixel"]:.3f},'
+                f'{format_optional(stage["ops_per_pixel"], ".3f")},{format_optional(stage["flop_share"], ".3f")},{format_optional(stage["time_share"], ".3f")},'
+                f'{format_optional(stage["cost_ratio"], ".2f")},{"SLOW" if stage["flagged"] else ""},{speedup}'
+            )
+
+
+def load_baseline(path):
+    if path is None:
+        return {}
+    with open(path, 'r') as baseline_file:
+        results = json.load(baseline_file)['results']
+    baseline = {}
+    for result in results:
+        baseline[(result['resolution'], result['extractor'], None)] = 1 / result['frames_per_s']
+        for stage in result['stages']:
+            baseline[(result['resolution'], result['extractor'], stage['stage'])] = stage['time_per_frame_ms']
+    return baseline
+
+
+def get_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description='Measure the throughput of each stage of FUNQUE-family extractors on synthetic videos and compare it to the analytical FLOP model')
+    parser.add_argument('--fex_names', help='Names of the feature extractors to benchmark', type=str, nargs='+', default=['FUNQUE_fex', 'Y_FUNQUE_Plus_fex', 'FS_Y_FUNQUE_Plus_fex', '3C_FUNQUE_Plus_fex', 'FS_3C_FUNQUE_Plus_fex'])
+    parser.add_argument('--resolutions', help='Resolutions of the synthetic videos', type=str, nargs='+', choices=list(resolutions), default=list(resolutions))
+    parser.add_argument('--frames', help='Number of frames in each synthetic video', type=int, default=5)
+    parser.add_argument('--precision', help='Precision of the extractors', type=str, default='float64')
+    parser.add_argument('--repeats', help='Number of timed runs per extractor (minimum is reported)', type=int, default=3)
+    parser.add_argument('--flag_ratio', help='Flag stages whose share of time is this many times their share of ops', type=float, default=2.0)
+    parser.add_argument('--seed', help='Seed for the synthetic videos', type=int, default=0)
+    parser.add_argument('--out_file', help='Path to output JSON file containing results. (Optional)', type=str, default=None)
+    parser.add_argument('--baseline_file', help='Path to a JSON file from a previous run to compare against. (Optional)', type=str, default=None)
+    return parser
+
+
+def main():
+    args = get_parser().parse_args()
+    rng = np.random.default_rng(args.seed)
+    baseline = load_baseline(args.baseline_file)
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for resolution in args.resolutions:
+            height, width = resolutions[resolution]
+            asset_dict = {
+                'ref_path': os.path.join(tmp_dir, f'ref_{resolution}.yuv'), 'dis_path': os.path.join(tmp_dir, f'dis_{resolution}.yuv'),
+                'ref_standard': get_standard('sRGB'), 'dis_standard': get_standard('sRGB'),
+                'width': width, 'height': height, 'chroma_format': '420',
+            }
+            write_video_pair(asset_dict['ref_path'], asset_dict['dis_path'], (height, width), args.frames, rng)
+            for fex_name in args.fex_names:
+                results.append({'resolution': resolution, **benchmark_extractor(fex_name, asset_dict, args)})
+
+    print_results(results, baseline)
+
+    flagged = [f'{result["resolution"]} {result["extractor"]} {stage["stage"]}' for result in results for stage in result['stages'] if stage['flagged']]
+    if flagged:
+        print()
+        print(f'Stages costing more than {args.flag_ratio}x their FLOP share: {", ".join(flagged)}')
+
+    if args.out_file is not None:
+        with open(args.out_file, 'w') as out_file:
+            json.dump({
+                'python': platform.python_version(), 'numpy': np.__version__, 'machine': platform.machine(), 'processor': platform.processor(),
+                'args': vars(args), 'results': results,
+            }, out_file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
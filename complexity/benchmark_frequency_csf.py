@@ -0,0 +1,60 @@
+import argparse
+import time
+
+import numpy as np
+
+from funque_plus.features.funque_atoms import filter_utils
+from funque_plus.features.funque_atoms.filter_utils import FrequencyFilter, frequency_csf_matrix, frequency_filter_keys
+
+
+# Full complex FFT previously used by filter_utils.filter_img, rebuilding the CSF on every call. Kept here as the reference implementation.
+def complex_filter(img, filter_key, channel=0):
+    csf_mat = frequency_csf_matrix(filter_key, img.shape, channel)
+    return np.real(np.fft.ifft2(np.fft.ifftshift(np.fft.fftshift(np.fft.fft2(img)) * csf_mat)))
+
+
+def time_funct(funct, repeats):
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        funct()
+        times.append(time.perf_counter() - start)
+    return np.min(times)
+
+
+def get_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description='Compare the cached real-FFT CSF filter against per-frame complex FFT filtering')
+    parser.add_argument('--filter', help='Frequency-domain CSF', type=str, default='nadenau', choices=frequency_filter_keys)
+    parser.add_argument('--repeats', help='Number of timed runs per implementation (minimum is reported)', type=int, default=5)
+    parser.add_argument('--seed', help='Seed for the random test images', type=int, default=0)
+    return parser
+
+
+def main():
+    args = get_parser().parse_args()
+    rng = np.random.default_rng(args.seed)
+
+    sizes = {'540p': (540, 960), '1080p': (1080, 1920), '2160p': (2160, 3840)}
+    backends = ['numpy'] + (['pyfftw'] if filter_utils.pyfftw is not None else [])
+    pyfftw = filter_utils.pyfftw
+
+    print('Size,Method,Time (ms),Speedup,Max rel diff vs complex')
+    for size_name, shape in sizes.items():
+        img = rng.random(shape)
+        ref_filtered = complex_filter(img, args.filter)
+        complex_time = time_funct(lambda: complex_filter(img, args.filter), args.repeats)
+        print(f'{size_name},complex fft2,{1e3*complex_time:.3f},1.00,0')
+
+        for backend in backends:
+            filter_utils.pyfftw = pyfftw if backend == 'pyfftw' else None
+            start = time.perf_counter()
+            freq_filter = FrequencyFilter(args.filter, shape)
+            setup_time = time.perf_counter() - start
+            diff = np.max(np.abs(freq_filter(img) - ref_filtered)) / np.max(np.abs(ref_filtered))
+            filter_time = time_funct(lambda: freq_filter(img), args.repeats)
+            print(f'{size_name},rfft2 ({backend}; setup {1e3*setup_time:.0f} ms),{1e3*filter_time:.3f},{complex_time/filter_time:.2f},{diff:.3e}')
+        filter_utils.pyfftw = pyfftw
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+import argparse
+import time
+import tracemalloc
+
+import numpy as np
+from scipy import ndimage
+
+from funque_plus.features.funque_atoms.gsm_utils import gsm_model, im2col
+
+
+# im2col-based model previously used by gsm_utils.gsm_model. Kept here as the reference implementation.
+def im2col_gsm_model(y, M):
+    tol = 1e-15
+    y_size = (int(y.shape[0]/M)*M, int(y.shape[1]/M)*M)
+    y = y[:y_size[0], :y_size[1]]
+
+    y_vecs = im2col(y, M, 1)
+    cov = np.cov(y_vecs)
+    lamda, V = np.linalg.eigh(cov)
+    lamda[lamda < tol] = tol
+    cov = V@np.diag(lamda)@V.T
+
+    y_vecs = im2col(y, M, M)
+
+    s = np.linalg.inv(cov)@y_vecs
+    s = np.sum(s * y_vecs, 0)/(M*M)
+    s = np.clip(s.reshape((int(y_size[0]/M), int(y_size[1]/M))), tol, None)
+
+    return s, lamda, cov
+
+
+def time_funct(funct, repeats):
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        funct()
+        times.append(time.perf_counter() - start)
+    return np.min(times)
+
+
+def peak_memory(funct):
+    tracemalloc.start()
+    funct()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+
+def get_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description='Compare the batched, shifted-product GSM model against the im2col-based model')
+    parser.add_argument('--block_sizes', help='Neighbourhood sizes to test', type=int, nargs='+', default=[3, 5])
+    parser.add_argument('--repeats', help='Number of timed runs per implementation (minimum is reported)', type=int, default=3)
+    parser.add_argument('--seed', help='Seed for the random test images', type=int, default=0)
+    return parser
+
+
+def main():
+    args = get_parser().parse_args()
+    rng = np.random.default_rng(args.seed)
+
+    # Subbands of SAST-downscaled and full-scale frames, and full-scale frames, as modelled by Ens-VMAF
+    sizes = {'270p': (270, 480), '540p': (540, 960), '1080p': (1080, 1920)}
+
+    print('Size,Block size,Method,Time (ms),Speedup,Peak memory (MB),Max rel diff of s vs im2col')
+    for size_name, shape in sizes.items():
+        # Two smooth subbands (e.g., H and V), since GSM models are used on correlated data
+        ys = np.stack([ndimage.gaussian_filter(rng.standard_normal(shape), 1) for _ in range(2)])
+        for block_size in args.block_sizes:
+            ref_s = [im2col_gsm_model(y, block_size)[0] for y in ys]
+            im2col_time = time_funct(lambda: [im2col_gsm_model(y, block_size) for y in ys], args.repeats)
+            im2col_peak = peak_memory(lambda: [im2col_gsm_model(y, block_size) for y in ys])
+            print(f'{size_name},{block_size},im2col (2 subbands),{1e3*im2col_time:.3f},1.00,{im2col_peak/2**20:.1f},0')
+
+            s = gsm_model(ys, block_size)[0]
+            diff = max([np.max(np.abs(s[i] - ref_s[i])) / np.max(ref_s[i]) for i in range(len(ys))])
+            batch_time = time_funct(lambda: gsm_model(ys, block_size), args.repeats)
+            batch_peak = peak_memory(lambda: gsm_model(ys, block_size))
+            print(f'{size_name},{block_size},batched (stack of 2),{1e3*batch_time:.3f},{im2col_time/batch_time:.2f},{batch_peak/2**20:.1f},{diff:.3e}')
+
+
+if __name__ == '__main__':
+    main()
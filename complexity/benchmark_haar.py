@@ -0,0 +1,81 @@
+import argparse
+import time
+
+import numpy as np
+from pywt import dwt2
+
+from funque_plus.features.funque_atoms.haar_utils import haar_wavedec2, haar_wavedec2_approxs
+
+
+# Per-level pywt loop previously used by pyr_features.custom_wavedec2. Kept here as the reference implementation.
+def pywt_wavedec2(x, level):
+    approxs = []
+    details = []
+    for _ in range(level):
+        approx, detail = dwt2(x, 'haar', 'periodization')
+        approxs.append(approx)
+        details.append(detail)
+        x = approx
+    return approxs, details
+
+
+def max_abs_diff(pyr_a, pyr_b):
+    approxs_a, details_a = pyr_a
+    approxs_b, details_b = pyr_b
+    subbands_a = approxs_a + [subband for level in details_a for subband in level]
+    subbands_b = approxs_b + [subband for level in details_b for subband in level]
+    return max([np.max(np.abs(a - b)) for a, b in zip(subbands_a, subbands_b)])
+
+
+def time_funct(funct, repeats):
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        funct()
+        times.append(time.perf_counter() - start)
+    return np.min(times)
+
+
+def get_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description='Compare the batched Haar pyramid kernel against per-level pywt.dwt2 calls')
+    parser.add_argument('--levels', help='Number of pyramid levels', type=int, default=3)
+    parser.add_argument('--repeats', help='Number of timed runs per implementation (minimum is reported)', type=int, default=5)
+    parser.add_argument('--seed', help='Seed for the random test images', type=int, default=0)
+    return parser
+
+
+def main():
+    args = get_parser().parse_args()
+    rng = np.random.default_rng(args.seed)
+
+    sizes = {'540p': (536, 960), '1080p': (1080, 1920), '2160p': (2160, 3840)}
+
+    print('Size,Dtype,Method,Time (ms),Speedup,Max abs diff vs pywt')
+    for size_name, (height, width) in sizes.items():
+        # Cropped to a multiple of 2^levels, as in the FUNQUE extractors
+        shape = ((height >> args.levels) << args.levels, (width >> args.levels) << args.levels)
+        for dtype in ['float64', 'float32']:
+            x_ref = rng.random(shape).astype(dtype)
+            x_dis = rng.random(shape).astype(dtype)
+            x_stack = np.stack([x_ref, x_dis])
+
+            pywt_time = time_funct(lambda: (pywt_wavedec2(x_ref, args.levels), pywt_wavedec2(x_dis, args.levels)), args.repeats)
+            print(f'{size_name},{dtype},pywt (ref + dis),{1e3*pywt_time:.3f},1.00,0')
+
+            diff = max(max_abs_diff(haar_wavedec2(x_ref, args.levels), pywt_wavedec2(x_ref, args.levels)), max_abs_diff(haar_wavedec2(x_dis, args.levels), pywt_wavedec2(x_dis, args.levels)))
+            haar_time = time_funct(lambda: (haar_wavedec2(x_ref, args.levels), haar_wavedec2(x_dis, args.levels)), args.repeats)
+            print(f'{size_name},{dtype},haar (ref + dis),{1e3*haar_time:.3f},{pywt_time/haar_time:.2f},{diff:.3e}')
+
+            approxs_stack, details_stack = haar_wavedec2(x_stack, args.levels)
+            diff = max([max_abs_diff(([approx[i] for approx in approxs_stack], [tuple([subband[i] for subband in level]) for level in details_stack]), pywt_wavedec2(x, args.levels)) for i, x in enumerate([x_ref, x_dis])])
+            stack_time = time_funct(lambda: haar_wavedec2(x_stack, args.levels), args.repeats)
+            print(f'{size_name},{dtype},haar (stacked),{1e3*stack_time:.3f},{pywt_time/stack_time:.2f},{diff:.3e}')
+
+            pywt_approx_time = time_funct(lambda: (pywt_wavedec2(x_ref, args.levels)[0], pywt_wavedec2(x_dis, args.levels)[0]), args.repeats)
+            diff = max([np.max(np.abs(a - b)) for a, b in zip(haar_wavedec2_approxs(x_ref, args.levels), pywt_wavedec2(x_ref, args.levels)[0])])
+            approx_time = time_funct(lambda: (haar_wavedec2_approxs(x_ref, args.levels), haar_wavedec2_approxs(x_dis, args.levels)), args.repeats)
+            print(f'{size_name},{dtype},haar approxs only (ref + dis),{1e3*approx_time:.3f},{pywt_approx_time/approx_time:.2f},{diff:.3e}')
+
+
+if __name__ == '__main__':
+    main()
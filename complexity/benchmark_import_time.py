@@ -0,0 +1,76 @@
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+
+# Startup of extract_features.py before the lazy registry: every extractor module was imported to expose extractors to get_fex.
+eager_code = '''
+import funque_plus.feature_extractors.baseline_feature_extractors
+import funque_plus.feature_extractors.funque_feature_extractors
+from funque_plus.feature_extractors import get_fex
+get_fex({fex_name!r})
+'''
+
+lazy_code = '''
+from funque_plus.feature_extractors import get_fex
+get_fex({fex_name!r})
+'''
+
+
+def run_python(code):
+    # Runs code in a fresh interpreter that can import funque_plus
+    repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([repo_dir] + [path for path in [os.environ.get('PYTHONPATH')] if path]))
+    return subprocess.run([sys.executable, '-c', code], env=env, capture_output=True, text=True)
+
+
+def time_startup(code, repeats):
+    # Minimum wall time of a fresh interpreter running code, or None and the error if it fails
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        proc = run_python(code)
+        times.append(time.perf_counter() - start)
+        if proc.returncode != 0:
+            return None, proc.stderr.strip().splitlines()[-1]
+    return np.min(times), None
+
+
+def count_modules(code):
+    proc = run_python(code + '\nimport sys\nprint(len(sys.modules))')
+    return int(proc.stdout.split()[-1]) if proc.returncode == 0 else None
+
+
+def get_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description='Compare the startup time of extract_features.py with lazy and eager imports of feature extractor modules')
+    parser.add_argument('--fex_name', help='Name of the requested feature extractor', type=str, default='Y_FUNQUE_Plus_fex')
+    parser.add_argument('--repeats', help='Number of timed interpreter launches per method (minimum is reported)', type=int, default=5)
+    return parser
+
+
+def main():
+    args = get_parser().parse_args()
+    codes = {
+        'interpreter only': 'pass',
+        'eager (all modules)': eager_code.format(fex_name=args.fex_name),
+        'lazy (registry)': lazy_code.format(fex_name=args.fex_name),
+    }
+
+    print(f'Feature extractor: {args.fex_name}')
+    print('Method,Time (ms),Modules loaded,Speedup vs eager')
+    results = {method: time_startup(code, args.repeats) for method, code in codes.items()}
+    eager_time, _ = results['eager (all modules)']
+    for method, (startup_time, error) in results.items():
+        if startup_time is None:
+            print(f'{method},failed ({error}),,')
+            continue
+        speedup = f'{eager_time/startup_time:.2f}' if eager_time is not None else ''
+        print(f'{method},{1e3*startup_time:.1f},{count_modules(codes[method])},{speedup}')
+
+
+if __name__ == '__main__':
+    main()
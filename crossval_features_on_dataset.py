@@ -10,11 +10,10 @@ from sklearn.svm import SVR
 from sklearn.preprocessing import MinMaxScaler
 
 from qualitylib.tools import import_python_file, read_dataset
-from qualitylib.feature_extractor import get_fex
 from qualitylib.runner import Runner
 from qualitylib.cross_validate import random_cross_validation
 
-from funque_plus.feature_extractors import *
+from funque_plus.feature_extractors import get_fex  # Imports only the module implementing the requested feature extractor
 
 np.random.seed(0)
 
@@ -1,10 +1,11 @@
 import os
 
-from qualitylib.feature_extractor import get_fex
 from qualitylib.tools import import_python_file
 
-from funque_plus.feature_extractors import *
+from funque_plus.feature_extractors import get_fex  # Imports only the module implementing the requested feature extractor
 from funque_plus.utils import get_standard
+from funque_plus.ref_cache import REF_CACHE_DIR_ENV
+from funque_plus.profiling import PROFILE_ENV, summarize_timings, save_timings
 
 import argparse
 
@@ -20,12 +21,20 @@ def get_parser() -> argparse.ArgumentParser:
     parser.add_argument('--width', help='Width of input video. Required for raw YUV videos.', type=int, default=None)
     parser.add_argument('--height', help='Width of input video. Required for raw YUV videos.', type=int, default=None)
     parser.add_argument('--framerate', help='Framerate of input video in FPS. Required for raw YUV videos.', type=int, default=None)
+    parser.add_argument('--chroma_format', help='Chroma subsampling of raw YUV videos. One of 420, 422 or 444.', type=str, default='420')
+    parser.add_argument('--frame_processes', help='Number of processes over which FUNQUE-family extractors split the frames of the video pair. (Optional)', type=int, default=1)
+    parser.add_argument('--ref_cache_dir', help='Directory in which FUNQUE-family extractors cache reference-side pyramids, shared across distorted videos. (Optional)', type=str, default=None)
+    parser.add_argument('--profile', help='Time the stages of each frame, and save the timings alongside out_file. (Optional)', action='store_true')
     parser.add_argument('--out_file', help='Path to output MAT file containing results. (Optional)', type=str, default=None)
     return parser
 
 
 def main():
     args = get_parser().parse_args()
+    if args.ref_cache_dir is not None:
+        os.environ[REF_CACHE_DIR_ENV] = args.ref_cache_dir
+    if args.profile:
+        os.environ[PROFILE_ENV] = '1'
     asset_dict = {}
     asset_dict['dataset_name'] = None
     asset_dict['ref_path'] = args.ref_video
@@ -38,6 +47,7 @@ def main():
     asset_dict['width'] = args.width
     asset_dict['height'] = args.height
     asset_dict['fps'] = args.framerate
+    asset_dict['chroma_format'] = args.chroma_format
     
     FexClass = get_fex(args.fex_name, args.fex_version)
 
@@ -50,6 +60,9 @@ def main():
         if hasattr(mod, 'kwargs'):
             fex_kwargs.update(mod.kwargs)
 
+    if args.frame_processes > 1:
+        fex_kwargs['frame_processes'] = args.frame_processes
+
     fex = FexClass(*fex_args, use_cache=False, **fex_kwargs)
     result = fex(asset_dict)
 
@@ -61,11 +74,18 @@ def main():
         for feat_val in result.agg_feats.flatten():
             print(f'{feat_val:.4f}')
 
+    stage_timings = getattr(result, 'stage_timings', None)
+    if stage_timings is not None:
+        print('Stage timings:')
+        print(summarize_timings(stage_timings))
+
     if args.out_file is not None:
         ext = os.path.splitext(args.out_file)[-1]
         if ext != 'mat':
             raise OSError(f'Invalid extension {ext}, expected \'mat\'')
         result.save(args.out_file)
+        if stage_timings is not None:
+            save_timings(stage_timings, os.path.splitext(args.out_file)[0] + '_timings.mat')
 
 
 if __name__ == '__main__':
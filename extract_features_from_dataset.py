@@ -1,31 +1,62 @@
+from typing import Any, Dict, List, Type
+
 import argparse
+import os
+import multiprocessing
 
 from qualitylib.tools import import_python_file, read_dataset
 from qualitylib.runner import Runner
-from qualitylib.feature_extractor import get_fex
 
-from funque_plus.feature_extractors import *  # Exposes user-defined feature extractors to get_fex
+from funque_plus.feature_extractors import get_fex  # Imports only the module implementing the requested feature extractor
+from funque_plus.feature_extractors.funque_pipeline import FunquePipelineMixin, SharedFunquePass
+from funque_plus.ref_cache import REF_CACHE_DIR_ENV
+
+# Feature extractors of a worker process that share one pass over each video pair
+_shared_fexs = []
 
 
 def get_parser() -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser(description='Run feature extractors and store results')
     parser.add_argument('--dataset', help='Path to dataset file for which to extract features', type=str)
-    parser.add_argument('--fex_name', help='Name of feature extractor', type=str)
+    parser.add_argument('--fex_name', help='Name(s) of feature extractor(s). FUNQUE-family extractors share one pass over each video pair.', type=str, nargs='+')
     parser.add_argument('--fex_version', help='Version of feature extractor', type=str, default=None)
     parser.add_argument('--processes', help='Number of parallel processes', type=str, default=1)
+    parser.add_argument('--ref_cache_dir', help='Directory in which FUNQUE-family extractors cache reference-side pyramids, shared across distorted videos. (Optional)', type=str, default=None)
     return parser
 
 
+def _init_shared_worker(fex_classes: List[Type]) -> None:
+    _shared_fexs.extend([FexClass(use_cache=True) for FexClass in fex_classes])
+    SharedFunquePass(_shared_fexs)
+
+
+def _run_shared_worker(asset_dict: Dict[str, Any]) -> None:
+    for fex in _shared_fexs:
+        fex(asset_dict)  # Reads from stored results if available, else stores results.
+
+
 def main() -> None:
     args = get_parser().parse_args()
+    if args.ref_cache_dir is not None:
+        os.environ[REF_CACHE_DIR_ENV] = args.ref_cache_dir  # Inherited by the Runner's worker processes
 
     dataset = import_python_file(args.dataset)
     assets = read_dataset(dataset, shuffle=True)
 
-    FexClass = get_fex(args.fex_name, args.fex_version)
-    runner = Runner(FexClass, processes=args.processes, use_cache=True)  # Reads from stored results if available, else stores results.
-    runner(assets, return_results=False)  # Only extract features, do not use for anything.
+    FexClasses = [get_fex(fex_name, args.fex_version) for fex_name in args.fex_name]
+    shared_classes = [FexClass for FexClass in FexClasses if issubclass(FexClass, FunquePipelineMixin)]
+    if len(shared_classes) > 1:
+        with multiprocessing.Pool(int(args.processes), initializer=_init_shared_worker, initargs=(shared_classes,)) as pool:
+            for _ in pool.imap_unordered(_run_shared_worker, assets):
+                pass
+    else:
+        shared_classes = []
+
+    for FexClass in FexClasses:
+        if FexClass not in shared_classes:
+            runner = Runner(FexClass, processes=args.processes, use_cache=True)  # Reads from stored results if available, else stores results.
+            runner(assets, return_results=False)  # Only extract features, do not use for anything.
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
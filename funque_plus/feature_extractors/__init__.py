@@ -1,2 +1,76 @@
-from .baseline_feature_extractors import *
-from .funque_feature_extractors import *
\ No newline at end of file
+from typing import List, Optional, Type
+
+import importlib
+
+from qualitylib.feature_extractor import FeatureExtractor
+from qualitylib.feature_extractor import get_fex as get_imported_fex
+
+# Modules implementing each feature extractor, by NAME. A module is only imported when one of its extractors is requested,
+# so that extractors neither pay for nor require the dependencies of others (e.g., skimage, skvideo or torch).
+fex_modules = {
+    'FUNQUE_fex': 'funque_feature_extractors',
+    'Y_FUNQUE_Plus_fex': 'funque_feature_extractors',
+    'FS_Y_FUNQUE_Plus_fex': 'funque_feature_extractors',
+    '3C_FUNQUE_Plus_fex': 'funque_feature_extractors',
+    'FS_3C_FUNQUE_Plus_fex': 'funque_feature_extractors',
+    'SSIM_fex': 'baseline_feature_extractors',
+    'PSNR_fex': 'baseline_feature_extractors',
+    'FSIM_fex': 'baseline_feature_extractors',
+    'STVMAF_fex': 'baseline_feature_extractors',
+    'MS_SSIM_fex': 'baseline_feature_extractors',
+    'EnsVMAF_M1_fex': 'baseline_feature_extractors',
+    'EnsVMAF_fex': 'baseline_feature_extractors',
+    'VMAF_fex': 'baseline_feature_extractors',
+    'EnhVMAF_M1_fex': 'baseline_feature_extractors',
+    'EnhVMAF_M2_fex': 'baseline_feature_extractors',
+    'EnhVMAF_fex': 'baseline_feature_extractors',
+    'LPIPS_fex': 'baseline_deep_feature_extractors',
+    'DISTS_fex': 'baseline_deep_feature_extractors',
+    'DeepWSD_fex': 'baseline_deep_feature_extractors',
+}
+
+# Modules defining each extractor class, so that classes can still be imported from this package.
+_class_modules = {
+    'FunqueFeatureExtractor': 'funque_feature_extractors',
+    'YFunquePlusFeatureExtractor': 'funque_feature_extractors',
+    'FullScaleYFunquePlusFeatureExtractor': 'funque_feature_extractors',
+    'ThreeChannelFunquePlusFeatureExtractor': 'funque_feature_extractors',
+    'FullScaleThreeChannelFunquePlusFeatureExtractor': 'funque_feature_extractors',
+    'SsimFeatureExtractor': 'baseline_feature_extractors',
+    'PsnrFeatureExtractor': 'baseline_feature_extractors',
+    'FsimFeatureExtractor': 'baseline_feature_extractors',
+    'StVmafFeatureExtractor': 'baseline_feature_extractors',
+    'MsSsimFeatureExtractor': 'baseline_feature_extractors',
+    'EnsVmafM1FeatureExtractor': 'baseline_feature_extractors',
+    'EnsVmafM2FeatureExtractor': 'baseline_feature_extractors',
+    'EnsVmafFeatureExtractor': 'baseline_feature_extractors',
+    'VmafFeatureExtractor': 'baseline_feature_extractors',
+    'EnhVmafM1FeatureExtractor': 'baseline_feature_extractors',
+    'EnhVmafM2FeatureExtractor': 'baseline_feature_extractors',
+    'EnhVmafFeatureExtractor': 'baseline_feature_extractors',
+    'LpipsFeatureExtractor': 'baseline_deep_feature_extractors',
+    'DistsFeatureExtractor': 'baseline_deep_feature_extractors',
+    'DeepWsdFeatureExtractor': 'baseline_deep_feature_extractors',
+}
+
+__all__ = ['fex_modules', 'get_fex']
+
+
+def get_fex(name: str, version: Optional[str] = None) -> Type[FeatureExtractor]:
+    '''
+    Feature extractor class with the given NAME (and VERSION, if given). Only the module implementing it is imported.
+    Extractors that are not in fex_modules (e.g., defined by the caller) are looked up among those already imported.
+    '''
+    if name in fex_modules:
+        importlib.import_module(f'.{fex_modules[name]}', __name__)
+    return get_imported_fex(name, version)
+
+
+def __getattr__(name: str) -> Type[FeatureExtractor]:
+    if name in _class_modules:
+        return getattr(importlib.import_module(f'.{_class_modules[name]}', __name__), name)
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
+def __dir__() -> List[str]:
+    return sorted(list(globals()) + list(_class_modules))
@@ -11,6 +11,7 @@ from qualitylib.result import Result
 import lpips
 import DISTS_pytorch
 from ..features.baseline_atoms import DeepWSD
+from ..profiling import StageTimer, profiling_enabled
 
 
 class LpipsFeatureExtractor(FeatureExtractor):
@@ -25,6 +26,7 @@ class LpipsFeatureExtractor(FeatureExtractor):
 
     def _run_on_asset(self, asset_dict: Dict[str, Any]) -> Result:
         sample_interval = self._get_sample_interval(asset_dict)
+        timer = StageTimer(profiling_enabled())
         feats_dict = {key: [] for key in self.feat_names}
         with torch.no_grad():
             with Video(
@@ -40,7 +42,7 @@ class LpipsFeatureExtractor(FeatureExtractor):
                     batch_ref_list = []
                     batch_dis_list = []
                     lpips_vals = np.empty((0,), dtype='float64')
-                    for frame_ind, (frame_ref, frame_dis) in enumerate(zip(v_ref, v_dis)):
+                    for frame_ind, (frame_ref, frame_dis) in timer.frames(zip(v_ref, v_dis)):
                         if frame_ind % sample_interval == 0:
                             batch_ref_list.append(np.transpose(2*frame_ref.rgb/v_ref.standard.range - 1, (2, 0, 1)))
                             batch_dis_list.append(np.transpose(2*frame_dis.rgb/v_dis.standard.range - 1, (2, 0, 1)))
@@ -54,7 +56,7 @@ class LpipsFeatureExtractor(FeatureExtractor):
                             lpips_vals = np.concatenate([lpips_vals, dist.squeeze().cpu()])
 
         print(f'Processed {asset_dict["dis_path"]}')
-        return self._to_result(asset_dict, feats=np.expand_dims(lpips_vals, -1), feat_names=self.feat_names)
+        return timer.attach(self._to_result(asset_dict, feats=np.expand_dims(lpips_vals, -1), feat_names=self.feat_names))
 
 
 class DistsFeatureExtractor(FeatureExtractor):
@@ -69,6 +71,7 @@ class DistsFeatureExtractor(FeatureExtractor):
 
     def _run_on_asset(self, asset_dict: Dict[str, Any]) -> Result:
         sample_interval = self._get_sample_interval(asset_dict)
+        timer = StageTimer(profiling_enabled())
         feats_dict = {key: [] for key in self.feat_names}
         with torch.no_grad():
             with Video(
@@ -84,7 +87,7 @@ class DistsFeatureExtractor(FeatureExtractor):
                     batch_ref_list = []
                     batch_dis_list = []
                     dists_vals = np.empty((0,), dtype='float64')
-                    for frame_ind, (frame_ref, frame_dis) in enumerate(zip(v_ref, v_dis)):
+                    for frame_ind, (frame_ref, frame_dis) in timer.frames(zip(v_ref, v_dis)):
                         if frame_ind % sample_interval == 0:
                             # batch_ref_list.append(DISTS_pytorch.DISTS_pt.prepare_image(Image.fromarray(np.dtype(v_ref.standard.dtype).type(frame_ref.rgb))))
                             # batch_dis_list.append(DISTS_pytorch.DISTS_pt.prepare_image(Image.fromarray(np.dtype(v_dis.standard.dtype).type(frame_dis.rgb))))
@@ -100,7 +103,7 @@ class DistsFeatureExtractor(FeatureExtractor):
                             dists_vals = np.concatenate([dists_vals, dist.squeeze().cpu().numpy()])
 
         print(f'Processed {asset_dict["dis_path"]}')
-        return self._to_result(asset_dict, feats=np.expand_dims(dists_vals, -1), feat_names=self.feat_names)
+        return timer.attach(self._to_result(asset_dict, feats=np.expand_dims(dists_vals, -1), feat_names=self.feat_names))
 
 
 class DeepWsdFeatureExtractor(FeatureExtractor):
@@ -116,6 +119,7 @@ class DeepWsdFeatureExtractor(FeatureExtractor):
 
     def _run_on_asset(self, asset_dict: Dict[str, Any]) -> Result:
         sample_interval = self._get_sample_interval(asset_dict)
+        timer = StageTimer(profiling_enabled())
         feats_dict = {key: [] for key in self.feat_names}
         with torch.no_grad():
             with Video(
@@ -132,7 +136,7 @@ class DeepWsdFeatureExtractor(FeatureExtractor):
                     batch_dis_list = []
                     # wsds_vals = np.empty((0,), dtype='float64')
                     wsds_vals = []
-                    for frame_ind, (frame_ref, frame_dis) in enumerate(zip(v_ref, v_dis)):
+                    for frame_ind, (frame_ref, frame_dis) in timer.frames(zip(v_ref, v_dis)):
                         if frame_ind % sample_interval == 0:
                             # batch_ref_list.append(DeepWSD.prepare_image(Image.fromarray(np.dtype(v_ref.standard.dtype).type(frame_ref.rgb))))
                             # batch_dis_list.append(DeepWSD.prepare_image(Image.fromarray(np.dtype(v_dis.standard.dtype).type(frame_dis.rgb))))
@@ -150,4 +154,4 @@ class DeepWsdFeatureExtractor(FeatureExtractor):
                             # wsds_vals = np.concatenate([wsds_vals, [wsd.squeeze().cpu().item()]])
 
         print(f'Processed {asset_dict["dis_path"]}')
-        return self._to_result(asset_dict, feats=np.expand_dims(wsds_vals, -1), feat_names=self.feat_names)
+        return timer.attach(self._to_result(asset_dict, feats=np.expand_dims(wsds_vals, -1), feat_names=self.feat_names))
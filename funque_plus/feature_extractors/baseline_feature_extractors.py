@@ -11,6 +11,7 @@ from skvideo import measure
 from image_similarity_measures import quality_metrics
 from ..features.baseline_atoms import vmaf_features, ens_vmaf_features, evmaf_features, flow_utils
 from ..features.funque_atoms import pyr_features
+from ..profiling import StageTimer, profiling_enabled
 
 
 class SsimFeatureExtractor(FeatureExtractor):
@@ -23,6 +24,7 @@ class SsimFeatureExtractor(FeatureExtractor):
 
     def _run_on_asset(self, asset_dict: Dict[str, Any]) -> Result:
         sample_interval = self._get_sample_interval(asset_dict)
+        timer = StageTimer(profiling_enabled())
         feats_dict = {key: [] for key in self.feat_names}
         with Video(
             asset_dict['ref_path'], mode='r',
@@ -34,7 +36,7 @@ class SsimFeatureExtractor(FeatureExtractor):
                 standard=asset_dict['dis_standard'],
                 width=asset_dict['width'], height=asset_dict['height']
             ) as v_dis:
-                for frame_ind, (frame_ref, frame_dis) in enumerate(zip(v_ref, v_dis)):
+                for frame_ind, (frame_ref, frame_dis) in timer.frames(zip(v_ref, v_dis)):
                     if frame_ind % sample_interval:
                         continue
                     ssim = metrics.structural_similarity(frame_ref.yuv[..., 0], frame_dis.yuv[..., 0], win_size=11, gaussian_weights=True, data_range=1)
@@ -42,7 +44,7 @@ class SsimFeatureExtractor(FeatureExtractor):
 
         feats = np.array(list(feats_dict.values())).T
         print(f'Processed {asset_dict["dis_path"]}')
-        return self._to_result(asset_dict, feats, list(feats_dict.keys()))
+        return timer.attach(self._to_result(asset_dict, feats, list(feats_dict.keys())))
 
 
 class PsnrFeatureExtractor(FeatureExtractor):
@@ -55,6 +57,7 @@ class PsnrFeatureExtractor(FeatureExtractor):
 
     def _run_on_asset(self, asset_dict: Dict[str, Any]) -> Result:
         sample_interval = self._get_sample_interval(asset_dict)
+        timer = StageTimer(profiling_enabled())
         feats_dict = {key: [] for key in self.feat_names}
         with Video(
             asset_dict['ref_path'], mode='r',
@@ -66,7 +69,7 @@ class PsnrFeatureExtractor(FeatureExtractor):
                 standard=asset_dict['dis_standard'],
                 width=asset_dict['width'], height=asset_dict['height']
             ) as v_dis:
-                for frame_ind, (frame_ref, frame_dis) in enumerate(zip(v_ref, v_dis)):
+                for frame_ind, (frame_ref, frame_dis) in timer.frames(zip(v_ref, v_dis)):
                     if frame_ind % sample_interval:
                         continue
                     psnr = -10*np.log10(np.mean((frame_ref.yuv[..., 0] - frame_dis.yuv[..., 0])**2))
@@ -76,7 +79,7 @@ class PsnrFeatureExtractor(FeatureExtractor):
 
         feats = np.array(list(feats_dict.values())).T
         print(f'Processed {asset_dict["dis_path"]}')
-        return self._to_result(asset_dict, feats, list(feats_dict.keys()))
+        return timer.attach(self._to_result(asset_dict, feats, list(feats_dict.keys())))
 
 
 class FsimFeatureExtractor(FeatureExtractor):
@@ -89,6 +92,7 @@ class FsimFeatureExtractor(FeatureExtractor):
 
     def _run_on_asset(self, asset_dict: Dict[str, Any]) -> Result:
         sample_interval = self._get_sample_interval(asset_dict)
+        timer = StageTimer(profiling_enabled())
         feats_dict = {key: [] for key in self.feat_names}
         with Video(
             asset_dict['ref_path'], mode='r',
@@ -100,7 +104,7 @@ class FsimFeatureExtractor(FeatureExtractor):
                 standard=asset_dict['dis_standard'],
                 width=asset_dict['width'], height=asset_dict['height']
             ) as v_dis:
-                for frame_ind, (frame_ref, frame_dis) in enumerate(zip(v_ref, v_dis)):
+                for frame_ind, (frame_ref, frame_dis) in timer.frames(zip(v_ref, v_dis)):
                     if frame_ind % sample_interval:
                         continue
                     fsim = quality_metrics.fsim(frame_ref.yuv[..., :1], frame_dis[..., :1])
@@ -108,7 +112,7 @@ class FsimFeatureExtractor(FeatureExtractor):
 
         feats = np.array(list(feats_dict.values())).T
         print(f'Processed {asset_dict["dis_path"]}')
-        return self._to_result(asset_dict, feats, list(feats_dict.keys()))
+        return timer.attach(self._to_result(asset_dict, feats, list(feats_dict.keys())))
 
 
 class StVmafFeatureExtractor(FeatureExtractor):
@@ -135,6 +139,7 @@ class StVmafFeatureExtractor(FeatureExtractor):
 
     def _run_on_asset(self, asset_dict: Dict[str, Any]) -> Result:
         sample_interval = self._get_sample_interval(asset_dict)
+        timer = StageTimer(profiling_enabled())
         feats_dict = {key: [] for key in self.feat_names}
         with Video(
             asset_dict['ref_path'], mode='r',
@@ -148,7 +153,7 @@ class StVmafFeatureExtractor(FeatureExtractor):
             ) as v_dis:
                 y_scales_ref_prev = [None, None, None, None]
                 y_scales_dis_prev = [None, None, None, None]
-                for frame_ind, (frame_ref, frame_dis) in enumerate(zip(v_ref, v_dis)):
+                for frame_ind, (frame_ref, frame_dis) in timer.frames(zip(v_ref, v_dis)):
                     if frame_ind % sample_interval:
                         continue
 
@@ -192,7 +197,7 @@ class StVmafFeatureExtractor(FeatureExtractor):
 
         feats = np.array(list(feats_dict.values())).T
         print(f'Processed {asset_dict["dis_path"]}')
-        return self._to_result(asset_dict, feats, list(feats_dict.keys()))
+        return timer.attach(self._to_result(asset_dict, feats, list(feats_dict.keys())))
 
 
 class MsSsimFeatureExtractor(FeatureExtractor):
@@ -205,6 +210,7 @@ class MsSsimFeatureExtractor(FeatureExtractor):
 
     def _run_on_asset(self, asset_dict: Dict[str, Any]) -> Result:
         sample_interval = self._get_sample_interval(asset_dict)
+        timer = StageTimer(profiling_enabled())
         feats_dict = {key: [] for key in self.feat_names}
         with Video(
             asset_dict['ref_path'], mode='r',
@@ -216,7 +222,7 @@ class MsSsimFeatureExtractor(FeatureExtractor):
                 standard=asset_dict['dis_standard'],
                 width=asset_dict['width'], height=asset_dict['height']
             ) as v_dis:
-                for frame_ind, (frame_ref, frame_dis) in enumerate(zip(v_ref, v_dis)):
+                for frame_ind, (frame_ref, frame_dis) in timer.frames(zip(v_ref, v_dis)):
                     if frame_ind % sample_interval:
                         continue
                     ms_ssim = measure.msssim(frame_ref.yuv[..., :1], frame_dis[..., :1])
@@ -224,7 +230,7 @@ class MsSsimFeatureExtractor(FeatureExtractor):
 
         feats = np.array(list(feats_dict.values())).T
         print(f'Processed {asset_dict["dis_path"]}')
-        return self._to_result(asset_dict, feats, list(feats_dict.keys()))
+        return timer.attach(self._to_result(asset_dict, feats, list(feats_dict.keys())))
 
 
 class EnsVmafM1FeatureExtractor(FeatureExtractor):
@@ -249,6 +255,7 @@ class EnsVmafM1FeatureExtractor(FeatureExtractor):
 
     def _run_on_asset(self, asset_dict: Dict[str, Any]) -> Result:
         sample_interval = self._get_sample_interval(asset_dict)
+        timer = StageTimer(profiling_enabled())
         feats_dict = {key: [] for key in self.feat_names}
         with Video(
             asset_dict['ref_path'], mode='r',
@@ -261,7 +268,7 @@ class EnsVmafM1FeatureExtractor(FeatureExtractor):
                 width=asset_dict['width'], height=asset_dict['height']
             ) as v_dis:
                 y_scales_ref_prev = [None, None, None, None]
-                for frame_ind, (frame_ref, frame_dis) in enumerate(zip(v_ref, v_dis)):
+                for frame_ind, (frame_ref, frame_dis) in timer.frames(zip(v_ref, v_dis)):
                     y_scale_ref = frame_ref.yuv[..., 0].copy()
                     y_scale_dis = frame_dis.yuv[..., 0].copy()
 
@@ -303,7 +310,7 @@ class EnsVmafM1FeatureExtractor(FeatureExtractor):
 
         feats = np.array(list(feats_dict.values())).T
         print(f'Processed {asset_dict["dis_path"]}')
-        return self._to_result(asset_dict, feats, list(feats_dict.keys()))
+        return timer.attach(self._to_result(asset_dict, feats, list(feats_dict.keys())))
 
 
 class EnsVmafM2FeatureExtractor(FeatureExtractor):
@@ -328,6 +335,7 @@ class EnsVmafM2FeatureExtractor(FeatureExtractor):
 
     def _run_on_asset(self, asset_dict: Dict[str, Any]) -> Result:
         sample_interval = self._get_sample_interval(asset_dict)
+        timer = StageTimer(profiling_enabled())
         feats_dict = {key: [] for key in self.feat_names}
         with Video(
             asset_dict['ref_path'], mode='r',
@@ -341,7 +349,7 @@ class EnsVmafM2FeatureExtractor(FeatureExtractor):
             ) as v_dis:
                 y_scales_ref_prev = [None, None, None, None]
                 y_scales_dis_prev = [None, None, None, None]
-                for frame_ind, (frame_ref, frame_dis) in enumerate(zip(v_ref, v_dis)):
+                for frame_ind, (frame_ref, frame_dis) in timer.frames(zip(v_ref, v_dis)):
                     y_scale_ref = frame_ref.yuv[..., 0].copy()
                     y_scale_dis = frame_dis.yuv[..., 0].copy()
 
@@ -374,7 +382,7 @@ class EnsVmafM2FeatureExtractor(FeatureExtractor):
 
         feats = np.array(list(feats_dict.values())).T
         print(f'Processed {asset_dict["dis_path"]}')
-        return self._to_result(asset_dict, feats, list(feats_dict.keys()))
+        return timer.attach(self._to_result(asset_dict, feats, list(feats_dict.keys())))
 
 
 class EnsVmafFeatureExtractor(FeatureExtractor):
@@ -401,6 +409,7 @@ class EnsVmafFeatureExtractor(FeatureExtractor):
 
     def _run_on_asset(self, asset_dict: Dict[str, Any]) -> Result:
         sample_interval = self._get_sample_interval(asset_dict)
+        timer = StageTimer(profiling_enabled())
         feats_dict = {key: [] for key in self.feat_names}
         with Video(
             asset_dict['ref_path'], mode='r',
@@ -414,7 +423,7 @@ class EnsVmafFeatureExtractor(FeatureExtractor):
             ) as v_dis:
                 y_scales_ref_prev = [None, None, None, None]
                 y_scales_dis_prev = [None, None, None, None]
-                for frame_ind, (frame_ref, frame_dis) in enumerate(zip(v_ref, v_dis)):
+                for frame_ind, (frame_ref, frame_dis) in timer.frames(zip(v_ref, v_dis)):
                     y_scale_ref = frame_ref.yuv[..., 0].copy()
                     y_scale_dis = frame_dis.yuv[..., 0].copy()
 
@@ -464,7 +473,7 @@ class EnsVmafFeatureExtractor(FeatureExtractor):
 
         feats = np.array(list(feats_dict.values())).T
         print(f'Processed {asset_dict["dis_path"]}')
-        return self._to_result(asset_dict, feats, list(feats_dict.keys()))
+        return timer.attach(self._to_result(asset_dict, feats, list(feats_dict.keys())))
 
 
 class VmafFeatureExtractor(FeatureExtractor):
@@ -489,6 +498,7 @@ class VmafFeatureExtractor(FeatureExtractor):
 
     def _run_on_asset(self, asset_dict: Dict[str, Any]) -> Result:
         sample_interval = self._get_sample_interval(asset_dict)
+        timer = StageTimer(profiling_enabled())
         feats_dict = {key: [] for key in self.feat_names}
         with Video(
             asset_dict['ref_path'], mode='r',
@@ -501,7 +511,7 @@ class VmafFeatureExtractor(FeatureExtractor):
                 width=asset_dict['width'], height=asset_dict['height']
             ) as v_dis:
                 y_ref_prev = None
-                for frame_ind, (frame_ref, frame_dis) in enumerate(zip(v_ref, v_dis)):
+                for frame_ind, (frame_ref, frame_dis) in timer.frames(zip(v_ref, v_dis)):
                     if frame_ind % sample_interval:
                         y_ref_prev = frame_ref.yuv[..., 0]
                         continue
@@ -538,7 +548,7 @@ class VmafFeatureExtractor(FeatureExtractor):
 
         feats = np.array(list(feats_dict.values())).T
         print(f'Processed {asset_dict["dis_path"]}')
-        return self._to_result(asset_dict, feats, list(feats_dict.keys()))
+        return timer.attach(self._to_result(asset_dict, feats, list(feats_dict.keys())))
 
 
 class EnhVmafM1FeatureExtractor(FeatureExtractor):
@@ -563,6 +573,7 @@ class EnhVmafM1FeatureExtractor(FeatureExtractor):
 
     def _run_on_asset(self, asset_dict: Dict[str, Any]) -> Result:
         sample_interval = self._get_sample_interval(asset_dict)
+        timer = StageTimer(profiling_enabled())
         feats_dict = {key: [] for key in self.feat_names}
         with Video(
             asset_dict['ref_path'], mode='r',
@@ -576,7 +587,7 @@ class EnhVmafM1FeatureExtractor(FeatureExtractor):
             ) as v_dis:
                 y_scales_ref_prev = [None, None, None, None]
 
-                for frame_ind, (frame_ref, frame_dis) in enumerate(zip(v_ref, v_dis)):
+                for frame_ind, (frame_ref, frame_dis) in timer.frames(zip(v_ref, v_dis)):
                     y_scale_ref = frame_ref.yuv[..., 0].copy()
                     y_scale_dis = frame_dis.yuv[..., 0].copy()
 
@@ -631,7 +642,7 @@ class EnhVmafM1FeatureExtractor(FeatureExtractor):
 
         feats = np.array(list(feats_dict.values())).T
         print(f'Processed {asset_dict["dis_path"]}')
-        return self._to_result(asset_dict, feats, list(feats_dict.keys()))
+        return timer.attach(self._to_result(asset_dict, feats, list(feats_dict.keys())))
 
 
 class EnhVmafM2FeatureExtractor(FeatureExtractor):
@@ -656,6 +667,7 @@ class EnhVmafM2FeatureExtractor(FeatureExtractor):
 
     def _run_on_asset(self, asset_dict: Dict[str, Any]) -> Result:
         sample_interval = self._get_sample_interval(asset_dict)
+        timer = StageTimer(profiling_enabled())
         feats_dict = {key: [] for key in self.feat_names}
         with Video(
             asset_dict['ref_path'], mode='r',
@@ -671,7 +683,7 @@ class EnhVmafM2FeatureExtractor(FeatureExtractor):
                 u_scale_ref_prev = None
                 u_scale_dis_prev = None
 
-                for frame_ind, (frame_ref, frame_dis) in enumerate(zip(v_ref, v_dis)):
+                for frame_ind, (frame_ref, frame_dis) in timer.frames(zip(v_ref, v_dis)):
                     y_scale_ref = frame_ref.yuv[..., 0].copy()
                     y_scale_dis = frame_dis.yuv[..., 0].copy()
 
@@ -760,7 +772,7 @@ class EnhVmafM2FeatureExtractor(FeatureExtractor):
 
         feats = np.array(list(feats_dict.values())).T
         print(f'Processed {asset_dict["dis_path"]}')
-        return self._to_result(asset_dict, feats, list(feats_dict.keys()))
+        return timer.attach(self._to_result(asset_dict, feats, list(feats_dict.keys())))
 
 
 class EnhVmafFeatureExtractor(FeatureExtractor):
@@ -786,6 +798,7 @@ class EnhVmafFeatureExtractor(FeatureExtractor):
 
     def _run_on_asset(self, asset_dict: Dict[str, Any]) -> Result:
         sample_interval = self._get_sample_interval(asset_dict)
+        timer = StageTimer(profiling_enabled())
         feats_dict = {key: [] for key in self.feat_names}
         with Video(
             asset_dict['ref_path'], mode='r',
@@ -801,7 +814,7 @@ class EnhVmafFeatureExtractor(FeatureExtractor):
                 u_scale_ref_prev = None
                 u_scale_dis_prev = None
 
-                for frame_ind, (frame_ref, frame_dis) in enumerate(zip(v_ref, v_dis)):
+                for frame_ind, (frame_ref, frame_dis) in timer.frames(zip(v_ref, v_dis)):
                     y_scale_ref = frame_ref.yuv[..., 0].copy()
                     y_scale_dis = frame_dis.yuv[..., 0].copy()
 
@@ -900,4 +913,4 @@ class EnhVmafFeatureExtractor(FeatureExtractor):
 
         feats = np.array(list(feats_dict.values())).T
         print(f'Processed {asset_dict["dis_path"]}')
-        return self._to_result(asset_dict, feats, list(feats_dict.keys()))
+        return timer.attach(self._to_result(asset_dict, feats, list(feats_dict.keys())))
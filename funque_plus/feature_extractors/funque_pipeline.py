@@ -0,0 +1,829 @@
+from typing import Dict, Any, Iterator, List, Optional, Tuple, Union
+import os
+import itertools
+import multiprocessing
+
+from videolib import Video, standards
+from qualitylib.result import Result
+
+import numpy as np
+import cv2
+from ..features.funque_atoms import pyr_features, vif_utils, filter_utils, rred_utils, pool_utils
+from ..ref_cache import RefPyramidCache, REF_CACHE_DIR_ENV
+from ..prefetch import Prefetcher
+from ..yuv_reader import YuvReader, YuvFrame, infer_chroma_format
+from ..profiling import StageTimer, profiling_enabled, stage
+
+
+_channel_inds = {'y': 0, 'u': 1, 'v': 2}
+
+# Precisions in which the pipeline may run. In float32 mode, summed-area tables, local variances and pooled sums stay in float64.
+precisions = ['float64', 'float32']
+
+
+def _frame_schedule(frame_ind: int, sample_interval: int) -> Tuple[bool, bool]:
+    '''
+    Returns whether features are computed at this frame, and whether the next frame is,
+    in which case temporal features of the next frame need (some of) this frame's pyramids.
+    '''
+    return frame_ind % sample_interval == 0, (frame_ind + 1) % sample_interval == 0
+
+
+class FrameMemo(dict):
+    '''
+    Intermediates of one pair of frames that are shared by several pipelines (see run_pipelines), keyed by the identity of
+    the frame or channel they are computed from and by how they are computed: resized channels, preprocessed channels and pyramids.
+    Must be dropped before the next frame is read, since keys hold object ids.
+    '''
+    def lookup(self, key: Tuple, funct):
+        if key not in self:
+            self[key] = funct()
+        return self[key]
+
+
+class FunqueTransform:
+    '''
+    Declares how frames are turned into wavelet pyramids: optional SAST (downscaling by 2), cropping, CSF filtering and
+    a periodized wavelet decomposition of each channel.
+    csf_stage is 'image' for CSFs that filter the channel before the decomposition (filter_img),
+    and 'pyramid' for CSFs that weight the detail subbands after it (filter_pyr).
+    dtype is one of precisions. Atoms follow the dtype of the pyramids.
+    If native_chroma is True, chroma channels are read from 4:2:0 YuvFrames at their native resolution instead of being upsampled.
+    With SAST, the native plane takes the place of the SAST-downscaled channel. Without SAST, it takes the place of the first
+    approximation subband, so only levels-1 levels are computed and the first level of the pyramid has no detail subbands (None).
+    Spatial CSFs applied to the image filter reference and distorted channels as one stack, using csf_threads threads.
+    '''
+    def __init__(self, csf: Optional[str], csf_stage: str, wavelet: str = 'haar', levels: int = 1, sast: bool = True, channels: Tuple[str, ...] = ('y',), dtype: str = 'float64', native_chroma: bool = False, csf_threads: int = 1) -> None:
+        if csf_stage not in ['image', 'pyramid']:
+            raise ValueError('csf_stage must be one of \'image\' or \'pyramid\'')
+        if dtype not in precisions:
+            raise ValueError(f'Invalid precision {dtype}. Must be one of {precisions}')
+        if native_chroma and not sast and (csf_stage == 'image' or wavelet != 'haar'):
+            raise ValueError('Native chroma without SAST requires a Haar pyramid and a CSF applied to the pyramid')
+        self.csf = csf
+        self.csf_stage = csf_stage
+        self.wavelet = wavelet
+        self.levels = levels
+        self.sast = sast
+        self.channels = tuple(channels)
+        self.dtype = dtype
+        self.native_chroma = native_chroma
+        self.csf_threads = csf_threads
+        if csf_stage == 'pyramid' and csf is not None:
+            self.csf_plans = {
+                channel: filter_utils.get_csf_plan(csf, levels - self.skipped_levels(channel), _channel_inds[channel], self.skipped_levels(channel))
+                for channel in self.channels
+            }
+
+    def skipped_levels(self, channel: str) -> int:
+        '''
+        Number of leading pyramid levels of the channel that have no detail subbands.
+        '''
+        return int(self.native_chroma and not self.sast and channel != 'y')
+
+    def crop_shape(self, width: int, height: int) -> Tuple[int, int]:
+        # Cropping to a multiple of 2^levels (after SAST) to avoid problems in SSIM
+        shift = self.levels + 1 if self.sast else self.levels
+        return (height >> shift) << self.levels, (width >> shift) << self.levels
+
+    def pyramid_key(self, channel: str) -> Tuple:
+        # Transforms with equal keys compute equal pyramids from the same channel
+        return (self.csf, self.csf_stage, self.wavelet, self.levels, self.skipped_levels(channel), self.dtype, channel)
+
+    def read_channel(self, frame, channel: str, standard: standards.Standard, crop_shape: Tuple[int, int], memo: Optional[FrameMemo] = None) -> np.ndarray:
+        # Normalized, SAST-downscaled (if enabled) and cropped channel of a videolib Frame or a YuvFrame
+        if memo is not None:
+            key = ('channel', id(frame), channel, crop_shape, self.sast, self.native_chroma and channel != 'y', self.dtype)
+            return memo.lookup(key, lambda: self._read_channel(frame, channel, standard, crop_shape, memo))
+        return self._read_channel(frame, channel, standard, crop_shape)
+
+    def _resized_channel(self, frame, channel_ind: int, standard: standards.Standard) -> np.ndarray:
+        with stage('resize'):
+            if isinstance(frame, YuvFrame):
+                img = frame.full_plane(channel_ind)
+            else:
+                img = frame.yuv[..., channel_ind]
+            if self.sast:
+                img = cv2.resize(img.astype(standard.dtype), (frame.width//2, frame.height//2), interpolation=cv2.INTER_CUBIC)
+            return img
+
+    def _read_channel(self, frame, channel: str, standard: standards.Standard, crop_shape: Tuple[int, int], memo: Optional[FrameMemo] = None) -> np.ndarray:
+        channel_ind = _channel_inds[channel]
+        if self.native_chroma and channel != 'y':
+            if not isinstance(frame, YuvFrame) or frame.chroma_format != '420':
+                raise ValueError('Native chroma requires raw 4:2:0 videos, read using a YuvReader')
+            with stage('normalize'):
+                if self.sast:
+                    return np.divide(frame.plane(channel_ind)[:crop_shape[0], :crop_shape[1]], standard.range, dtype=self.dtype)
+                # The first Haar approximation subband of a plane upsampled by pixel repetition is twice the plane
+                img = np.divide(frame.plane(channel_ind)[:crop_shape[0]//2, :crop_shape[1]//2], standard.range, dtype=self.dtype)
+                img *= 2
+                return img
+        if memo is not None:
+            img = memo.lookup(('resized', id(frame), channel_ind, self.sast), lambda: self._resized_channel(frame, channel_ind, standard))
+        else:
+            img = self._resized_channel(frame, channel_ind, standard)
+        with stage('normalize'):
+            return np.divide(img[:crop_shape[0], :crop_shape[1]], standard.range, dtype=self.dtype)
+
+    def _filter_img(self, imgs, channel: str) -> np.ndarray:
+        # Image-stage CSF filtering of an image or, for spatial CSFs, of a list of images as one stack.
+        # Spatial CSFs write into a buffer that is reused by the next call, so the result must be consumed right away.
+        with stage('filter'):
+            if self.csf not in filter_utils.spatial_filter_keys:
+                return filter_utils.filter_img(imgs, self.csf, self.wavelet, channel=_channel_inds[channel]).astype(self.dtype, copy=False)
+            spatial_filter = filter_utils.get_spatial_filter(self.csf, self.csf_threads)
+            first_img = imgs[0] if isinstance(imgs, list) else imgs
+            shape = (len(imgs),) + first_img.shape if isinstance(imgs, list) else first_img.shape
+            return spatial_filter(imgs, out=spatial_filter.buffer('out', shape, first_img.dtype)).astype(self.dtype, copy=False)
+
+    def pyramids(self, imgs: List[np.ndarray], channel: str, memo: Optional[FrameMemo] = None) -> List[Tuple[List[np.ndarray], List[Tuple[np.ndarray, ...]]]]:
+        '''
+        Pyramids of several channels returned by read_channel (e.g. reference and distorted), filtered and decomposed as one stack
+        if the CSF is a spatial filter applied to the image.
+        '''
+        if memo is not None:
+            keys = [('pyramid', id(img)) + self.pyramid_key(channel) for img in imgs]
+            if not all([key in memo for key in keys]):
+                memo.update(zip(keys, self.pyramids(imgs, channel)))
+            return [memo[key] for key in keys]
+        if self.csf_stage != 'image' or self.csf not in filter_utils.spatial_filter_keys or len(set([(img.shape, img.dtype) for img in imgs])) != 1:
+            return [self.pyramid(img, channel) for img in imgs]
+        filt_imgs = self._filter_img(list(imgs), channel)
+        with stage('wavedec'):
+            approxs, details = pyr_features.custom_wavedec2(filt_imgs, self.wavelet, 'periodization', self.levels)
+        return [([approx[i] for approx in approxs], [tuple([subband[i] for subband in level]) for level in details]) for i in range(len(imgs))]
+
+    def pyramid(self, img: np.ndarray, channel: str, memo: Optional[FrameMemo] = None) -> Tuple[List[np.ndarray], List[Tuple[np.ndarray, ...]]]:
+        '''
+        Pyramid of a channel returned by read_channel.
+        '''
+        if memo is not None:
+            return memo.lookup(('pyramid', id(img)) + self.pyramid_key(channel), lambda: self.pyramid(img, channel))
+        skipped_levels = self.skipped_levels(channel)
+        if self.csf_stage == 'image':
+            img = self._filter_img(img, channel)
+        with stage('wavedec'):
+            pyr = pyr_features.custom_wavedec2(img, self.wavelet, 'periodization', self.levels - skipped_levels)
+        if self.csf_stage == 'pyramid' and self.csf is not None:
+            with stage('filter'):
+                pyr = filter_utils.filter_pyr(pyr, self.csf_plans[channel], in_place=True)
+        if skipped_levels:
+            pyr = ([img] + list(pyr[0]), [None] + list(pyr[1]))
+        return pyr
+
+    def approxs(self, img: np.ndarray, channel: str, levels: int, memo: Optional[FrameMemo] = None) -> List[np.ndarray]:
+        '''
+        Approximation subbands of the first levels of the pyramid. CSFs applied to the pyramid only weight detail subbands, so they are skipped.
+        '''
+        if memo is not None:
+            return memo.lookup(('approxs', id(img), levels) + self.pyramid_key(channel), lambda: self.approxs(img, channel, levels))
+        if self.skipped_levels(channel):
+            with stage('wavedec'):
+                return [img] + pyr_features.custom_wavedec2_approxs(img, self.wavelet, 'periodization', levels-1)
+        if self.csf_stage == 'image':
+            img = self._filter_img(img, channel)
+        with stage('wavedec'):
+            return pyr_features.custom_wavedec2_approxs(img, self.wavelet, 'periodization', levels)
+
+
+class FrameState:
+    '''
+    Reference and distorted pyramids of one frame, keyed by channel, along with the intermediates that are shared by atoms.
+    Intermediates are computed on first use and kept until the state is dropped.
+    Pyramids computed only to serve as the previous frame may have approximation subbands only, i.e. ([A1, ..., Ak], None).
+    '''
+    def __init__(self, pyrs_ref: Dict[str, Any], pyrs_dis: Dict[str, Any], prev: Optional['FrameState'] = None) -> None:
+        self._pyrs = {'ref': pyrs_ref, 'dis': pyrs_dis}
+        self.prev = prev
+        self._memo = {}
+
+    def _memoized(self, key: Tuple, funct):
+        if key not in self._memo:
+            self._memo[key] = funct()
+        return self._memo[key]
+
+    def pyr(self, side: str, channel: str, levels: Optional[int] = None) -> Tuple[List[np.ndarray], List[Tuple[np.ndarray, ...]]]:
+        approxs, details = self._pyrs[side][channel]
+        if levels is None:
+            return approxs, details
+        return approxs[:levels], details[:levels]
+
+    def approx(self, side: str, channel: str, lev: int) -> np.ndarray:
+        return self._pyrs[side][channel][0][lev]
+
+    def details(self, side: str, channel: str, lev: int) -> Tuple[np.ndarray, ...]:
+        return self._pyrs[side][channel][1][lev]
+
+    def rred_state(self, side: str, channel: str, lev: int, compute: bool = True) -> Optional[rred_utils.RredState]:
+        # Also used by the next frame, to derive the statistics of the frame difference. None if not computed and compute is False.
+        key = ('rred_state', side, channel, lev)
+        if not compute and key not in self._memo:
+            return None
+        return self._memoized(key, lambda: rred_utils.RredState(self.details(side, channel, lev)))
+
+
+def _abs_diff(x: np.ndarray, y: np.ndarray) -> np.ndarray:
+    return np.abs(x - y)
+
+
+def _magnitude(subband_h: np.ndarray, subband_v: np.ndarray) -> np.ndarray:
+    # Gradient magnitude using the H and V subbands
+    return np.sqrt(subband_h**2 + subband_v**2)
+
+
+class Atom:
+    '''
+    A group of features computed from the pyramids of one channel.
+    prev_needs lists the (side, kind) pairs read from the previous frame, where kind is 'approx' for the approximation
+    subbands of the first self.levels levels, and 'pyr' for the full pyramid.
+    '''
+    prev_needs: Tuple[Tuple[str, str], ...] = ()
+
+    def __init__(self, channel: str, levels: int) -> None:
+        self.channel = channel
+        self.levels = levels
+
+    @property
+    def feat_names(self) -> List[str]:
+        raise NotImplementedError
+
+    @property
+    def stage_name(self) -> str:
+        # Name under which the atom is timed when profiling
+        return f'{type(self).__name__}:{self.channel}:{self.levels}'
+
+    def compute(self, state: FrameState) -> Dict[str, float]:
+        raise NotImplementedError
+
+
+class SsimAtom(Atom):
+    '''
+    SSIM computed from the first levels of the pyramid, pooled using the coefficient of variation.
+    '''
+    @property
+    def feat_names(self) -> List[str]:
+        return [f'ssim_cov_channel_{self.channel}_levels_{self.levels}']
+
+    def compute(self, state: FrameState) -> Dict[str, float]:
+        ssim_cov = pyr_features.ssim_pyr(state.pyr('ref', self.channel, self.levels), state.pyr('dis', self.channel, self.levels), pool='cov')
+        return {self.feat_names[0]: ssim_cov}
+
+
+class MsSsimAtom(Atom):
+    '''
+    MS-SSIM computed from the first levels of the pyramid, pooled using the coefficient of variation.
+    '''
+    @property
+    def feat_names(self) -> List[str]:
+        return [f'ms_ssim_cov_channel_{self.channel}_levels_{self.levels}']
+
+    def compute(self, state: FrameState) -> Dict[str, float]:
+        ms_ssim_cov_scales, _ = pyr_features.ms_ssim_pyr(state.pyr('ref', self.channel, self.levels), state.pyr('dis', self.channel, self.levels), pool='cov')
+        return {self.feat_names[0]: ms_ssim_cov_scales[-1]}
+
+
+class DlmAtom(Atom):
+    '''
+    DLM computed from the detail subbands of level self.levels.
+    '''
+    @property
+    def feat_names(self) -> List[str]:
+        return [f'dlm_channel_{self.channel}_scale_{self.levels}']
+
+    def compute(self, state: FrameState) -> Dict[str, float]:
+        lev = self.levels - 1
+        dlm_val = pyr_features.dlm_pyr((None, [state.details('ref', self.channel, lev)]), (None, [state.details('dis', self.channel, lev)]), csf=None)
+        return {self.feat_names[0]: dlm_val}
+
+
+class VifApproxAtom(Atom):
+    '''
+    Scalar VIF computed from the approximation subbands of each of the first levels.
+    '''
+    def __init__(self, channel: str, levels: int, sigma_nsq: float = 5, k: int = 9) -> None:
+        super().__init__(channel, levels)
+        self.sigma_nsq = sigma_nsq
+        self.k = k
+
+    @property
+    def feat_names(self) -> List[str]:
+        return [f'vif_approx_scalar_channel_{self.channel}_scale_{lev+1}' for lev in range(self.levels)]
+
+    def compute(self, state: FrameState) -> Dict[str, float]:
+        return {
+            feat_name: vif_utils.vif_spatial(state.approx('ref', self.channel, lev), state.approx('dis', self.channel, lev), sigma_nsq=self.sigma_nsq, k=self.k, full=False, dtype=state.approx('ref', self.channel, lev).dtype)
+            for lev, feat_name in enumerate(self.feat_names)
+        }
+
+
+class MadAtom(Atom):
+    '''
+    Mean absolute difference between the reference and distorted approximation subbands of level self.levels.
+    '''
+    @property
+    def feat_names(self) -> List[str]:
+        return [f'mad_channel_{self.channel}_scale_{self.levels}']
+
+    def compute(self, state: FrameState) -> Dict[str, float]:
+        lev = self.levels - 1
+        return {self.feat_names[0]: pool_utils.pool_stats(state.approx('ref', self.channel, lev), state.approx('dis', self.channel, lev), funct=_abs_diff).mean}
+
+
+class TemporalMadAtom(Atom):
+    '''
+    Mean absolute difference between consecutive approximation subbands of level self.levels of one side. Zero at the first frame.
+    '''
+    def __init__(self, channel: str, levels: int, side: str, prefix: Optional[str] = None) -> None:
+        super().__init__(channel, levels)
+        self.side = side
+        self.prefix = prefix if prefix is not None else f'mad_{side}'
+        self.prev_needs = ((side, 'approx'),)
+
+    @property
+    def feat_names(self) -> List[str]:
+        return [f'{self.prefix}_channel_{self.channel}_scale_{self.levels}']
+
+    def compute(self, state: FrameState) -> Dict[str, float]:
+        if state.prev is None:
+            return {self.feat_names[0]: 0}
+        lev = self.levels - 1
+        return {self.feat_names[0]: pool_utils.pool_stats(state.approx(self.side, self.channel, lev), state.prev.approx(self.side, self.channel, lev), funct=_abs_diff).mean}
+
+
+class StrredAtom(Atom):
+    '''
+    Scalar ST-RRED (on H and V subbands) of the first levels. outputs selects among 'srred', 'trred' and 'strred'. Zero at the first frame.
+    '''
+    prev_needs = (('ref', 'pyr'), ('dis', 'pyr'))
+    _output_inds = {'srred': 0, 'trred': 1, 'strred': 2}
+
+    def __init__(self, channel: str, levels: int, outputs: Tuple[str, ...] = ('srred', 'trred', 'strred')) -> None:
+        super().__init__(channel, levels)
+        self.outputs = tuple(outputs)
+
+    @property
+    def feat_names(self) -> List[str]:
+        return [f'{output}_scalar_channel_{self.channel}_levels_{self.levels}' for output in self.outputs]
+
+    def compute(self, state: FrameState) -> Dict[str, float]:
+        if state.prev is None:
+            return {feat_name: 0 for feat_name in self.feat_names}
+        # Levels without detail subbands (native chroma) contribute zero, but still count towards the average over levels
+        skipped_levels = sum([details is None for details in state.pyr('ref', self.channel, self.levels)[1]])
+        # Subband moments are kept in the frame state, so that the next frame derives its temporal terms from them.
+        # The previous frame only has them if it was scored.
+        levs = range(skipped_levels, self.levels)
+        rred_states = [[state.rred_state(side, self.channel, lev) for lev in levs] for side in ['ref', 'dis']]
+        prev_rred_states = [
+            [state.prev.rred_state(side, self.channel, lev, compute=False) or state.prev.details(side, self.channel, lev) for lev in levs]
+            for side in ['ref', 'dis']
+        ]
+        rred_scales = pyr_features.strred_hv_states(*rred_states, *prev_rred_states)
+        scale = (self.levels - skipped_levels) / self.levels
+        return {feat_name: rred_scales[self._output_inds[output]][-1] * scale for output, feat_name in zip(self.outputs, self.feat_names)}
+
+
+class SaiAtom(Atom):
+    '''
+    TLVQM-like spatial activity difference at level self.levels, using Haar H, V subbands in place of Sobel H, V.
+    '''
+    @property
+    def feat_names(self) -> List[str]:
+        return [f'sai_diff_channel_{self.channel}_scale_{self.levels}']
+
+    def compute(self, state: FrameState) -> Dict[str, float]:
+        lev = self.levels - 1
+        sai_ref = pool_utils.pool_stats(*state.details('ref', self.channel, lev)[:2], funct=_magnitude).std**0.25
+        sai_dis = pool_utils.pool_stats(*state.details('dis', self.channel, lev)[:2], funct=_magnitude).std**0.25
+        return {self.feat_names[0]: sai_ref - sai_dis}
+
+
+class BlurEdgeAtom(Atom):
+    '''
+    Blur or edge feature at level self.levels. against='ref' compares the reference to itself, as FS-3C-FUNQUE+ does.
+    '''
+    def __init__(self, channel: str, levels: int, mode: str, against: str = 'dis') -> None:
+        if mode not in ['blur', 'edge']:
+            raise ValueError('mode must be one of \'blur\' or \'edge\'')
+        super().__init__(channel, levels)
+        self.mode = mode
+        self.against = against
+
+    @property
+    def feat_names(self) -> List[str]:
+        return [f'{self.mode}_channel_{self.channel}_scale_{self.levels}']
+
+    def compute(self, state: FrameState) -> Dict[str, float]:
+        lev = self.levels - 1
+        [val] = pyr_features.blur_edge_pyr((None, [state.details('ref', self.channel, lev)]), (None, [state.details(self.against, self.channel, lev)]), mode=self.mode)
+        return {self.feat_names[0]: val}
+
+
+class FunquePipeline:
+    '''
+    Single-pass frame loop of a FUNQUE-family extractor, planned from its transform and atoms.
+    Every sampled frame is decomposed once per channel and side, and atoms share intermediates through a FrameState.
+    Frames that are not sampled are skipped, except those preceding a sampled frame, for which only what the atoms
+    read from the previous frame (prev_needs) is computed.
+    Reading and preprocessing frames overlaps with feature computation, using reader threads that keep up to prefetch_depth
+    frames (and, if given, up to prefetch_max_bytes bytes of preprocessed channels per video) ready ahead.
+    Raw .yuv files are read using a memory-mapped YuvReader if yuv_reader is True, and using videolib if it is False.
+    By default (None), the YuvReader is used if the transform only needs luma, which it reads without touching the chroma planes,
+    or if it reads native chroma.
+    '''
+    def __init__(self, transform: FunqueTransform, atoms: List[Atom], prefetch_depth: int = 2, prefetch_max_bytes: Optional[int] = None, yuv_reader: Optional[bool] = None) -> None:
+        self.transform = transform
+        self.atoms = list(atoms)
+        self.prefetch_depth = prefetch_depth
+        self.prefetch_max_bytes = prefetch_max_bytes
+        self.yuv_reader = yuv_reader
+        for atom in self.atoms:
+            if atom.channel not in transform.channels:
+                raise ValueError(f'Atom {type(atom).__name__} uses channel {atom.channel}, which is not in the transform')
+            if atom.levels > transform.levels:
+                raise ValueError(f'Atom {type(atom).__name__} uses {atom.levels} levels, but the transform has {transform.levels}')
+        self.feat_names = [feat_name for atom in self.atoms for feat_name in atom.feat_names]
+        self.prev_plan = self._plan_prev()
+        self._prev_channels = {side: [channel for channel, plan_side in self.prev_plan if plan_side == side] for side in ['ref', 'dis']}
+
+    def _plan_prev(self) -> Dict[Tuple[str, str], Any]:
+        # For each (channel, side), either 'pyr' or the number of approximation levels that atoms read from the previous frame.
+        prev_plan = {}
+        for atom in self.atoms:
+            for side, kind in atom.prev_needs:
+                key = (atom.channel, side)
+                if kind == 'pyr' or prev_plan.get(key) == 'pyr':
+                    prev_plan[key] = 'pyr'
+                else:
+                    prev_plan[key] = max(prev_plan.get(key, 0), atom.levels)
+        return prev_plan
+
+    def cache_config(self, fex_name: str, fex_version: str) -> Dict[str, Any]:
+        config = {
+            'fex_name': fex_name, 'fex_version': fex_version,
+            'csf': self.transform.csf, 'csf_stage': self.transform.csf_stage, 'wavelet': self.transform.wavelet,
+            'levels': self.transform.levels, 'sast': self.transform.sast, 'channels': list(self.transform.channels), 'dtype': self.transform.dtype,
+        }
+        # The YuvReader upsamples chroma differently from videolib
+        if self.yuv_reader is not None:
+            config['yuv_reader'] = self.yuv_reader
+        if self.transform.native_chroma:
+            config['native_chroma'] = True
+        return config
+
+    def _uses_yuv_reader(self, asset_dict: Dict[str, Any], side: str) -> bool:
+        use_yuv_reader = self.yuv_reader if self.yuv_reader is not None else self.transform.native_chroma or all([channel == 'y' for channel in self.transform.channels])
+        return use_yuv_reader and os.path.splitext(asset_dict[f'{side}_path'])[-1].lower() == '.yuv'
+
+    def _open_video(self, asset_dict: Dict[str, Any], side: str):
+        path = asset_dict[f'{side}_path']
+        if self._uses_yuv_reader(asset_dict, side):
+            return YuvReader(path, asset_dict['width'], asset_dict['height'], asset_dict[f'{side}_standard'], asset_dict.get('chroma_format', '420'))
+        return Video(
+            path, mode='r',
+            standard=asset_dict[f'{side}_standard'],
+            width=asset_dict['width'], height=asset_dict['height']
+        )
+
+    def _read_frames(self, video: Union[Video, YuvReader], side: str, standard: standards.Standard, crop_shape: Tuple[int, int], sample_interval: int, frame_range: Tuple[int, Optional[int]], ref_cache: Optional[RefPyramidCache], timer: StageTimer) -> Iterator[Tuple[int, Dict[str, np.ndarray], Optional[Dict[str, Any]]]]:
+        # Yields (frame_ind, imgs, cached_pyrs) for every frame that the main loop needs, in order. imgs holds the preprocessed
+        # channels needed from this side, unless the reference pyramids were found in the cache. Runs on a reader thread.
+        start, stop = frame_range
+        frames = iter(video)
+        for frame_ind in itertools.count():
+            if stop is not None and frame_ind >= stop:
+                break
+            try:
+                with timer.frame(frame_ind), stage('decode'):
+                    frame = next(frames)
+            except StopIteration:
+                break
+            if frame_ind < start - 1:
+                continue
+
+            channels = self.needed_channels(frame_ind, sample_interval, side, start)
+            if channels is None:
+                continue
+
+            with timer.frame(frame_ind):
+                # Reference-side work is shared by all distorted versions of a content
+                cached_pyrs = None
+                if side == 'ref' and ref_cache is not None and channels:
+                    with stage('cache'):
+                        cached_pyrs = ref_cache.get(frame_ind)
+                imgs = {channel: self.transform.read_channel(frame, channel, standard, crop_shape) for channel in channels} if cached_pyrs is None else {}
+            yield frame_ind, imgs, cached_pyrs
+
+    def needed_channels(self, frame_ind: int, sample_interval: int, side: str, start: int = 0) -> Optional[Tuple[str, ...]]:
+        '''
+        Channels of one side that are read at a frame: all channels if the frame is scored, those that temporal atoms read
+        from the previous frame if the next frame is scored, and None if the frame is not used.
+        '''
+        sampled, needed_as_prev = _frame_schedule(frame_ind, sample_interval)
+        if sampled and frame_ind >= start:
+            return self.transform.channels
+        elif needed_as_prev:
+            return tuple(self._prev_channels[side])
+        return None
+
+    def _sampled_state(self, frame_ind: int, imgs_ref: Dict[str, np.ndarray], imgs_dis: Dict[str, np.ndarray], cached_pyrs_ref: Optional[Dict[str, Any]], ref_cache: Optional[RefPyramidCache], prev: Optional[FrameState], memo: Optional[FrameMemo]) -> FrameState:
+        pyrs_ref = cached_pyrs_ref
+        if pyrs_ref is None:
+            pyrs_ref, pyrs_dis = {}, {}
+            for channel in self.transform.channels:
+                pyrs_ref[channel], pyrs_dis[channel] = self.transform.pyramids([imgs_ref[channel], imgs_dis[channel]], channel, memo)
+            if ref_cache is not None:
+                with stage('cache'):
+                    ref_cache.put(frame_ind, pyrs_ref)
+        else:
+            pyrs_dis = {channel: self.transform.pyramid(imgs_dis[channel], channel, memo) for channel in self.transform.channels}
+        return FrameState(pyrs_ref, pyrs_dis, prev)
+
+    def _prev_state(self, imgs_ref: Dict[str, np.ndarray], imgs_dis: Dict[str, np.ndarray], cached_pyrs_ref: Optional[Dict[str, Any]], memo: Optional[FrameMemo]) -> FrameState:
+        pyrs = {'ref': {}, 'dis': {}}
+        imgs = {'ref': imgs_ref, 'dis': imgs_dis}
+        for (channel, side), need in self.prev_plan.items():
+            if side == 'ref' and cached_pyrs_ref is not None:
+                pyrs[side][channel] = cached_pyrs_ref[channel]
+            elif need == 'pyr':
+                pyrs[side][channel] = self.transform.pyramid(imgs[side][channel], channel, memo)
+            else:
+                pyrs[side][channel] = (self.transform.approxs(imgs[side][channel], channel, need, memo), None)
+        return FrameState(pyrs['ref'], pyrs['dis'])
+
+    def step(self, frame_ind: int, imgs_ref: Dict[str, np.ndarray], imgs_dis: Dict[str, np.ndarray], prev_state: Optional[FrameState], score: bool, cached_pyrs_ref: Optional[Dict[str, Any]] = None, ref_cache: Optional[RefPyramidCache] = None, memo: Optional[FrameMemo] = None) -> Tuple[FrameState, Optional[Dict[str, float]]]:
+        '''
+        Processes one frame given its preprocessed channels (see needed_channels) and the state of the previous frame, if it was used.
+        Returns the state to pass to the next frame and, if score is True, the features of this frame.
+        Pyramids are shared with other pipelines processing the same frame through memo, if given.
+        '''
+        if not score:
+            return self._prev_state(imgs_ref, imgs_dis, cached_pyrs_ref, memo), None
+        state = self._sampled_state(frame_ind, imgs_ref, imgs_dis, cached_pyrs_ref, ref_cache, prev_state, memo)
+        feats = {}
+        for atom in self.atoms:
+            with stage(atom.stage_name):
+                feats.update(atom.compute(state))
+        # Only one frame of history is kept
+        state.prev = None
+        return state, feats
+
+    def run(self, asset_dict: Dict[str, Any], sample_interval: int, ref_cache: Optional[RefPyramidCache] = None, frame_range: Optional[Tuple[int, int]] = None, timer: Optional[StageTimer] = None) -> Dict[str, List[float]]:
+        '''
+        Returns the features of all sampled frames. If frame_range = (start, stop) is given, only frames in [start, stop) are scored,
+        and frame start-1 is only used as the previous frame of frame start.
+        Frames are read and preprocessed on one reader thread per video, unless prefetch_depth is 0.
+        Stages of each frame are timed by timer, if given and enabled.
+        '''
+        frame_range = frame_range if frame_range is not None else (0, None)
+        timer = timer if timer is not None else StageTimer(enabled=False)
+        feats_dict = {key: [] for key in self.feat_names}
+
+        with self._open_video(asset_dict, 'ref') as v_ref:
+            with self._open_video(asset_dict, 'dis') as v_dis:
+                crop_shape = self.transform.crop_shape(v_ref.width, v_ref.height)
+                ref_frames = self._read_frames(v_ref, 'ref', asset_dict['ref_standard'], crop_shape, sample_interval, frame_range, ref_cache, timer)
+                dis_frames = self._read_frames(v_dis, 'dis', asset_dict['dis_standard'], crop_shape, sample_interval, frame_range, None, timer)
+
+                with Prefetcher(ref_frames, self.prefetch_depth, self.prefetch_max_bytes, name='ref_reader') as ref_reader, \
+                        Prefetcher(dis_frames, self.prefetch_depth, self.prefetch_max_bytes, name='dis_reader') as dis_reader:
+                    prev_state = None
+                    for (frame_ind, imgs_ref, cached_pyrs_ref), (_, imgs_dis, _) in zip(ref_reader, dis_reader):
+                        sampled, _ = _frame_schedule(frame_ind, sample_interval)
+                        with timer.frame(frame_ind):
+                            prev_state, feats = self.step(frame_ind, imgs_ref, imgs_dis, prev_state, sampled and frame_ind >= frame_range[0], cached_pyrs_ref, ref_cache)
+                        if feats is not None:
+                            for key, val in feats.items():
+                                feats_dict[key].append(val)
+
+        return feats_dict
+
+    def _num_frames(self, asset_dict: Dict[str, Any]) -> int:
+        with self._open_video(asset_dict, 'ref') as v_ref:
+            with self._open_video(asset_dict, 'dis') as v_dis:
+                return min(v_ref.num_frames, v_dis.num_frames)
+
+    def _run_segment(self, asset_dict: Dict[str, Any], sample_interval: int, ref_cache: Optional[RefPyramidCache], frame_range: Tuple[int, int], profile: bool) -> Tuple[Dict[str, List[float]], List[Tuple]]:
+        # Runs in a worker process of run_parallel, returning the features and the timing records of a segment
+        timer = StageTimer(profile)
+        feats_dict = self.run(asset_dict, sample_interval, ref_cache, frame_range, timer)
+        timer.stop()
+        return feats_dict, timer.records
+
+    def run_parallel(self, asset_dict: Dict[str, Any], sample_interval: int, ref_cache: Optional[RefPyramidCache] = None, processes: int = 1, timer: Optional[StageTimer] = None) -> Dict[str, List[float]]:
+        '''
+        Splits the video pair into one temporal segment per process, runs the segments in a process pool and stitches their features.
+        Each segment also reads the frame preceding it, so that temporal features are the same as those of run().
+        Timing records of all segments are collected in timer, if given.
+        Must not be called from a daemonic process (e.g., a worker of a multiprocessing Pool).
+        '''
+        num_frames = self._num_frames(asset_dict)
+        bounds = [(num_frames * i) // processes for i in range(processes + 1)]
+        frame_ranges = [(bounds[i], bounds[i+1]) for i in range(processes) if bounds[i] < bounds[i+1]]
+        if len(frame_ranges) <= 1:
+            return self.run(asset_dict, sample_interval, ref_cache, timer=timer)
+
+        profile = timer is not None and timer.enabled
+        with multiprocessing.Pool(len(frame_ranges)) as pool:
+            segments = pool.starmap(self._run_segment, [(asset_dict, sample_interval, ref_cache, frame_range, profile) for frame_range in frame_ranges])
+        if profile:
+            for _, records in segments:
+                timer.records.extend(records)
+        return {key: [val for feats_dict, _ in segments for val in feats_dict[key]] for key in self.feat_names}
+
+
+def run_pipelines(pipelines: List[FunquePipeline], asset_dict: Dict[str, Any], sample_intervals: List[int], ref_caches: List[Optional[RefPyramidCache]], timers: Optional[List[StageTimer]] = None) -> List[Dict[str, List[float]]]:
+    '''
+    Same as calling run() of each pipeline, but making one pass over the video pair for all pipelines that read it in the same way
+    (see FunquePipeline._open_video). Channels and pyramids that several transforms compute in the same way are shared through a FrameMemo.
+    Frames are read on the calling thread. Each pipeline's stages are timed by its timer, if given. Shared work (including decoding)
+    is timed by the first pipeline that needs it.
+    '''
+    feats_dicts = [{key: [] for key in pipeline.feat_names} for pipeline in pipelines]
+    timers = timers if timers is not None else [StageTimer(enabled=False) for _ in pipelines]
+    groups = {}
+    for pipeline_ind, pipeline in enumerate(pipelines):
+        groups.setdefault((pipeline._uses_yuv_reader(asset_dict, 'ref'), pipeline._uses_yuv_reader(asset_dict, 'dis')), []).append(pipeline_ind)
+
+    for pipeline_inds in groups.values():
+        with pipelines[pipeline_inds[0]]._open_video(asset_dict, 'ref') as v_ref:
+            with pipelines[pipeline_inds[0]]._open_video(asset_dict, 'dis') as v_dis:
+                crop_shapes = {ind: pipelines[ind].transform.crop_shape(v_ref.width, v_ref.height) for ind in pipeline_inds}
+                prev_states = {ind: None for ind in pipeline_inds}
+                for frame_ind, (frame_ref, frame_dis) in timers[pipeline_inds[0]].frames(zip(v_ref, v_dis), body_stage=None):
+                    memo = FrameMemo()
+                    for ind in pipeline_inds:
+                        pipeline, sample_interval, ref_cache = pipelines[ind], sample_intervals[ind], ref_caches[ind]
+                        channels_ref = pipeline.needed_channels(frame_ind, sample_interval, 'ref')
+                        if channels_ref is None:
+                            continue
+                        with timers[ind].frame(frame_ind):
+                            cached_pyrs_ref = None
+                            if ref_cache is not None and channels_ref:
+                                with stage('cache'):
+                                    cached_pyrs_ref = ref_cache.get(frame_ind)
+                            imgs_ref = {} if cached_pyrs_ref is not None else \
+                                {channel: pipeline.transform.read_channel(frame_ref, channel, asset_dict['ref_standard'], crop_shapes[ind], memo) for channel in channels_ref}
+                            imgs_dis = {channel: pipeline.transform.read_channel(frame_dis, channel, asset_dict['dis_standard'], crop_shapes[ind], memo) for channel in pipeline.needed_channels(frame_ind, sample_interval, 'dis')}
+
+                            sampled, _ = _frame_schedule(frame_ind, sample_interval)
+                            prev_states[ind], feats = pipeline.step(frame_ind, imgs_ref, imgs_dis, prev_states[ind], sampled, cached_pyrs_ref, ref_cache, memo)
+                        if feats is not None:
+                            for key, val in feats.items():
+                                feats_dicts[ind][key].append(val)
+                    del memo
+
+    return feats_dicts
+
+
+class FunqueStreamScorer:
+    '''
+    Scores a video pair one frame at a time, e.g. as an encoder produces it, without reading video files.
+    Frames are NumPy arrays of code values of the respective standard: a (H, W) luma plane (for luma-only extractors),
+    a (H, W, 3) array of full-resolution Y, U and V (as in videolib Frame.yuv), or a (Y, U, V) tuple of planes whose chroma
+    subsampling is inferred from their shapes. All frames must have the same size.
+    Every sample_interval-th frame is scored. Only the state of the last used frame is kept, so memory does not grow with the video.
+    '''
+    def __init__(self, pipeline: FunquePipeline, ref_standard: standards.Standard, dis_standard: standards.Standard, sample_interval: int = 1) -> None:
+        self.pipeline = pipeline
+        self.standards = {'ref': ref_standard, 'dis': dis_standard}
+        self.sample_interval = sample_interval
+        self.feat_names = list(pipeline.feat_names)
+        self.reset()
+
+    def reset(self) -> None:
+        '''
+        Forgets all frames, so that the next frame is scored as the first frame of a new video.
+        '''
+        self.frame_ind = 0
+        self._prev_state = None
+        self._frame_shape = None
+        self._crop_shape = None
+
+    @staticmethod
+    def _as_frame(frame: Any) -> YuvFrame:
+        if isinstance(frame, YuvFrame):
+            return frame
+        if isinstance(frame, (tuple, list)):
+            planes = tuple([np.asarray(plane) for plane in frame])
+            return YuvFrame(planes, infer_chroma_format(planes[0].shape, planes[1].shape))
+        frame = np.asarray(frame)
+        if frame.ndim == 2:
+            return YuvFrame((frame, None, None), '444')
+        elif frame.ndim == 3 and frame.shape[-1] == 3:
+            return YuvFrame((frame[..., 0], frame[..., 1], frame[..., 2]), '444')
+        raise ValueError(f'Invalid frame of shape {frame.shape}. Expected a (H, W) or (H, W, 3) array, or a tuple of Y, U and V planes')
+
+    def _read(self, frame: YuvFrame, side: str, channels: Tuple[str, ...]) -> Dict[str, np.ndarray]:
+        if any([frame.plane(_channel_inds[channel]) is None for channel in channels]):
+            raise ValueError(f'Channels {channels} are needed, but the {side} frame only has a luma plane')
+        return {channel: self.pipeline.transform.read_channel(frame, channel, self.standards[side], self._crop_shape) for channel in channels}
+
+    def push(self, frame_ref: Any, frame_dis: Any) -> Optional[np.ndarray]:
+        '''
+        Processes the next pair of frames. Returns its features, ordered as feat_names, if the frame is scored, and None otherwise.
+        '''
+        frame_ref, frame_dis = self._as_frame(frame_ref), self._as_frame(frame_dis)
+        frame_shape = (frame_ref.height, frame_ref.width)
+        if self._frame_shape is None:
+            self._frame_shape = frame_shape
+            self._crop_shape = self.pipeline.transform.crop_shape(frame_ref.width, frame_ref.height)
+        if frame_shape != self._frame_shape or (frame_dis.height, frame_dis.width) != self._frame_shape:
+            raise ValueError(f'All frames must be of size {self._frame_shape}')
+
+        frame_ind = self.frame_ind
+        channels_ref = self.pipeline.needed_channels(frame_ind, self.sample_interval, 'ref')
+        if channels_ref is None:
+            self.frame_ind += 1
+            return None
+        imgs_ref = self._read(frame_ref, 'ref', channels_ref)
+        imgs_dis = self._read(frame_dis, 'dis', self.pipeline.needed_channels(frame_ind, self.sample_interval, 'dis'))
+
+        sampled, _ = _frame_schedule(frame_ind, self.sample_interval)
+        self._prev_state, feats = self.pipeline.step(frame_ind, imgs_ref, imgs_dis, self._prev_state, sampled)
+        self.frame_ind += 1
+        if feats is None:
+            return None
+        return np.array([feats[key] for key in self.feat_names])
+
+
+class SharedFunquePass:
+    '''
+    Computes the features of several FUNQUE-family extractors in one pass over each video pair (see run_pipelines).
+    The first extractor that is run on an asset computes the features of all extractors, which the others then return.
+    Only the features of the last asset are kept.
+    '''
+    def __init__(self, fexs: List[Any]) -> None:
+        self.fexs = list(fexs)
+        for fex in self.fexs:
+            fex.shared_pass = self
+        self._asset_key = None
+        self._feats_dicts = {}
+        self._timers = {}
+
+    def feats(self, fex: Any, asset_dict: Dict[str, Any]) -> Tuple[Dict[str, List[float]], StageTimer]:
+        '''
+        Features of fex on the asset, and the StageTimer of its stages.
+        '''
+        asset_key = (asset_dict['ref_path'], asset_dict['dis_path'])
+        if asset_key != self._asset_key or id(fex) not in self._feats_dicts:
+            timers = [StageTimer(profiling_enabled(member.profile)) for member in self.fexs]
+            feats_dicts = run_pipelines(
+                [member.pipeline for member in self.fexs], asset_dict,
+                [member._get_sample_interval(asset_dict) for member in self.fexs],
+                [RefPyramidCache.from_asset(member.ref_cache_dir, asset_dict, member.pipeline.cache_config(member.NAME, member.VERSION)) for member in self.fexs],
+                timers
+            )
+            self._asset_key = asset_key
+            self._feats_dicts = {id(member): feats_dict for member, feats_dict in zip(self.fexs, feats_dicts)}
+            self._timers = {id(member): timer for member, timer in zip(self.fexs, timers)}
+        return self._feats_dicts.pop(id(fex)), self._timers.pop(id(fex))
+
+
+class FunquePipelineMixin:
+    '''
+    Implements _run_on_asset for extractors that set self.pipeline (a FunquePipeline), self.ref_cache_dir and self.frame_processes.
+    Extractors store their options using _init_pipeline_options and build their pipeline using _make_pipeline.
+    Extractors that are part of a SharedFunquePass compute features through it, in a single process.
+    If self.profile (or, if it is None, the environment variable profiling.PROFILE_ENV) is set, the stages of each frame are timed
+    and the timings are stored in the result as stage_timings (see StageTimer.frame_table).
+    Must precede FeatureExtractor in the list of base classes.
+    '''
+    shared_pass = None
+    profile = None
+
+    def _init_pipeline_options(self, ref_cache_dir: Optional[str], precision: str, frame_processes: int, profile: Optional[bool], prefetch_depth: int, prefetch_max_mb: Optional[float], yuv_reader: Optional[bool]) -> None:
+        # Options shared by all FUNQUE-family extractors. ref_cache_dir defaults to the environment variable REF_CACHE_DIR_ENV.
+        self.ref_cache_dir = ref_cache_dir if ref_cache_dir is not None else os.environ.get(REF_CACHE_DIR_ENV)
+        self.precision = precision
+        self.frame_processes = frame_processes
+        self.profile = profile
+        self.prefetch_depth = prefetch_depth
+        self.prefetch_max_bytes = int(prefetch_max_mb * (1 << 20)) if prefetch_max_mb is not None else None
+        self.yuv_reader = yuv_reader
+
+    def _make_pipeline(self, transform: FunqueTransform, atoms: List[Atom]) -> FunquePipeline:
+        return FunquePipeline(transform, atoms, prefetch_depth=self.prefetch_depth, prefetch_max_bytes=self.prefetch_max_bytes, yuv_reader=self.yuv_reader)
+
+    def _run_on_asset(self, asset_dict: Dict[str, Any]) -> Result:
+        if self.shared_pass is not None:
+            feats_dict, timer = self.shared_pass.feats(self, asset_dict)
+        else:
+            timer = StageTimer(profiling_enabled(self.profile))
+            sample_interval = self._get_sample_interval(asset_dict)
+            ref_cache = RefPyramidCache.from_asset(self.ref_cache_dir, asset_dict, self.pipeline.cache_config(self.NAME, self.VERSION))
+            if self.frame_processes > 1:
+                feats_dict = self.pipeline.run_parallel(asset_dict, sample_interval, ref_cache, self.frame_processes, timer)
+            else:
+                feats_dict = self.pipeline.run(asset_dict, sample_interval, ref_cache, timer=timer)
+
+        feats = np.array([feats_dict[key] for key in self.feat_names]).T
+        print(f'Processed {asset_dict["dis_path"]}')
+        return timer.attach(self._to_result(asset_dict, feats, list(self.feat_names)))
+
+    def stream_scorer(self, ref_standard: standards.Standard, dis_standard: Optional[standards.Standard] = None, sample_interval: int = 1) -> FunqueStreamScorer:
+        '''
+        FunqueStreamScorer that computes this extractor's features from frames passed one at a time. dis_standard defaults to ref_standard.
+        '''
+        return FunqueStreamScorer(self.pipeline, ref_standard, dis_standard if dis_standard is not None else ref_standard, sample_interval)
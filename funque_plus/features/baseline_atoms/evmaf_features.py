@@ -40,9 +40,10 @@ def e_dlm_pyr(pyr_dtf, pyr_ref, pyr_dist, exps, border_size=0.2, csf='watson'):
 
     # Below this point, pyramids have the structure
     # [(H1, V1, D1), ..., (Hn, Vn, Dn)])]
+    # Decoupled subbands are not shared with the caller, so they are weighted in place
     _, details_ref = filter_pyr((None, details_ref), csf)
-    _, pyr_rest = filter_pyr((None, pyr_rest), csf)
-    _, pyr_add = filter_pyr((None, pyr_add), csf)
+    _, pyr_rest = filter_pyr((None, pyr_rest), csf, in_place=True)
+    _, pyr_add = filter_pyr((None, pyr_add), csf, in_place=True)
 
     dtfs = [np.sum(np.abs(np.stack(level_dtf, axis=-1)), -1) for level_dtf in pyr_dtf[1]]
     pyr_rest_masked_all = [new_dlm_contrast_mask_one_way(dtf, exps, level_add, level_rest) for level_rest, level_add, dtf in zip(pyr_rest, pyr_add, dtfs)]
@@ -86,9 +87,10 @@ def approx_e_dlm_pyr(pyr_dtf, pyr_ref, pyr_dist, exps, border_size=0.2, csf='wat
 
     # Below this point, pyramids have the structure
     # [(H1, V1, D1), ..., (Hn, Vn, Dn)])]
+    # Decoupled subbands are not shared with the caller, so they are weighted in place
     _, details_ref = filter_pyr((None, details_ref), csf)
-    _, pyr_rest = filter_pyr((None, pyr_rest), csf)
-    _, pyr_add = filter_pyr((None, pyr_add), csf)
+    _, pyr_rest = filter_pyr((None, pyr_rest), csf, in_place=True)
+    _, pyr_add = filter_pyr((None, pyr_add), csf, in_place=True)
 
     dtfs = [np.abs(dtf) for dtf in pyr_dtf[0]]
     pyr_rest_masked_all = [new_dlm_contrast_mask_one_way(dtf, exps, level_add, level_rest) for level_rest, level_add, dtf in zip(pyr_rest, pyr_add, dtfs)]
@@ -77,9 +77,10 @@ def dlm(img_ref, img_dist, wavelet='db2', border_size=0.2, csf='watson'):
     pyr_rest = (None, details_rest)
     pyr_add = (None, details_add)
 
-    pyr_ref = filter_pyr(pyr_ref, csf)[1]
-    pyr_rest = filter_pyr(pyr_rest, csf)[1]
-    pyr_add = filter_pyr(pyr_add, csf)[1]
+    # All pyramids are local to this function, so they are weighted in place
+    pyr_ref = filter_pyr(pyr_ref, csf, in_place=True)[1]
+    pyr_rest = filter_pyr(pyr_rest, csf, in_place=True)[1]
+    pyr_add = filter_pyr(pyr_add, csf, in_place=True)[1]
 
     pyr_rest = vmaf_dlm_contrast_mask_one_way(pyr_rest, pyr_add)
 
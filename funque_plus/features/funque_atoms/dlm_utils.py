@@ -1,20 +1,46 @@
 import numpy as np
-from .vif_utils import integral_image
+from .integral_utils import local_sums
 
 
 def integral_image_sums(x, k, stride=1):
-    x_pad = np.pad(x, int((k - stride)/2), mode='reflect')
-    int_x = integral_image(x_pad)
-    ret = (int_x[:-k:stride, :-k:stride] - int_x[:-k:stride, k::stride] - int_x[k::stride, :-k:stride] + int_x[k::stride, k::stride])
-    return ret
+    # Sums are accumulated in float64 and returned in the precision of x
+    return local_sums(x, k, stride).astype(np.result_type(x.dtype, np.float32), copy=False)
+
+
+tan_one_degree = float(np.tan(np.pi/180))
+
+
+def _angle_vectors(subband_h, subband_v, eps=1e-30):
+    # Vectors having the angles arctan(V / (H + eps)) (+ pi where H <= 0) used to decouple subbands, which only differ from (H, V)
+    # where -eps < H <= 0. There, the angle is that of (0, -V), or pi if V is also zero.
+    near_zero = (subband_h <= 0) & (subband_h > -eps)
+    if not near_zero.any():
+        return subband_h, subband_v
+    vec_h = subband_h.copy()
+    vec_h[near_zero] = np.where(subband_v[near_zero] == 0, -1, 0)
+    vec_v = subband_v.copy()
+    vec_v[near_zero] *= -1
+    return vec_h, vec_v
+
+
+def dlm_decouple_mask(level_ref, level_dist):
+    '''
+    Pixels where the angles of the (H, V) coefficients of the reference and distorted levels differ by less than one degree.
+    Angles are compared using cross and dot products instead of arctangents. Like the arctangent angles, which lie in (-pi/2, 3pi/2],
+    angles on either side of -pi/2 are not considered close.
+    '''
+    ref_h, ref_v = _angle_vectors(level_ref[0], level_ref[1])
+    dist_h, dist_v = _angle_vectors(level_dist[0], level_dist[1])
+    dot = ref_h*dist_h + ref_v*dist_v
+    cross = ref_h*dist_v - ref_v*dist_h
+    mask = (dot > 0) & (np.abs(cross) < tan_one_degree*dot)
+    mask &= ~(((level_ref[0] <= 0) != (level_dist[0] <= 0)) & (ref_v < 0))
+    return mask
 
 
 def dlm_decouple(level_ref, level_dist):
     eps = 1e-30
-    psi_ref = np.arctan(level_ref[1] / (level_ref[0] + eps)) + np.pi*(level_ref[0] <= 0)
-    psi_dist = np.arctan(level_dist[1] / (level_dist[0] + eps)) + np.pi*(level_dist[0] <= 0)
-    psi_diff = 180*np.abs(psi_ref - psi_dist)/np.pi
-    mask = (psi_diff < 1)
+    mask = dlm_decouple_mask(level_ref, level_dist)
 
     level_rest = []
     level_add = []
@@ -44,3 +70,61 @@ def dlm_contrast_mask(level_1, level_2):
     masked_level_2 = dlm_contrast_mask_one_way(level_1, level_2)
     masked_level_1 = dlm_contrast_mask_one_way(level_2, level_1)
     return masked_level_1, masked_level_2
+
+
+def dlm_level_sums(level_ref, level_dist, border_size=0.2, weights=None, tile_rows=64):
+    '''
+    Per-subband contributions to the numerator and denominator of DLM (as in dlm_pyr) of one level (H, V, D) of detail subbands.
+    Decoupling, weighting by weights (one per subband, if given), contrast masking of the restored subbands by the additive subbands
+    and cubic pooling are fused, and computed in blocks of tile_rows rows over the pooled region only (and a one-pixel halo).
+    Returns two lists of the cube roots of the pooled sums, for the restored and the reference subbands.
+    '''
+    eps = 1e-30
+    h, w = level_ref[0].shape
+    border_h = int(border_size*h)
+    border_w = int(border_size*w)
+    n_subbands = len(level_ref)
+    if border_h == 0 or border_w == 0 or h - 2*border_h <= 0 or w - 2*border_w <= 0:
+        return [0.0]*n_subbands, [0.0]*n_subbands  # Nothing is pooled
+
+    num_sums = np.zeros((n_subbands,))
+    den_sums = np.zeros((n_subbands,))
+    cols = slice(border_w - 1, w - border_w + 1)
+    for start in range(border_h, h - border_h, tile_rows):
+        stop = min(start + tile_rows, h - border_h)
+        rows = slice(start - 1, stop + 1)  # The halo is inside the level, since borders are at least one pixel wide
+        tile_ref = [subband[rows, cols] for subband in level_ref]
+        tile_dist = [subband[rows, cols] for subband in level_dist]
+        mask = dlm_decouple_mask(tile_ref, tile_dist)
+
+        masking_threshold = 0
+        tiles_rest = []
+        for sub, (subband_ref, subband_dist) in enumerate(zip(tile_ref, tile_dist)):
+            subband_rest = np.clip(subband_dist / (subband_ref + eps), 0.0, 1.0)
+            subband_rest *= subband_ref
+            np.copyto(subband_rest, subband_dist, where=mask)
+            subband_add = subband_dist - subband_rest
+            if weights is not None:
+                subband_rest *= weights[sub]
+                subband_add *= weights[sub]
+                subband_ref = subband_ref * weights[sub]
+            tiles_rest.append(subband_rest[1:-1, 1:-1])
+
+            masking_signal = np.abs(subband_add, out=subband_add)
+            masking_sums = masking_signal[:-2] + masking_signal[1:-1]
+            masking_sums += masking_signal[2:]
+            masking_sums = masking_sums[:, :-2] + masking_sums[:, 1:-1] + masking_sums[:, 2:]
+            masking_sums += masking_signal[1:-1, 1:-1]
+            masking_sums /= 30
+            masking_threshold += masking_sums
+
+            subband_ref = np.abs(subband_ref[1:-1, 1:-1])
+            den_sums[sub] += np.sum(subband_ref*subband_ref*subband_ref, dtype=np.float64)
+
+        for sub, subband_rest in enumerate(tiles_rest):
+            subband_rest = np.abs(subband_rest)
+            subband_rest -= masking_threshold
+            np.clip(subband_rest, 0, None, out=subband_rest)
+            num_sums[sub] += np.sum(subband_rest*subband_rest*subband_rest, dtype=np.float64)
+
+    return [np.power(num_sum, 1.0/3) for num_sum in num_sums], [np.power(den_sum, 1.0/3) for den_sum in den_sums]
@@ -1,59 +1,256 @@
+import functools
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
+try:
+    import pyfftw
+except ImportError:  # Filtering falls back to numpy.fft
+    pyfftw = None
 from scipy.ndimage import convolve1d
 from .csf_utils import csf_dict, ngan, nadenau, mannos
+from .workspace_utils import WorkspaceCache
 from pywt import wavedec2, waverec2
 
 
-def filter_pyr(pyr, csf_funct, channel=0):
+class CsfPlan:
+    '''
+    Weights of a wavelet-domain CSF for the H, V and D subbands of every level of a pyramid having n_levels levels.
+    Weights are evaluated once and cast once per dtype. level_offset is as in filter_pyr.
+    '''
+    def __init__(self, csf_funct, n_levels, channel=0, level_offset=0):
+        if isinstance(csf_funct, str):
+            csf_funct = csf_dict[csf_funct]
+        self.n_levels = n_levels
+        self.channel = channel
+        self.level_offset = level_offset
+        if csf_funct.__name__ != 'ahc_weight':
+            weights = [[csf_funct(lev+level_offset, sub+1, channel=channel) for sub in range(3)] for lev in range(n_levels)]
+        else:
+            weights = [[csf_funct(lev+level_offset, sub+1, n_levels+level_offset, channel=channel) for sub in range(3)] for lev in range(n_levels)]  # No approximation coefficient. Only H, V, D.
+        self.weights = np.array(weights, dtype=np.float64).reshape(n_levels, 3)
+        self._cast_weights = {}
+
+    def weights_as(self, dtype):
+        dtype = np.dtype(dtype)
+        if dtype not in self._cast_weights:
+            self._cast_weights[dtype] = self.weights.astype(dtype)  # Weights are cast to keep float32 pyramids in float32
+        return self._cast_weights[dtype]
+
+    def apply(self, details, in_place=False):
+        '''
+        Weighted detail subbands [(H1, V1, D1), ..., (Hn, Vn, Dn)]. If in_place, subbands are overwritten and returned.
+        '''
+        if len(details) != self.n_levels:
+            raise ValueError(f'CSF plan has {self.n_levels} levels, but the pyramid has {len(details)}')
+        filt_details = []
+        for lev, detail_level in enumerate(details):
+            filt_level = []
+            for sub, subband in enumerate(detail_level):
+                weight = self.weights_as(subband.dtype)[lev, sub]
+                filt_level.append(np.multiply(subband, weight, out=subband) if in_place else subband * weight)
+            filt_details.append(tuple(filt_level))
+        return filt_details
+
+
+@functools.lru_cache(maxsize=None)
+def get_csf_plan(csf_funct, n_levels, channel=0, level_offset=0):
+    '''
+    Shared CsfPlan for a CSF (name or function), number of levels, channel and level offset.
+    '''
+    return CsfPlan(csf_funct, n_levels, channel, level_offset)
+
+
+def filter_pyr(pyr, csf_funct, channel=0, level_offset=0, in_place=False):
+    '''
+    Weights detail subbands by the CSF, which may be a name, a function or a CsfPlan. level_offset is the number of finer levels
+    that are absent from pyr, e.g. 1 for the pyramid of a 4:2:0 chroma plane when weights are those of the full-resolution pyramid.
+    If in_place, detail subbands of pyr are overwritten.
+    '''
     if csf_funct is None:
         return pyr
-    elif isinstance(csf_funct, str):
-        csf_funct = csf_dict[csf_funct]
 
     approxs, details = pyr  # Do not filter approx subbands.
-    n_levels = len(details)
-    filt_details = []
-    for lev, detail_level in enumerate(details):
-        filt_level = []
-        for sub, subband in enumerate(detail_level):
-            if csf_funct.__name__ != 'ahc_weight':
-                filt_level.append(subband * csf_funct(lev, sub+1, channel=channel))
-            else:
-                filt_level.append(subband * csf_funct(lev, sub+1, n_levels, channel=channel))  # No approximation coefficient. Only H, V, D.
-        filt_details.append(tuple(filt_level))
-    return approxs, filt_details
+    plan = csf_funct if isinstance(csf_funct, CsfPlan) else get_csf_plan(csf_funct, len(details), channel, level_offset)
+    return approxs, plan.apply(details, in_place)
+
+
+frequency_filter_keys = ['ngan', 'ngan_rad', 'mannos', 'nadenau']
+
+
+def frequency_csf_matrix(filter_key, shape, channel=0):
+    '''
+    CSF of a frequency-domain filter, sampled on the centered (fftshift-ed) frequency grid of an image of the given shape.
+    '''
+    d2h = 3.0
+    pic_height = 1080
+    f_max = np.pi*pic_height*d2h/180
+    h, w = shape
+    u_min = -(h >> 1)
+    u_max = (h >> 1) + 1 if h & 1 else (h >> 1)
+    v_min = -(w >> 1)
+    v_max = (w >> 1) + 1 if w & 1 else (w >> 1)
+
+    u, v = np.meshgrid(np.arange(u_min, u_max), np.arange(v_min, v_max), indexing='ij')
+    fx, fy = u*f_max/h, v*f_max/w
+
+    if filter_key == 'ngan':
+        csf_mat = ngan(np.abs(fx)) * ngan(np.abs(fy))  # Separable filtering
+    elif filter_key == 'ngan_rad':
+        f_mat = np.sqrt(fx**2 + fy**2)
+        csf_mat = ngan(f_mat)
+    elif filter_key == 'mannos':
+        f_mat = np.sqrt(fx**2 + fy**2)
+        theta_mat = np.arctan2(v, u)
+        csf_mat = mannos(f_mat, theta_mat)
+    elif filter_key == 'nadenau':
+        csf_mat = nadenau(np.abs(fx), channel=channel) * nadenau(np.abs(fy), channel=channel)  # Separable filtering
+    else:
+        raise ValueError(f'Invalid frequency-domain filter {filter_key}. Must be one of {frequency_filter_keys}')
+    return csf_mat
+
+
+class FrequencyFilter:
+    '''
+    Frequency-domain CSF filtering of real images of one shape, using real FFTs.
+    The CSF is computed once, with the fftshift baked in, for the non-negative frequencies of the last axis. All CSFs in
+    frequency_filter_keys are even functions of frequency, so this matches filtering the full spectrum.
+    If pyFFTW is installed, FFTW plans and aligned buffers are reused across calls. Plans use pyFFTW's configured planner effort
+    (PYFFTW_PLANNER_EFFORT, e.g. FFTW_MEASURE for long runs). Instances must not be shared by threads
+    (see get_frequency_filter).
+    '''
+    def __init__(self, filter_key, shape, channel=0, threads=1):
+        self.shape = tuple(shape)
+        self.csf_half = np.ascontiguousarray(np.fft.ifftshift(frequency_csf_matrix(filter_key, self.shape, channel))[:, :self.shape[1]//2 + 1])
+        if pyfftw is not None:
+            self._rfft = pyfftw.builders.rfft2(pyfftw.empty_aligned(self.shape, dtype='float64'), threads=threads)
+            self._irfft = pyfftw.builders.irfft2(pyfftw.empty_aligned(self.csf_half.shape, dtype='complex128'), s=self.shape, threads=threads)
+
+    def __call__(self, img):
+        if pyfftw is None:
+            return np.fft.irfft2(np.fft.rfft2(img) * self.csf_half, s=self.shape)
+        self._rfft.input_array[:] = img
+        np.multiply(self._rfft(), self.csf_half, out=self._irfft.input_array)
+        return self._irfft().copy()  # The output buffer is reused by the next call
+
+
+_filter_workspaces = WorkspaceCache()
+
+
+def get_frequency_filter(filter_key, shape, channel=0):
+    '''
+    Per-thread FrequencyFilter for images of the given shape, so that CSFs and FFT plans persist across frames.
+    Only the most recently used filters of each thread are kept (see WorkspaceCache).
+    '''
+    key = ('frequency', filter_key, tuple(shape), channel)
+    return _filter_workspaces.get(key, lambda: FrequencyFilter(filter_key, shape, channel))
+
+
+spatial_filter_keys = ['ngan_spat', 'ngan_spat_clipped', 'nadenau_spat', 'nadenau_spat_clipped']
+
+# Thread pools of SpatialFilters, one per number of threads, that live as long as the process
+_band_pools = {}
+_band_pools_lock = threading.Lock()
+
+
+def _get_band_pool(threads):
+    with _band_pools_lock:
+        if threads not in _band_pools:
+            _band_pools[threads] = ThreadPoolExecutor(threads, thread_name_prefix='csf_band')
+        return _band_pools[threads]
+
+
+class SpatialFilter:
+    '''
+    Separable spatial CSF filtering (vertical, then horizontal, each optionally followed by clipping) using precomputed taps.
+    Filters an image, or a stack of images along leading axes (e.g. reference and distorted), in one call.
+    With threads > 1, each pass is split into bands of independent lines (columns for the vertical pass, rows for the
+    horizontal pass) that are filtered on a thread pool, shared by all filters using the same number of threads.
+    Instances must not be shared by threads (see get_spatial_filter).
+    '''
+    max_buffers = 4
+
+    def __init__(self, filter_key, threads=1, k=None):
+        if filter_key not in spatial_filter_keys:
+            raise ValueError(f'Invalid spatial filter {filter_key}. Must be one of {spatial_filter_keys}')
+        d2h = 3.0
+        filt_funct = csf_dict[filter_key.split('_clipped')[0]]
+        self.taps = filt_funct(d2h, k=k) if k is not None else filt_funct(d2h)
+        self.clipped = 'clipped' in filter_key
+        self.threads = threads
+        self._pool = _get_band_pool(threads) if threads > 1 else None
+        self._buffers = OrderedDict()
+
+    def buffer(self, name, shape, dtype):
+        '''
+        Array that persists across calls, e.g. to pass as out when the result is consumed before the next call.
+        Only the max_buffers most recently used buffers are kept.
+        '''
+        key = (name, tuple(shape), np.dtype(dtype).str)
+        if key in self._buffers:
+            self._buffers.move_to_end(key)
+        else:
+            self._buffers[key] = np.empty(shape, dtype=dtype)
+            while len(self._buffers) > self.max_buffers:
+                self._buffers.popitem(last=False)
+        return self._buffers[key]
+
+    def _convolve(self, src, dst, axis):
+        if self._pool is None:
+            convolve1d(src, self.taps, axis=axis, output=dst)
+        else:
+            band_axis = src.ndim - 1 if axis == -2 else src.ndim - 2
+            bounds = [(src.shape[band_axis] * i) // self.threads for i in range(self.threads + 1)]
+            bands = [tuple([slice(start, stop) if dim == band_axis else slice(None) for dim in range(src.ndim)]) for start, stop in zip(bounds[:-1], bounds[1:])]
+            list(self._pool.map(lambda band: convolve1d(src[band], self.taps, axis=axis, output=dst[band]), bands))
+        if self.clipped:
+            np.clip(dst, 0, None, out=dst)
+
+    def __call__(self, imgs, out=None):
+        '''
+        imgs is an array, or a list of arrays of equal shape and dtype that are filtered as one stack.
+        Returns out (allocated if None), having the dtype of the input.
+        '''
+        if isinstance(imgs, (list, tuple)):
+            shape, dtype = (len(imgs),) + imgs[0].shape, imgs[0].dtype
+        else:
+            shape, dtype = imgs.shape, imgs.dtype
+        tmp = self.buffer('tmp', shape, dtype)
+        if out is None:
+            out = np.empty(shape, dtype=dtype)
+
+        if isinstance(imgs, (list, tuple)):
+            for img, tmp_img in zip(imgs, tmp):
+                self._convolve(img, tmp_img, -2)
+        else:
+            self._convolve(imgs, tmp, -2)
+        self._convolve(tmp, out, -1)
+        return out
+
+
+def get_spatial_filter(filter_key, threads=1, k=None):
+    '''
+    Per-thread SpatialFilter, so that scratch buffers and thread pools persist across frames.
+    Only the most recently used filters of each thread are kept (see WorkspaceCache).
+    '''
+    key = ('spatial', filter_key, threads, k)
+    return _filter_workspaces.get(key, lambda: SpatialFilter(filter_key, threads, k))
+
+
+def clear_workspaces():
+    '''
+    Frees the frequency and spatial filters of the calling thread.
+    '''
+    _filter_workspaces.clear()
 
 
 def filter_img(img, filter_key, wavelet=None, channel=0, **kwargs):
     if filter_key is None:
         return img
 
-    elif filter_key in ['ngan', 'ngan_rad', 'mannos', 'nadenau']:
-        d2h = 3.0
-        pic_height = 1080
-        f_max = np.pi*pic_height*d2h/180
-        h, w = img.shape
-        u_min = -(h >> 1)
-        u_max = (h >> 1) + 1 if h & 1 else (h >> 1)
-        v_min = -(w >> 1)
-        v_max = (w >> 1) + 1 if w & 1 else (w >> 1)
-
-        u, v = np.meshgrid(np.arange(u_min, u_max), np.arange(v_min, v_max), indexing='ij')
-        fx, fy = u*f_max/h, v*f_max/w
-
-        if filter_key == 'ngan':
-            csf_mat = ngan(np.abs(fx)) * ngan(np.abs(fy))  # Separable filtering
-        elif filter_key == 'ngan_rad':
-            f_mat = np.sqrt(fx**2 + fy**2)
-            csf_mat = ngan(f_mat)
-        elif filter_key == 'mannos':
-            f_mat = np.sqrt(fx**2 + fy**2)
-            theta_mat = np.arctan2(v, u)
-            csf_mat = mannos(f_mat, theta_mat)
-        elif filter_key == 'nadenau':
-            csf_mat = nadenau(np.abs(fx), channel=channel) * nadenau(np.abs(fy), channel=channel)  # Separable filtering
-
-        img_filtered = np.fft.ifft2(np.fft.ifftshift(np.fft.fftshift(np.fft.fft2(img)) * csf_mat))
+    elif filter_key in frequency_filter_keys:
+        img_filtered = get_frequency_filter(filter_key, img.shape, channel)(img)
 
     elif filter_key in ['li', 'watson', 'ahc', 'hill', 'mannos_weight']:
         n_levels = 4
@@ -63,20 +260,7 @@ def filter_img(img, filter_key, wavelet=None, channel=0, **kwargs):
         pyr_filtered = filter_pyr(pyr, csf_funct, channel=channel)
         img_filtered = waverec2(pyr_filtered, wavelet, 'reflect')
 
-    elif filter_key in ['ngan_spat', 'ngan_spat_clipped', 'nadenau_spat', 'nadenau_spat_clipped']:
-        d2h = 3.0
-        filt_funct = csf_dict[filter_key.split('_clipped')[0]]
-        if 'k' in kwargs:
-            filt = filt_funct(d2h, k=kwargs['k'])
-        else:
-            filt = filt_funct(d2h)
-
-        img_filtered = convolve1d(img, filt, axis=0)
-        if 'clipped' in filter_key:
-            img_filtered = np.clip(img_filtered, 0, None)
-
-        img_filtered = convolve1d(img_filtered, filt, axis=1)
-        if 'clipped' in filter_key:
-            img_filtered = np.clip(img_filtered, 0, None)
+    elif filter_key in spatial_filter_keys:
+        img_filtered = get_spatial_filter(filter_key, k=kwargs.get('k'))(img)
 
     return np.real(img_filtered)
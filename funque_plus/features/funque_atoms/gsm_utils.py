@@ -14,22 +14,76 @@ def im2col(img, k, stride=1):
     return ret[:, :, ::stride, ::stride].reshape(k*k, -1)
 
 
+def _window_sums(x, row_start, col_start, nrows, ncols, row_sums, col_sums, total):
+    # Sums of x[..., row_start:row_start+nrows, col_start:col_start+ncols], given the row sums, column sums and total of x.
+    # Only the few rows and columns outside the window are summed again.
+    rows_out = np.r_[0:row_start, row_start+nrows:x.shape[-2]]
+    cols_out = np.r_[0:col_start, col_start+ncols:x.shape[-1]]
+    corners = x[..., rows_out[:, None], cols_out[None, :]].sum((-2, -1))
+    return total - row_sums[..., rows_out].sum(-1) - col_sums[..., cols_out].sum(-1) + corners
+
+
+def gsm_covariances(y, M):
+    '''
+    Covariance of the MxM neighbourhoods of each subband in a stack y of shape (..., H, W), equal to np.cov(im2col(y, M, 1)).
+    Covariances are computed from sums of products of shifted subbands, without building the M^2 x N matrix of neighbourhoods.
+    '''
+    # Covariances do not depend on the mean, and centering avoids cancellation when subtracting products of means
+    y = np.asarray(y, dtype=np.float64)
+    y = y - y.mean((-2, -1), keepdims=True)
+    h, w = y.shape[-2:]
+    nrows, ncols = h - M + 1, w - M + 1
+    n = nrows * ncols
+    offsets = [(row, col) for row in range(M) for col in range(M)]
+
+    row_sums, col_sums = y.sum(-1), y.sum(-2)
+    total = row_sums.sum(-1)
+    means = np.stack([_window_sums(y, row, col, nrows, ncols, row_sums, col_sums, total) for row, col in offsets], -1) / n
+
+    # Sums of products of neighbourhood elements i and j only depend on their relative shift, up to the borders
+    prods = np.empty(y.shape[:-2] + (M*M, M*M))
+    for shift_row in range(M):
+        for shift_col in range(-(M-1), M):
+            if shift_row == 0 and shift_col < 0:
+                continue
+            col_start, col_stop = max(0, -shift_col), w - max(0, shift_col)
+            shifted_prod = y[..., :h-shift_row, col_start:col_stop] * y[..., shift_row:, col_start+shift_col:col_stop+shift_col]
+            prod_row_sums, prod_col_sums = shifted_prod.sum(-1), shifted_prod.sum(-2)
+            prod_total = prod_row_sums.sum(-1)
+            for i, (row, col) in enumerate(offsets):
+                if row + shift_row >= M or not 0 <= col + shift_col < M:
+                    continue
+                j = (row + shift_row)*M + col + shift_col
+                prods[..., i, j] = _window_sums(shifted_prod, row, col - col_start, nrows, ncols, prod_row_sums, prod_col_sums, prod_total)
+                prods[..., j, i] = prods[..., i, j]
+
+    return (prods - n * means[..., :, None] * means[..., None, :]) / (n - 1)
+
+
 def gsm_model(y, M):
+    '''
+    GSM model of a subband, or of each subband in a stack of shape (..., H, W), using MxM neighbourhoods.
+    Returns the multipliers s, and the eigenvalues (clipped to be positive) and covariance of neighbourhoods.
+    Eigen-decompositions of a stack are computed at once, and s is computed in the eigenbasis instead of inverting the covariance.
+    '''
     tol = 1e-15
-    y_size = (int(y.shape[0]/M)*M, int(y.shape[1]/M)*M)
-    y = y[:y_size[0], :y_size[1]]
+    y = np.asarray(y)
+    y_size = (int(y.shape[-2]/M)*M, int(y.shape[-1]/M)*M)
+    y = y[..., :y_size[0], :y_size[1]]
 
-    y_vecs = im2col(y, M, 1)
-    cov = np.cov(y_vecs)
+    cov = gsm_covariances(y, M)
     lamda, V = np.linalg.eigh(cov)
     lamda[lamda < tol] = tol
-    cov = V@np.diag(lamda)@V.T
+    cov = (V * lamda[..., None, :]) @ np.swapaxes(V, -1, -2)
 
-    y_vecs = im2col(y, M, M)
+    # Non-overlapping neighbourhoods as columns, ordered as in im2col(y, M, M)
+    blocks = y.reshape(y.shape[:-2] + (y_size[0]//M, M, y_size[1]//M, M))
+    y_vecs = np.moveaxis(blocks, (-4, -3, -2, -1), (-2, -4, -1, -3)).reshape(y.shape[:-2] + (M*M, -1))
 
-    s = np.linalg.inv(cov)@y_vecs
-    s = np.sum(s * y_vecs, 0)/(M*M)
-    s = np.clip(s.reshape((int(y_size[0]/M), int(y_size[1]/M))), tol, None)
+    # y^T cov^-1 y, using cov^-1 = V diag(1/lamda) V^T
+    proj = np.swapaxes(V, -1, -2) @ y_vecs
+    s = np.sum(proj * proj / lamda[..., :, None], -2)/(M*M)
+    s = np.clip(s.reshape(y.shape[:-2] + (y_size[0]//M, y_size[1]//M)), tol, None)
 
     return s, lamda, cov
 
@@ -0,0 +1,95 @@
+import numpy as np
+import pywt
+
+
+_haar_coeff = pywt.Wavelet('haar').dec_lo[0]
+
+
+def haar_applies(data, wavelet, mode, level, axes=(-2, -1)):
+    '''
+    Whether haar_wavedec2 computes the same pyramid as custom_wavedec2 would using pywt, i.e. for a periodized Haar
+    decomposition of the last two axes of a float32 or float64 array whose sizes are divisible by 2**level.
+    '''
+    if not isinstance(wavelet, str) or wavelet != 'haar' or mode != 'periodization' or not isinstance(data, np.ndarray) or data.ndim < 2:
+        return False
+    if data.dtype not in [np.float32, np.float64] or tuple([axis % data.ndim for axis in axes]) != (data.ndim-2, data.ndim-1):
+        return False
+    return all([size > 0 and size % (1 << level) == 0 for size in data.shape[-2:]])
+
+
+def _level_shapes(shape, level):
+    lead, (h, w) = shape[:-2], shape[-2:]
+    return [lead + (h >> (lev+1), w >> (lev+1)) for lev in range(level)]
+
+
+def _haar_rows(data, k, scratch, details=True):
+    # Sums and differences (if details) of pairs of rows, scaled by k. Returns (lo, hi, tmp) views of scratch, tmp being free space.
+    row_shape = data.shape[:-2] + (data.shape[-2] // 2, data.shape[-1])
+    size = int(np.prod(row_shape))
+    hi, prod, lo = [scratch[i*size: (i+1)*size].reshape(row_shape) for i in range(3)]
+    # Products are summed as in pywt, so that subbands are bitwise identical
+    np.multiply(data[..., 0::2, :], k, out=hi)
+    np.multiply(data[..., 1::2, :], k, out=prod)
+    np.add(hi, prod, out=lo)
+    if details:
+        np.subtract(hi, prod, out=hi)
+    return lo, hi, prod
+
+
+def _haar_cols(data, k, out_lo, out_hi, tmp):
+    np.multiply(data[..., 0::2], k, out=out_lo)
+    np.multiply(data[..., 1::2], k, out=tmp)
+    if out_hi is not None:
+        np.subtract(out_lo, tmp, out=out_hi)
+    np.add(out_lo, tmp, out=out_lo)
+
+
+def haar_wavedec2(data, level=1):
+    '''
+    Periodized Haar pyramid ([A1, ..., An], [(H1, V1, D1), ..., (Hn, Vn, Dn)]) of the last two axes of data.
+    Leading axes are decomposed independently, so stacked images (e.g. reference and distorted, or Y, U and V) share one call.
+    All subbands are views into one buffer, and are bitwise identical to those of pywt.dwt2(..., 'haar', 'periodization').
+    Sizes of the last two axes must be divisible by 2**level (see haar_applies).
+    '''
+    k = data.dtype.type(_haar_coeff)
+    shapes = _level_shapes(data.shape, level)
+    sizes = [int(np.prod(shape)) for shape in shapes]
+    buf = np.empty(4*sum(sizes), dtype=data.dtype)
+    scratch = np.empty(3*2*sizes[0], dtype=data.dtype)
+
+    approxs = []
+    details = []
+    offset = 0
+    for shape, size in zip(shapes, sizes):
+        approx, horz, vert, diag = [buf[offset + i*size: offset + (i+1)*size].reshape(shape) for i in range(4)]
+        offset += 4*size
+        lo, hi, tmp = _haar_rows(data, k, scratch)
+        tmp = tmp.reshape(-1)[:size].reshape(shape)
+        _haar_cols(lo, k, approx, vert, tmp)
+        _haar_cols(hi, k, horz, diag, tmp)
+        approxs.append(approx)
+        details.append((horz, vert, diag))
+        data = approx
+    return approxs, details
+
+
+def haar_wavedec2_approxs(data, level=1):
+    '''
+    Approximation subbands [A1, ..., An] of haar_wavedec2, without computing detail subbands.
+    '''
+    k = data.dtype.type(_haar_coeff)
+    shapes = _level_shapes(data.shape, level)
+    sizes = [int(np.prod(shape)) for shape in shapes]
+    buf = np.empty(sum(sizes), dtype=data.dtype)
+    scratch = np.empty(3*2*sizes[0], dtype=data.dtype)
+
+    approxs = []
+    offset = 0
+    for shape, size in zip(shapes, sizes):
+        approx = buf[offset: offset+size].reshape(shape)
+        offset += size
+        lo, _, tmp = _haar_rows(data, k, scratch, details=False)
+        _haar_cols(lo, k, approx, None, tmp.reshape(-1)[:size].reshape(shape))
+        approxs.append(approx)
+        data = approx
+    return approxs
@@ -0,0 +1,173 @@
+import numpy as np
+from .workspace_utils import WorkspaceCache
+
+
+integral_methods = ['sequential', 'compensated', 'extended']
+
+
+def _two_sum_cumsum(x, axis):
+    # Running sums along axis, with the rounding error of every partial sum recovered exactly using TwoSum.
+    s = np.cumsum(x, axis=axis, dtype=np.float64)
+    err = np.zeros_like(s)
+    head = [slice(None)] * s.ndim
+    tail = [slice(None)] * s.ndim
+    head[axis] = slice(None, -1)
+    tail[axis] = slice(1, None)
+    head, tail = tuple(head), tuple(tail)
+
+    a = s[head]
+    b = x[tail]
+    s_ab = s[tail]
+    b_virt = s_ab - a
+    err[tail] = (a - (s_ab - b_virt)) + (b - b_virt)
+    return s + np.cumsum(err, axis=axis)
+
+
+def integral_image(x, method='sequential', out=None):
+    '''
+    Summed-area table of x (or of a stack of images along the leading axes), with a leading row and column of zeros.
+    method: 'sequential' accumulates rows, then columns, in float64. Bitwise identical to the original row/column loop.
+            'compensated' recovers the rounding error of every running sum (TwoSum) and adds it back.
+            'extended' accumulates in np.longdouble (80-bit on x86, plain float64 on some platforms) before rounding to float64.
+    out: Optional float64 array of shape (..., M+1, N+1) to reuse. Its first row and column are reset to zero.
+    '''
+    if method not in integral_methods:
+        raise ValueError(f'Invalid integral image method {method}. Must be one of {integral_methods}')
+
+    M, N = x.shape[-2:]
+    if out is None:
+        out = np.zeros(x.shape[:-2] + (M+1, N+1))
+    else:
+        out[..., 0, :] = 0
+        out[..., :, 0] = 0
+
+    int_x = out[..., 1:, 1:]
+    if method == 'sequential':
+        np.cumsum(x, axis=-2, dtype=np.float64, out=int_x)
+        np.cumsum(int_x, axis=-1, out=int_x)
+    elif method == 'compensated':
+        int_x[:] = _two_sum_cumsum(_two_sum_cumsum(x, -2), -1)
+    elif method == 'extended':
+        int_x[:] = np.cumsum(np.cumsum(x, axis=-2, dtype=np.longdouble), axis=-1)
+    return out
+
+
+def box_sums(int_x, k, stride=1, out=None):
+    '''
+    Sums over k x k windows sampled every stride pixels, read off a summed-area table from integral_image.
+    '''
+    if out is None:
+        return int_x[..., :-k:stride, :-k:stride] - int_x[..., :-k:stride, k::stride] - int_x[..., k::stride, :-k:stride] + int_x[..., k::stride, k::stride]
+    np.subtract(int_x[..., :-k:stride, :-k:stride], int_x[..., :-k:stride, k::stride], out=out)
+    np.subtract(out, int_x[..., k::stride, :-k:stride], out=out)
+    np.add(out, int_x[..., k::stride, k::stride], out=out)
+    return out
+
+
+def box_means(int_x, k, stride=1):
+    return box_sums(int_x, k, stride) / (k*k)
+
+
+def local_sums(x, k, stride=1, method='sequential'):
+    '''
+    Sums over k x k windows of x, after reflect-padding so that the output has (roughly) the size of x / stride.
+    '''
+    x_pad = np.pad(x, int((k - stride)/2), mode='reflect')
+    return box_sums(integral_image(x_pad, method), k, stride)
+
+
+def _reflect_pad_into(buf, x, pad):
+    # Same as buf[:] = np.pad(x, pad, mode='reflect'), without allocating the padded copy.
+    M, N = x.shape
+    if pad == 0:
+        buf[:] = x
+        return
+    if pad >= M or pad >= N:
+        buf[:] = np.pad(x, pad, mode='reflect')
+        return
+    buf[pad:pad+M, pad:pad+N] = x
+    buf[:pad, pad:pad+N] = x[pad:0:-1]
+    buf[pad+M:, pad:pad+N] = x[-2:-pad-2:-1]
+    buf[:, :pad] = buf[:, 2*pad:pad:-1]
+    buf[:, pad+N:] = buf[:, pad+N-2:N-2:-1]
+
+
+class BoxMoments:
+    '''
+    Local means, variances and covariance of a ref/dis pair (or means and variances of a single image) over k x k windows.
+    All five window sums are read off one stacked summed-area table, built in scratch buffers that are reused
+    for every call with inputs of the same shape. Returned maps are views into that scratch, valid until the next call.
+    dtype sets the precision of the products and of the returned maps. The table, window sums and the
+    subtraction of squared means are always float64, since variances cancel badly in float32.
+    '''
+    def __init__(self, k, stride=1, dtype='float64', method='sequential'):
+        self.k = k
+        self.stride = stride
+        self.dtype = np.dtype(dtype)
+        self.method = method
+        self.pad = int((k - stride)/2)
+        self._shape = None
+
+    def _allocate(self, shape, n_stats):
+        M, N = shape
+        Mp, Np = M + 2*self.pad, N + 2*self.pad
+        self._stack = np.empty((n_stats, Mp, Np), dtype=self.dtype)
+        self._table = np.zeros((n_stats, Mp+1, Np+1))
+        out_shape = self._table[0, :-self.k:self.stride, :-self.k:self.stride].shape
+        self._sums = np.empty((n_stats,) + out_shape)
+        self._stats = self._sums if self.dtype == self._sums.dtype else np.empty((n_stats,) + out_shape, dtype=self.dtype)
+        self._mu_sq = np.empty((n_stats >> 1,) + out_shape)
+        self._shape = (shape, n_stats)
+
+    def __call__(self, x, y=None):
+        n_stats = 2 if y is None else 5
+        if self._shape != (x.shape, n_stats):
+            self._allocate(x.shape, n_stats)
+
+        stack = self._stack
+        n_imgs = n_stats >> 1
+        _reflect_pad_into(stack[0], x, self.pad)
+        if y is not None:
+            _reflect_pad_into(stack[1], y, self.pad)
+        np.multiply(stack[:n_imgs], stack[:n_imgs], out=stack[n_imgs:2*n_imgs])
+        if y is not None:
+            np.multiply(stack[0], stack[1], out=stack[4])
+
+        integral_image(stack, self.method, out=self._table)
+        sums = box_sums(self._table, self.k, self.stride, out=self._sums)
+        stats = np.divide(sums, self.k*self.k, out=sums)
+
+        mu = stats[:n_imgs]
+        var = stats[n_imgs:2*n_imgs]
+        np.square(mu, out=self._mu_sq)
+        np.subtract(var, self._mu_sq, out=var)
+        if y is not None:
+            np.multiply(mu[0], mu[1], out=self._mu_sq[0])
+            np.subtract(stats[4], self._mu_sq[0], out=stats[4])
+
+        if self._stats is not sums:
+            np.copyto(self._stats, stats, casting='same_kind')
+            stats = self._stats
+
+        if y is None:
+            return stats[0], stats[1]
+        return stats[0], stats[1], stats[2], stats[3], stats[4]
+
+
+_workspaces = WorkspaceCache()
+
+
+def get_box_moments(shape, k, stride=1, dtype='float64', method='sequential', paired=True):
+    '''
+    Per-thread BoxMoments instance for inputs of the given shape, so that scratch buffers persist across frames.
+    Only the most recently used instances of each thread are kept (see WorkspaceCache).
+    '''
+    key = (tuple(shape), k, stride, np.dtype(dtype).str, method, paired)
+    return _workspaces.get(key, lambda: BoxMoments(k, stride, dtype, method))
+
+
+def clear_workspaces():
+    '''
+    Frees the BoxMoments instances of the calling thread.
+    '''
+    _workspaces.clear()
@@ -0,0 +1,82 @@
+import numpy as np
+
+
+class PoolStats:
+    '''
+    Pooling statistics of the values of a map, accumulated in float64 over a stream of tiles (or whole maps).
+    Count, mean and the sum of squared deviations are merged across tiles using the pairwise update of Chan et al.
+    If clipped, the sums of the positive and negative parts are also kept, as are the sums of |x|^p for each p in minkowski_ps.
+    This is not a single-pass reducer: each tile is reduced by a separate NumPy pass per statistic (mean, deviations, and each
+    clipped or Minkowski sum), which is cheap as long as tiles are small enough to stay in cache (see pool_stats).
+    Statistics are read-only properties.
+    '''
+    def __init__(self, clipped=False, minkowski_ps=()):
+        self.count = 0
+        self._mean = 0.0
+        self.m2 = 0.0
+        self.clipped = clipped
+        self.pos_sum = 0.0
+        self.neg_sum = 0.0
+        self.minkowski_sums = {p: 0.0 for p in minkowski_ps}
+
+    def update(self, x):
+        count = x.size
+        if count == 0:
+            return
+        mean = np.mean(x, dtype=np.float64)
+        dev = np.subtract(x, mean, dtype=np.float64).ravel()
+        m2 = np.dot(dev, dev)
+        total = self.count + count
+        delta = mean - self._mean
+        self._mean += delta * count / total
+        self.m2 += m2 + delta * delta * self.count * count / total
+        self.count = total
+
+        if self.clipped:
+            self.pos_sum += np.sum(np.maximum(x, 0), dtype=np.float64)
+            self.neg_sum += np.sum(np.minimum(x, 0), dtype=np.float64)
+        if self.minkowski_sums:
+            mag = np.abs(x)
+            for p in self.minkowski_sums:
+                self.minkowski_sums[p] += np.sum(np.power(mag, p), dtype=np.float64)
+
+    @property
+    def mean(self):
+        return self._mean
+
+    @property
+    def std(self):
+        return np.sqrt(self.m2 / self.count)
+
+    @property
+    def cov(self):
+        # Coefficient of variation
+        return self.std / self._mean
+
+    @property
+    def pos_mean(self):
+        # Mean of the map clipped below at zero
+        return self.pos_sum / self.count
+
+    @property
+    def neg_mean(self):
+        # Mean of the map clipped above at zero
+        return self.neg_sum / self.count
+
+    @property
+    def minkowski_means(self):
+        # Minkowski mean (mean of |x|^p)^(1/p) for each p in minkowski_ps
+        return {p: np.power(minkowski_sum / self.count, 1.0/p) for p, minkowski_sum in self.minkowski_sums.items()}
+
+
+def pool_stats(x, *others, funct=None, clipped=False, minkowski_ps=(), tile_rows=64):
+    '''
+    PoolStats of x, or of funct(x_tile, *other_tiles) over tiles of tile_rows rows of x and of the maps in others,
+    so that derived maps (e.g., differences or magnitudes) are pooled without forming them in full.
+    '''
+    stats = PoolStats(clipped, minkowski_ps)
+    for start in range(0, x.shape[0], tile_rows):
+        rows = slice(start, start + tile_rows)
+        tile = x[rows] if funct is None else funct(x[rows], *[other[rows] for other in others])
+        stats.update(tile)
+    return stats
@@ -1,13 +1,16 @@
 import numpy as np
 
-from .dlm_utils import dlm_decouple, dlm_contrast_mask
+from .dlm_utils import dlm_level_sums
 from .vif_utils import vif_spatial, vif_channel_est
-from .gsm_utils import gsm_model, im2col
-from .filter_utils import filter_pyr
+from .gsm_utils import gsm_model
+from .filter_utils import CsfPlan, get_csf_plan
 from .rred_utils import rred_entropies_and_scales
+from .pool_utils import pool_stats
+from .ssim_utils import wd_ssim_moments
+from .haar_utils import haar_applies, haar_wavedec2, haar_wavedec2_approxs
 
 
-from pywt import dwt2
+from pywt import dwt, dwt2
 
 
 def custom_wavedec2(data, wavelet, mode='symmetric', level=None, axes=(-2, -1)):
@@ -15,6 +18,8 @@ def custom_wavedec2(data, wavelet, mode='symmetric', level=None, axes=(-2, -1)):
     details = []
     if level is None:
         level = 1
+    if haar_applies(data, wavelet, mode, level, axes):
+        return haar_wavedec2(data, level)
     for _ in range(level):
         wavelet_level = dwt2(data, wavelet, mode, axes)
         approxs.append(wavelet_level[0])
@@ -23,42 +28,45 @@ def custom_wavedec2(data, wavelet, mode='symmetric', level=None, axes=(-2, -1)):
     return (approxs, details)
 
 
+def custom_wavedec2_approxs(data, wavelet, mode='symmetric', level=None, axes=(-2, -1)):
+    # Only the approximation subbands [A1, ..., An] of custom_wavedec2, skipping the detail subbands of the last axis.
+    approxs = []
+    if level is None:
+        level = 1
+    if haar_applies(data, wavelet, mode, level, axes):
+        return haar_wavedec2_approxs(data, level)
+    for _ in range(level):
+        for axis in axes:
+            data, _ = dwt(data, wavelet, mode, axis)
+        approxs.append(data)
+    return approxs
+
+
+def _dlm_level_sums(details_ref, details_dist, border_size, csf):
+    # Per-level lists of per-subband DLM numerator and denominator terms, computed by the fused kernel
+    assert len(details_ref) == len(details_dist), 'Pyramids must be of equal height.'
+    if csf is None:
+        weights = [None]*len(details_ref)
+    else:
+        plan = csf if isinstance(csf, CsfPlan) else get_csf_plan(csf, len(details_ref))
+        weights = plan.weights_as(details_ref[0][0].dtype)
+    return [dlm_level_sums(level_ref, level_dist, border_size, level_weights) for level_ref, level_dist, level_weights in zip(details_ref, details_dist, weights)]
+
+
 def dlm_pyr(pyr_ref, pyr_dist, border_size=0.2, csf='li'):
     # Pyramids are assumed to have the structure
     # ([A1, ..., An], [(H1, V1, D1), ..., (Hn, Vn, Dn)])
     _, details_ref = pyr_ref
     _, details_dist = pyr_dist
-    assert len(details_ref) == len(details_dist), 'Pyramids must be of equal height.'
-    pyrs_decouple = [dlm_decouple(level_ref, level_dist) for level_ref, level_dist in zip(details_ref, details_dist)]
-    pyr_rest = [level[0] for level in pyrs_decouple]
-    pyr_add = [level[1] for level in pyrs_decouple]
 
-    # Below this point, pyramids have the structure
-    # [(H1, V1, D1), ..., (Hn, Vn, Dn)])]
-    _, details_ref = filter_pyr((None, details_ref), csf)
-    _, pyr_rest = filter_pyr((None, pyr_rest), csf)
-    _, pyr_add = filter_pyr((None, pyr_add), csf)
-
-    pyrs_masked = [dlm_contrast_mask(level_rest, level_add) for level_rest, level_add in zip(pyr_rest, pyr_add)]
-    pyr_rest = [level[0] for level in pyrs_masked]
-    # pyr_add = [level[1] for level in pyrs_masked]
-
-    # pool results
+    # Decoupling, CSF weighting, contrast masking (of restored subbands only) and pooling are fused, level by level
     dlm_num = 0
     dlm_den = 0
-    for level in pyr_rest:
-        h, w = level[0].shape
-        border_h = int(border_size*h)
-        border_w = int(border_size*w)
-        for subband in level:
-            dlm_num += np.power(np.sum(np.power(subband[border_h:-border_h, border_w:-border_w], 3.0)), 1.0/3)
-
-    for level in details_ref:
-        h, w = level[0].shape
-        border_h = int(border_size*h)
-        border_w = int(border_size*w)
-        for subband in level:
-            dlm_den += np.power(np.sum(np.abs(np.power(subband[border_h:-border_h, border_w:-border_w], 3.0))), 1.0/3)
+    for level_nums, level_dens in _dlm_level_sums(details_ref, details_dist, border_size, csf):
+        for subband_num in level_nums:
+            dlm_num += subband_num
+        for subband_den in level_dens:
+            dlm_den += subband_den
 
     dlm = (dlm_num + 1e-4) / (dlm_den + 1e-4)
 
@@ -70,39 +78,15 @@ def ms_dlm_pyr(pyr_ref, pyr_dist, border_size=0.2, full=False, csf='li'):
     # ([A1, ..., An], [(H1, V1, D1), ..., (Hn, Vn, Dn)])
     _, details_ref = pyr_ref
     _, details_dist = pyr_dist
-    assert len(details_ref) == len(details_dist), 'Pyramids must be of equal height.'
     n_levels = len(details_ref)
 
-    pyrs_decouple = [dlm_decouple(level_ref, level_dist) for level_ref, level_dist in zip(details_ref, details_dist)]
-    pyr_rest = [level[0] for level in pyrs_decouple]
-    pyr_add = [level[1] for level in pyrs_decouple]
-
-    # Below this point, pyramids have the structure
-    # [(H1, V1, D1), ..., (Hn, Vn, Dn)])]
-    details_ref = filter_pyr(details_ref, csf)
-    pyr_rest = filter_pyr(pyr_rest, csf)
-    pyr_add = filter_pyr(pyr_add, csf)
-
-    pyrs_masked = [dlm_contrast_mask(level_rest, level_add) for level_rest, level_add in zip(pyr_rest, pyr_add)]
-    pyr_rest = [level[0] for level in pyrs_masked]
-    # pyr_add = [level[1] for level in pyrs_masked]
-
-    # pool results
     dlm_nums = np.ones((n_levels,))*1e-4
-    for i, level in enumerate(pyr_rest):
-        h, w = level[0].shape
-        border_h = int(border_size*h)
-        border_w = int(border_size*w)
-        for subband in level:
-            dlm_nums[i] += np.power(np.sum(np.power(subband[border_h:-border_h, border_w:-border_w], 3.0)), 1.0/3)
-
     dlm_dens = np.ones((n_levels,))*1e-4
-    for i, level in enumerate(details_ref):
-        h, w = level[0].shape
-        border_h = int(border_size*h)
-        border_w = int(border_size*w)
-        for subband in level:
-            dlm_dens[i] += np.power(np.sum(np.power(np.abs(subband[border_h:-border_h, border_w:-border_w]), 3.0)), 1.0/3)
+    for i, (level_nums, level_dens) in enumerate(_dlm_level_sums(details_ref, details_dist, border_size, csf)):
+        for subband_num in level_nums:
+            dlm_nums[i] += subband_num
+        for subband_den in level_dens:
+            dlm_dens[i] += subband_den
 
     if full:
         return np.cumsum(dlm_nums) / np.cumsum(dlm_dens), dlm_nums / dlm_dens
@@ -148,7 +132,9 @@ def vif_pyr(pyr_ref, pyr_dist, full=False, block_size=3, sigma_nsq=None):
         gsm_details = []
         gsm_approxs = []
         for approx_ref, detail_level_ref in zip(approxs_ref, details_ref):
-            gsm_details.append([gsm_model(subband_ref, block_size) for subband_ref in detail_level_ref[:-1]])
+            # The H and V subbands are modelled as one stack
+            s, lamda, cov = gsm_model(np.stack(detail_level_ref[:-1]), block_size)
+            gsm_details.append([(s[i], lamda[i], cov[i]) for i in range(len(detail_level_ref) - 1)])
             gsm_approxs.append(gsm_model(approx_ref, block_size))
 
         for lev, (level_channel, level_gsm) in enumerate(zip(channel_details, gsm_details)):
@@ -186,42 +172,16 @@ def ssim_pyr(pyr_ref, pyr_dist, max_val=1, K1=0.01, K2=0.03, pool='cov'):
     assert len(approxs_ref) == len(approxs_dist), 'Both wavelet pyramids must be of the same height'
     n_levels = len(approxs_ref)
 
-    C1 = (K1*max_val)**2
-    C2 = (K2*max_val)**2
-
-    var_x = np.zeros((details_ref[0][0].shape[0] << 1, details_ref[0][0].shape[1] << 1))
-    var_y = np.zeros((details_ref[0][0].shape[0] << 1, details_ref[0][0].shape[1] << 1))
-    cov_xy = np.zeros((details_ref[0][0].shape[0] << 1, details_ref[0][0].shape[1] << 1))
-
-    for detail_level_ref, detail_level_dist in zip(details_ref, details_dist):
-        var_x_add = np.stack([subband**2 for subband in detail_level_ref], axis=-1).sum(-1)
-        var_y_add = np.stack([subband**2 for subband in detail_level_dist], axis=-1).sum(-1)
-        cov_xy_add = np.stack([subband_ref * subband_dist for subband_ref, subband_dist in zip(detail_level_ref, detail_level_dist)], axis=-1).sum(-1)
-        var_x = im2col(var_x, 2, 2).sum(0).reshape(var_x_add.shape) + var_x_add
-        var_y = im2col(var_y, 2, 2).sum(0).reshape(var_y_add.shape) + var_y_add
-        cov_xy = im2col(cov_xy, 2, 2).sum(0).reshape(cov_xy_add.shape) + cov_xy_add
-
-    win_dim = (1 << n_levels)  # 2^L
-    win_size = (1 << (n_levels << 1))  # 2^(2L), i.e., a win_dim X win_dim square
-
-    mu_x = approxs_ref[-1] / win_dim
-    mu_y = approxs_dist[-1] / win_dim
-    var_x /= win_size
-    var_y /= win_size
-    cov_xy /= win_size
-
-    l = (2*mu_x*mu_y + C1) / (mu_x**2 + mu_y**2 + C1)
-    cs = (2 * cov_xy + C2) / (var_x + var_y + C2)
-
-    ssim_map = l * cs
-    mean_ssim = np.mean(ssim_map)
+    # l, cs and SSIM maps are pooled tile by tile, so full-size maps are never formed
+    _, _, ssim_moments = wd_ssim_moments(approxs_ref, approxs_dist, details_ref, details_dist, max_val, K1, K2, levels=[n_levels-1])[n_levels-1]
+    mean_ssim = ssim_moments.mean
 
     if pool == 'mean':
         return mean_ssim
     elif pool == 'cov':
-        return np.std(ssim_map) / mean_ssim
+        return ssim_moments.cov
     elif pool == 'all':
-        return mean_ssim, np.std(ssim_map) / mean_ssim
+        return mean_ssim, ssim_moments.cov
     else:
         raise ValueError('Invalid pool option.')
 
@@ -248,43 +208,15 @@ def ms_ssim_pyr(pyr_ref, pyr_dist, max_val=1, K1=0.01, K2=0.03, pool='cov', full
     cs_mink_scales = np.zeros((n_levels,))
     ssim_mink_scales = np.zeros((n_levels,))
 
-    C1 = (K1*max_val)**2
-    C2 = (K2*max_val)**2
-
-    var_x_cum = np.zeros((details_ref[0][0].shape[0] << 1, details_ref[0][0].shape[1] << 1))
-    var_y_cum = np.zeros((details_ref[0][0].shape[0] << 1, details_ref[0][0].shape[1] << 1))
-    cov_xy_cum = np.zeros((details_ref[0][0].shape[0] << 1, details_ref[0][0].shape[1] << 1))
-
-    win_dim = 1
-    win_size = 1
-    for lev, (approx_ref, approx_dist, detail_level_ref, detail_level_dist) in enumerate(zip(approxs_ref, approxs_dist, details_ref, details_dist)):
-        win_dim <<= 1
-        win_size <<= 2
-
-        var_x_add = np.stack([subband**2 for subband in detail_level_ref], axis=-1).sum(-1)
-        var_y_add = np.stack([subband**2 for subband in detail_level_dist], axis=-1).sum(-1)
-        cov_xy_add = np.stack([subband_ref * subband_dist for subband_ref, subband_dist in zip(detail_level_ref, detail_level_dist)], axis=-1).sum(-1)
-
-        var_x_cum = im2col(var_x_cum, 2, 2).sum(0).reshape(var_x_add.shape) + var_x_add
-        var_y_cum = im2col(var_y_cum, 2, 2).sum(0).reshape(var_y_add.shape) + var_y_add
-        cov_xy_cum = im2col(cov_xy_cum, 2, 2).sum(0).reshape(cov_xy_add.shape) + cov_xy_add
-
-        mu_x = approx_ref / win_dim
-        mu_y = approx_dist / win_dim
-        var_x = var_x_cum / win_size
-        var_y = var_y_cum / win_size
-        cov_xy = cov_xy_cum / win_size
-
-        l = (2*mu_x*mu_y + C1) / (mu_x**2 + mu_y**2 + C1)
-        cs = (2 * cov_xy + C2) / (var_x + var_y + C2)
-        ssim_map = l * cs
-
-        l_mean_scales[lev] = np.mean(l)
-        cs_mean_scales[lev] = np.mean(cs)
-        l_cov_scales[lev] = np.std(l) / l_mean_scales[lev]
-        cs_cov_scales[lev] = np.std(cs) / cs_mean_scales[lev]
-        ssim_mean_scales[lev] = np.mean(ssim_map)
-        ssim_cov_scales[lev] = np.std(ssim_map) / ssim_mean_scales[lev]
+    # l, cs and SSIM maps of every level are pooled tile by tile, so full-size maps are never formed
+    moments = wd_ssim_moments(approxs_ref, approxs_dist, details_ref, details_dist, max_val, K1, K2)
+    for lev, (l_moments, cs_moments, ssim_moments) in enumerate(moments):
+        l_mean_scales[lev] = l_moments.mean
+        cs_mean_scales[lev] = cs_moments.mean
+        l_cov_scales[lev] = l_moments.cov
+        cs_cov_scales[lev] = cs_moments.cov
+        ssim_mean_scales[lev] = ssim_moments.mean
+        ssim_cov_scales[lev] = ssim_moments.cov
 
     if pool != 'cov':
         ms_ssim_mean_scales = np.concatenate([np.array([1]), np.cumprod(cs_mean_scales[:-1] ** exps[:n_levels-1])]) * (ssim_mean_scales ** exps[:n_levels])
@@ -377,17 +309,17 @@ def strred_pyr(pyr_ref, pyr_dist, prev_pyr_ref, prev_pyr_dist, block_size=3, sin
     else:
         return ((srred_vals, trred_vals, strred_vals), (srred_approx_vals, trred_approx_vals, strred_approx_vals)), (spat_vals, temp_vals, spat_temp_vals)
 
+
 def strred_hv_pyr(pyr_ref, pyr_dist, prev_pyr_ref, prev_pyr_dist, block_size=3, single=False, full=False):
     # Pyramids are assumed to have the structure
     # ([A1, ..., An], [(H1, V1, D1), ..., (Hn, Vn, Dn)])
     approxs_ref, details_ref = pyr_ref
     approxs_dist, details_dist = pyr_dist
     assert len(details_ref) == len(details_dist), 'Both wavelet pyramids must be of the same height'
-    n_levels = len(details_ref)
     spat_gsm_ref_details = [tuple([rred_entropies_and_scales(subband, block_size) for subband in level]) for level in details_ref]
     spat_gsm_dist_details = [tuple([rred_entropies_and_scales(subband, block_size) for subband in level]) for level in details_dist]
-    compute_temporal = (prev_pyr_ref is not None and prev_pyr_dist is not None)
-    if compute_temporal:
+    temp_gsm_ref_details, temp_gsm_dist_details = None, None
+    if prev_pyr_ref is not None and prev_pyr_dist is not None:
         prev_approxs_ref, prev_details_ref = prev_pyr_ref
         prev_approxs_dist, prev_details_dist = prev_pyr_dist
         temp_gsm_ref_details = [tuple([rred_entropies_and_scales(subband - prev_subband, block_size) for subband, prev_subband in zip(level, prev_level)])
@@ -395,7 +327,29 @@ def strred_hv_pyr(pyr_ref, pyr_dist, prev_pyr_ref, prev_pyr_dist, block_size=3,
         temp_gsm_dist_details = [tuple([rred_entropies_and_scales(subband - prev_subband, block_size) for subband, prev_subband in zip(level, prev_level)])
                                  for level, prev_level in zip(details_dist, prev_details_dist)]
 
-    agg = lambda x: np.abs(np.mean(x)) if single else np.mean(np.abs(x))
+    return _strred_hv_vals(spat_gsm_ref_details, spat_gsm_dist_details, temp_gsm_ref_details, temp_gsm_dist_details, single, full)
+
+
+def strred_hv_states(states_ref, states_dist, prev_states_ref, prev_states_dist, single=False, full=False):
+    '''
+    Same as strred_hv_pyr with block_size=1 (up to rounding), given an RredState of the detail subbands of each level
+    of the reference and distorted frames. Temporal maps are derived from the states of the previous frames, if given
+    (see RredState.temporal).
+    '''
+    spat_gsm_ref_details = [state.spatial() for state in states_ref]
+    spat_gsm_dist_details = [state.spatial() for state in states_dist]
+    if prev_states_ref is None or prev_states_dist is None:
+        return _strred_hv_vals(spat_gsm_ref_details, spat_gsm_dist_details, None, None, single, full)
+    temp_gsm_ref_details = [state.temporal(prev_state) for state, prev_state in zip(states_ref, prev_states_ref)]
+    temp_gsm_dist_details = [state.temporal(prev_state) for state, prev_state in zip(states_dist, prev_states_dist)]
+    return _strred_hv_vals(spat_gsm_ref_details, spat_gsm_dist_details, temp_gsm_ref_details, temp_gsm_dist_details, single, full)
+
+
+def _strred_hv_vals(spat_gsm_ref_details, spat_gsm_dist_details, temp_gsm_ref_details, temp_gsm_dist_details, single, full):
+    # Pools per-level (entropies, scales) maps of each subband into ST-RRED values. Temporal maps are None at the first frame.
+    n_levels = len(spat_gsm_ref_details)
+    compute_temporal = temp_gsm_ref_details is not None
+    agg = lambda x: np.abs(np.mean(x, dtype=np.float64)) if single else np.mean(np.abs(x), dtype=np.float64)
 
     spat_vals = np.array([
         np.mean([agg(scale_ref * entropy_ref - scale_dist * entropy_dist) for (entropy_ref, scale_ref), (entropy_dist, scale_dist) in zip(level_ref, level_dist)])
@@ -426,6 +380,7 @@ def strred_hv_pyr(pyr_ref, pyr_dist, prev_pyr_ref, prev_pyr_dist, block_size=3,
     else:
         return (srred_vals, trred_vals, strred_vals), (spat_vals, temp_vals, spat_temp_vals)
 
+
 def blur_edge_pyr(pyr_ref, pyr_dis, mode='both'):
     if mode not in ['blur', 'edge', 'both']:
         raise ValueError
@@ -433,13 +388,20 @@ def blur_edge_pyr(pyr_ref, pyr_dis, mode='both'):
     _, details_ref = pyr_ref
     _, details_dis = pyr_dis
 
-    diffs = [np.sum(np.stack([np.abs(sub_ref) - np.abs(sub_dis) for sub_ref, sub_dis in zip(lev_ref, lev_dis)], -1), -1) for lev_ref, lev_dis in zip(details_ref, details_dis)]
+    # Differences of magnitudes, summed over subbands, are pooled tile by tile
+    def diff_funct(*subbands):
+        n_subbands = len(subbands) // 2
+        diff = np.abs(subbands[0]) - np.abs(subbands[n_subbands])
+        for sub_ref, sub_dis in zip(subbands[1:n_subbands], subbands[n_subbands+1:]):
+            diff += np.abs(sub_ref) - np.abs(sub_dis)
+        return diff
+    diff_stats = [pool_stats(*lev_ref, *lev_dis, funct=diff_funct, clipped=True) for lev_ref, lev_dis in zip(details_ref, details_dis)]
 
     if mode != 'edge':
-        blur_scales = [np.mean(np.clip(diff, 0, None)) for diff in diffs]
+        blur_scales = [stats.pos_mean for stats in diff_stats]
 
     if mode != 'blur':
-        edge_scales = [-np.mean(np.clip(diff, None, 0)) for diff in diffs]
+        edge_scales = [-stats.neg_mean for stats in diff_stats]
 
     if mode == 'blur':
         return blur_scales
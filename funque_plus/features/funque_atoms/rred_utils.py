@@ -1,25 +1,23 @@
 import numpy as np
-from .vif_utils import integral_image
+from .integral_utils import get_box_moments, integral_image, box_sums, _reflect_pad_into
 from .gsm_utils import complex_gsm_model, gsm_model
 
 
+def _var_entropies_and_scales(var_x, sigma_nsq=0.1):
+    # Entropies and scales of rred_entropies_and_scales with block_size = 1, from the local variance
+    entr_const = float(np.log(2*np.pi*np.exp(1)))  # Python float, so that float32 subbands stay float32
+    var_x = np.clip(var_x, 0, None)
+    return np.log(var_x + sigma_nsq) + entr_const, np.log(1 + var_x)
+
+
 def rred_entropies_and_scales(subband, block_size=3):
     sigma_nsq = 0.1
     tol = 1e-10
 
     if block_size == 1:
-        entr_const = np.log(2*np.pi*np.exp(1))
-        sigma_nsq = 0.1
         k = 9
-        k_norm = k**2
-        x_pad = np.pad(subband, int((k - 1)/2), mode='reflect')
-        int_1_x = integral_image(x_pad)
-        int_2_x = integral_image(x_pad*x_pad)
-        mu_x = (int_1_x[:-k, :-k] - int_1_x[:-k, k:] - int_1_x[k:, :-k] + int_1_x[k:, k:])/k_norm
-        var_x = (int_2_x[:-k, :-k] - int_2_x[:-k, k:] - int_2_x[k:, :-k] + int_2_x[k:, k:])/k_norm - mu_x**2
-        var_x = np.clip(var_x, 0, None)
-        entropies = np.log(var_x + sigma_nsq) + entr_const
-        scales = np.log(1 + var_x)
+        _, var_x = get_box_moments(subband.shape, k, dtype=np.result_type(subband.dtype, np.float32), paired=False)(subband)
+        entropies, scales = _var_entropies_and_scales(var_x, sigma_nsq)
     else:
         if np.iscomplexobj(subband):
             s, cov, rel = complex_gsm_model(subband, block_size)
@@ -39,4 +37,51 @@ def rred_entropies_and_scales(subband, block_size=3):
             entropies = entropies + np.log(s*lamda[j]+sigma_nsq) + np.log(2*np.pi*np.exp(1))
         scales = np.log(1 + s)
 
-    return entropies, scales
\ No newline at end of file
+    return entropies, scales
+
+
+def local_cross_means(x, y, k=9):
+    '''
+    Local means of x*y over k x k windows, padded as in BoxMoments.
+    '''
+    pad = int((k - 1)/2)
+    prod, y_pad = np.empty((2, x.shape[0] + 2*pad, x.shape[1] + 2*pad), dtype=np.result_type(x.dtype, y.dtype, np.float32))
+    _reflect_pad_into(prod, x, pad)
+    _reflect_pad_into(y_pad, y, pad)
+    prod *= y_pad
+    return box_sums(integral_image(prod), k) / (k*k)
+
+
+class RredState:
+    '''
+    Local means and variances over 9 x 9 windows of the subbands of one frame, from which the spatial RRED maps
+    (block_size = 1) of the frame are computed. Temporal maps of the next frame are derived from the moments of both frames
+    and the local means of their product, using var(x - y) = var(x) + var(y) - 2 cov(x, y), instead of filtering the frame difference.
+    '''
+    k = 9
+
+    def __init__(self, subbands):
+        self.subbands = list(subbands)
+        self.moments = []
+        for subband in self.subbands:
+            mu, var = get_box_moments(subband.shape, self.k, dtype=np.result_type(subband.dtype, np.float32), paired=False)(subband)
+            self.moments.append((mu.copy(), var.copy()))  # BoxMoments returns views into its scratch
+
+    def spatial(self):
+        '''
+        Same as rred_entropies_and_scales(subband, block_size=1) for each subband.
+        '''
+        return [_var_entropies_and_scales(var) for _, var in self.moments]
+
+    def temporal(self, prev):
+        '''
+        Same as rred_entropies_and_scales(subband - prev_subband, block_size=1) for each subband, up to rounding.
+        prev is the RredState of the previous frame or, if it has none, its subbands, whose difference is then filtered as usual.
+        '''
+        if not isinstance(prev, RredState):
+            return [rred_entropies_and_scales(subband - prev_subband, 1) for subband, prev_subband in zip(self.subbands, prev)]
+        maps = []
+        for subband, (mu, var), prev_subband, (prev_mu, prev_var) in zip(self.subbands, self.moments, prev.subbands, prev.moments):
+            cov = local_cross_means(subband, prev_subband, self.k) - mu*prev_mu
+            maps.append(_var_entropies_and_scales(var + prev_var - 2*cov))
+        return maps
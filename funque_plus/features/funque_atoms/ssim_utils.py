@@ -0,0 +1,79 @@
+import numpy as np
+from .pool_utils import PoolStats
+
+
+def _sum_2x2(x):
+    # Sums over non-overlapping 2x2 blocks, added in the order of im2col(x, 2, 2).sum(0)
+    h, w = x.shape[0] >> 1, x.shape[1] >> 1
+    return x[:2*h:2, :2*w:2] + x[:2*h:2, 1:2*w:2] + x[1:2*h:2, :2*w:2] + x[1:2*h:2, 1:2*w:2]
+
+
+def detail_energies(detail_level_ref, detail_level_dist):
+    # Sums over the detail subbands of one level of the squared ref and dist coefficients, and of their products
+    var_x_add = detail_level_ref[0]*detail_level_ref[0]
+    var_y_add = detail_level_dist[0]*detail_level_dist[0]
+    cov_xy_add = detail_level_ref[0]*detail_level_dist[0]
+    for subband_ref, subband_dist in zip(detail_level_ref[1:], detail_level_dist[1:]):
+        var_x_add += subband_ref*subband_ref
+        var_y_add += subband_dist*subband_dist
+        cov_xy_add += subband_ref*subband_dist
+    return var_x_add, var_y_add, cov_xy_add
+
+
+def wd_ssim_moments(approxs_ref, approxs_dist, details_ref, details_dist, max_val=1, K1=0.01, K2=0.03, levels=None, tile_shape=(128, 512)):
+    '''
+    PoolStats of the l, cs and SSIM maps of wavelet-domain SSIM at each of the given levels (default: all), or None at other levels.
+    Variances and covariances are accumulated across levels using 2x2 block sums, one tile at a time. Tiles span tile_shape pixels
+    of the finest level and the corresponding (nested) pixels of coarser levels, so memory use does not grow with the resolution.
+    Each level is assumed to be half the size of the previous one.
+    '''
+    n_levels = len(details_ref)
+    levels = range(n_levels) if levels is None else levels
+    moments = [(PoolStats(), PoolStats(), PoolStats()) if lev in levels else None for lev in range(n_levels)]
+
+    C1 = (K1*max_val)**2
+    C2 = (K2*max_val)**2
+
+    # Tiles are laid out on the coarsest level. A tile of level lev spans scale_lev times as many rows and columns.
+    scale = 1 << (n_levels - 1)
+    coarse_h, coarse_w = details_ref[-1][0].shape
+    tile_h = max(tile_shape[0] // scale, 1)
+    tile_w = max(tile_shape[1] // scale, 1)
+    for row in range(0, coarse_h, tile_h):
+        for col in range(0, coarse_w, tile_w):
+            row_stop = min(row + tile_h, coarse_h)
+            col_stop = min(col + tile_w, coarse_w)
+            for lev in range(n_levels):
+                scale_lev = 1 << (n_levels - 1 - lev)
+                rows = slice(row*scale_lev, row_stop*scale_lev)
+                cols = slice(col*scale_lev, col_stop*scale_lev)
+                var_x_add, var_y_add, cov_xy_add = detail_energies([subband[rows, cols] for subband in details_ref[lev]], [subband[rows, cols] for subband in details_dist[lev]])
+
+                if lev == 0:
+                    var_x_cum, var_y_cum, cov_xy_cum = var_x_add, var_y_add, cov_xy_add
+                else:
+                    var_x_cum = _sum_2x2(var_x_cum) + var_x_add
+                    var_y_cum = _sum_2x2(var_y_cum) + var_y_add
+                    cov_xy_cum = _sum_2x2(cov_xy_cum) + cov_xy_add
+
+                if moments[lev] is None:
+                    continue
+
+                win_dim = 1 << (lev + 1)  # 2^(lev+1)
+                win_size = 1 << ((lev + 1) << 1)  # 2^(2(lev+1)), i.e., a win_dim X win_dim square
+                mu_x = approxs_ref[lev][rows, cols] / win_dim
+                mu_y = approxs_dist[lev][rows, cols] / win_dim
+                var_x = var_x_cum / win_size
+                var_y = var_y_cum / win_size
+                cov_xy = cov_xy_cum / win_size
+
+                l = (2*mu_x*mu_y + C1) / (mu_x**2 + mu_y**2 + C1)
+                cs = (2 * cov_xy + C2) / (var_x + var_y + C2)
+                ssim_map = l * cs
+
+                l_moments, cs_moments, ssim_moments = moments[lev]
+                l_moments.update(l)
+                cs_moments.update(cs)
+                ssim_moments.update(ssim_map)
+
+    return moments
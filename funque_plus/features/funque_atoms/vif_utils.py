@@ -1,4 +1,5 @@
 import numpy as np
+from .integral_utils import get_box_moments
 
 
 def im2col(img, k, stride=1):
@@ -14,41 +15,13 @@ def im2col(img, k, stride=1):
     return ret[:, :, ::stride, ::stride].reshape(k*k, -1)
 
 
-def integral_image(x):
-    M, N = x.shape
-    int_x = np.zeros((M+1, N+1))
-    # int_x[1:, 1:] = np.cumsum(np.cumsum(x, 0), 1)
-    # Slower, but more precise than cumsum
-    for i in range(x.shape[0]):
-        int_x[i+1, 1:] = int_x[i, 1:] + x[i, :]
-    for j in range(x.shape[1]):
-        int_x[:, j+1] = int_x[:, j+1] + int_x[:, j]
-    return int_x
-
-
-def moments(x, y, k, stride):
-    kh = kw = k
-
-    k_norm = k**2
-
-    x_pad = np.pad(x, int((kh - stride)/2), mode='reflect')
-    y_pad = np.pad(y, int((kw - stride)/2), mode='reflect')
-
-    int_1_x = integral_image(x_pad)
-    int_1_y = integral_image(y_pad)
-
-    int_2_x = integral_image(x_pad*x_pad)
-    int_2_y = integral_image(y_pad*y_pad)
-
-    int_xy = integral_image(x_pad*y_pad)
-
-    mu_x = (int_1_x[:-kh:stride, :-kw:stride] - int_1_x[:-kh:stride, kw::stride] - int_1_x[kh::stride, :-kw:stride] + int_1_x[kh::stride, kw::stride])/k_norm
-    mu_y = (int_1_y[:-kh:stride, :-kw:stride] - int_1_y[:-kh:stride, kw::stride] - int_1_y[kh::stride, :-kw:stride] + int_1_y[kh::stride, kw::stride])/k_norm
-
-    var_x = (int_2_x[:-kh:stride, :-kw:stride] - int_2_x[:-kh:stride, kw::stride] - int_2_x[kh::stride, :-kw:stride] + int_2_x[kh::stride, kw::stride])/k_norm - mu_x**2
-    var_y = (int_2_y[:-kh:stride, :-kw:stride] - int_2_y[:-kh:stride, kw::stride] - int_2_y[kh::stride, :-kw:stride] + int_2_y[kh::stride, kw::stride])/k_norm - mu_y**2
-
-    cov_xy = (int_xy[:-kh:stride, :-kw:stride] - int_xy[:-kh:stride, kw::stride] - int_xy[kh::stride, :-kw:stride] + int_xy[kh::stride, kw::stride])/k_norm - mu_x*mu_y
+def moments(x, y, k, stride, dtype='float64', copy=True):
+    # Fused kernel: one stacked summed-area table for x, y, x^2, y^2 and xy, with scratch reused across calls.
+    # With copy=False, the returned maps live in that scratch and are only valid until the next call of the same shape.
+    box_moments = get_box_moments(x.shape, k, stride, dtype)
+    mu_x, mu_y, var_x, var_y, cov_xy = box_moments(x, y)
+    if copy:
+        mu_x, mu_y, var_x, var_y, cov_xy = [stat.copy() for stat in (mu_x, mu_y, var_x, var_y, cov_xy)]
 
     mask_x = (var_x < 0)
     mask_y = (var_y < 0)
@@ -68,7 +41,7 @@ def vif_channel_est(y_ref, y_dist, winsize, M=3):
     y_ref = y_ref[:y_size[0], :y_size[1]]
     y_dist = y_dist[:y_size[0], :y_size[1]]
 
-    _, _, var_x, var_y, cov_xy = moments(y_ref, y_dist, winsize, M)
+    _, _, var_x, var_y, cov_xy = moments(y_ref, y_dist, winsize, M, copy=False)
 
     g = cov_xy / (var_x + tol)
     sigma_vsq = var_y - g*cov_xy
@@ -85,11 +58,12 @@ def vif_channel_est(y_ref, y_dist, winsize, M=3):
     return g, sigma_vsq
 
 
-def vif_spatial(img_ref, img_dist, k=11, sigma_nsq=0.1, stride=1, full=False):
-    x = img_ref.astype('float64')
-    y = img_dist.astype('float64')
+def vif_spatial(img_ref, img_dist, k=11, sigma_nsq=0.1, stride=1, full=False, dtype='float64'):
+    # dtype sets the precision of the local statistics. Pooled sums are accumulated in float64.
+    x = img_ref.astype(dtype, copy=False)
+    y = img_dist.astype(dtype, copy=False)
 
-    _, _, var_x, var_y, cov_xy = moments(x, y, k, stride)
+    _, _, var_x, var_y, cov_xy = moments(x, y, k, stride, dtype=dtype, copy=False)
 
     g = cov_xy / (var_x + 1e-10)
     sv_sq = var_y - g * cov_xy
@@ -105,9 +79,11 @@ def vif_spatial(img_ref, img_dist, k=11, sigma_nsq=0.1, stride=1, full=False):
     g[g < 0] = 0
     sv_sq[sv_sq < 1e-10] = 1e-10
 
-    vif_val = np.sum(np.log(1 + g**2 * var_x / (sv_sq + sigma_nsq)) + 1e-4)/np.sum(np.log(1 + var_x / sigma_nsq) + 1e-4)
+    vif_num = np.sum(np.log(1 + g**2 * var_x / (sv_sq + sigma_nsq)) + 1e-4, dtype=np.float64)
+    vif_den = np.sum(np.log(1 + var_x / sigma_nsq) + 1e-4, dtype=np.float64)
+    vif_val = vif_num/vif_den
     if (full):
-        return (np.sum(np.log(1 + g**2 * var_x / (sv_sq + sigma_nsq)) + 1e-4), np.sum(np.log(1 + var_x / sigma_nsq) + 1e-4), vif_val)
+        return (vif_num, vif_den, vif_val)
     else:
         return vif_val
 
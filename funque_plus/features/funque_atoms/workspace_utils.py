@@ -0,0 +1,38 @@
+import threading
+from collections import OrderedDict
+
+
+class WorkspaceCache:
+    '''
+    Per-thread cache of workspaces (objects holding scratch buffers or precomputed plans), so that they persist across frames.
+    Each thread keeps its max_size most recently used workspaces, so long-running processes that see many shapes do not
+    accumulate scratch memory.
+    '''
+    def __init__(self, max_size=8):
+        self.max_size = max_size
+        self._local = threading.local()
+
+    def _entries(self):
+        if not hasattr(self._local, 'entries'):
+            self._local.entries = OrderedDict()
+        return self._local.entries
+
+    def get(self, key, make):
+        '''
+        Workspace of this thread for key, created by calling make() if it is not cached.
+        '''
+        entries = self._entries()
+        if key in entries:
+            entries.move_to_end(key)
+            return entries[key]
+        workspace = make()
+        entries[key] = workspace
+        while len(entries) > self.max_size:
+            entries.popitem(last=False)
+        return workspace
+
+    def clear(self):
+        '''
+        Drops the workspaces of the calling thread.
+        '''
+        self._entries().clear()
@@ -0,0 +1,110 @@
+from typing import Any, Iterable, Iterator, Optional
+
+import collections
+import threading
+
+import numpy as np
+
+
+def nbytes(item: Any) -> int:
+    '''
+    Total size of the NumPy arrays in a nest of tuples, lists and dicts.
+    '''
+    if isinstance(item, np.ndarray):
+        return item.nbytes
+    elif isinstance(item, dict):
+        return sum([nbytes(val) for val in item.values()])
+    elif isinstance(item, (list, tuple)):
+        return sum([nbytes(val) for val in item])
+    else:
+        return 0
+
+
+class Prefetcher:
+    '''
+    Runs an iterable on a background thread, keeping at most depth items ready ahead of the consumer.
+    If max_bytes is given, items are also held back while the arrays they contain would exceed max_bytes in total,
+    except that one item is always let through. Exceptions raised by the iterable are re-raised in the consumer.
+    With depth = 0, items are produced on the consumer's thread.
+    '''
+    def __init__(self, iterable: Iterable, depth: int = 2, max_bytes: Optional[int] = None, name: Optional[str] = None) -> None:
+        if depth < 0:
+            raise ValueError('depth must be non-negative')
+        self.depth = depth
+        self.max_bytes = max_bytes
+        self._iterable = iterable
+        self._items = collections.deque()
+        self._bytes = 0
+        self._done = False
+        self._closed = False
+        self._error = None
+        self._cond = threading.Condition()
+        self._thread = None
+        if depth > 0:
+            self._thread = threading.Thread(target=self._produce, name=name, daemon=True)
+            self._thread.start()
+        else:
+            self._iter = iter(iterable)
+
+    def _has_room(self, size: int) -> bool:
+        if len(self._items) >= self.depth:
+            return False
+        return self.max_bytes is None or len(self._items) == 0 or self._bytes + size <= self.max_bytes
+
+    def _produce(self) -> None:
+        try:
+            for item in self._iterable:
+                size = nbytes(item)
+                with self._cond:
+                    while not self._closed and not self._has_room(size):
+                        self._cond.wait()
+                    if self._closed:
+                        return
+                    self._items.append((item, size))
+                    self._bytes += size
+                    self._cond.notify_all()
+        except BaseException as err:
+            with self._cond:
+                self._error = err
+        finally:
+            with self._cond:
+                self._done = True
+                self._cond.notify_all()
+
+    def __iter__(self) -> Iterator:
+        return self
+
+    def __next__(self) -> Any:
+        if self._thread is None:
+            return next(self._iter)
+
+        with self._cond:
+            while not self._items and not self._done:
+                self._cond.wait()
+            if self._items:
+                item, size = self._items.popleft()
+                self._bytes -= size
+                self._cond.notify_all()
+                return item
+            if self._error is not None:
+                raise self._error
+            raise StopIteration
+
+    def close(self) -> None:
+        '''
+        Stops the background thread after the item it is producing, and drops prefetched items.
+        '''
+        if self._thread is None:
+            return
+        with self._cond:
+            self._closed = True
+            self._items.clear()
+            self._bytes = 0
+            self._cond.notify_all()
+        self._thread.join()
+
+    def __enter__(self) -> 'Prefetcher':
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
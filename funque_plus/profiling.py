@@ -0,0 +1,205 @@
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import os
+import time
+import threading
+import contextlib
+import tracemalloc
+
+import numpy as np
+import scipy.io
+
+
+# Environment variable that enables stage timing in feature extractors, unless they are told otherwise.
+PROFILE_ENV = 'FUNQUE_PROFILE'
+
+_null_context = contextlib.nullcontext()
+_active = threading.local()
+
+
+def profiling_enabled(profile: Optional[bool] = None) -> bool:
+    '''
+    profile, if given. Otherwise, whether the environment variable PROFILE_ENV is set to a value other than '', '0', 'false' or 'no'.
+    '''
+    if profile is not None:
+        return profile
+    return os.environ.get(PROFILE_ENV, '').lower() not in ['', '0', 'false', 'no']
+
+
+def stage(name: str):
+    '''
+    Context manager that times a stage of the current frame of this thread (see StageTimer.frame), or does nothing if there is none.
+    '''
+    timer = getattr(_active, 'timer', None)
+    return timer.stage(name) if timer is not None else _null_context
+
+
+class _Stage:
+    def __init__(self, timer: 'StageTimer', name: str) -> None:
+        self.timer = timer
+        self.name = name
+
+    def __enter__(self) -> None:
+        stack = self.timer._stack()
+        self.trace_memory = self.timer._traces_memory()
+        if self.trace_memory:
+            current, peak = tracemalloc.get_traced_memory()
+            for entry in stack:
+                entry['peak'] = max(entry['peak'], peak)
+            tracemalloc.reset_peak()
+        else:
+            current = 0
+        stack.append({'start_mem': current, 'peak': current, 'nested_wall': 0.0, 'nested_cpu': 0.0})
+        self.start_wall = time.perf_counter()
+        self.start_cpu = time.thread_time()
+
+    def __exit__(self, exc_type, *args) -> None:
+        # Stages that raise (e.g., reading past the last frame) are not recorded
+        wall_time = time.perf_counter() - self.start_wall
+        cpu_time = time.thread_time() - self.start_cpu
+        stack = self.timer._stack()
+        entry = stack.pop()
+        if stack:
+            stack[-1]['nested_wall'] += wall_time
+            stack[-1]['nested_cpu'] += cpu_time
+        if exc_type is not None:
+            return
+        if self.trace_memory:
+            entry['peak'] = max(entry['peak'], tracemalloc.get_traced_memory()[1])
+            for parent in stack:
+                parent['peak'] = max(parent['peak'], entry['peak'])
+        frame_ind = getattr(_active, 'frame_ind', None)
+        self.timer.records.append((frame_ind if frame_ind is not None else -1, self.name, wall_time - entry['nested_wall'], cpu_time - entry['nested_cpu'], entry['peak'] - entry['start_mem']))
+
+
+class _Frame:
+    def __init__(self, timer: 'StageTimer', frame_ind: int) -> None:
+        self.timer = timer
+        self.frame_ind = frame_ind
+
+    def __enter__(self) -> None:
+        self.prev = (getattr(_active, 'timer', None), getattr(_active, 'frame_ind', None))
+        _active.timer, _active.frame_ind = self.timer, self.frame_ind
+
+    def __exit__(self, *args) -> None:
+        _active.timer, _active.frame_ind = self.prev
+
+
+class StageTimer:
+    '''
+    Records the wall time, CPU time (of the calling thread) and peak allocation (traced by tracemalloc, above the allocation at the start)
+    of named stages of each frame. Stages are timed by stage() within a frame() context, which may be entered on several threads
+    (e.g., reader threads) at once. Times of stages nested in other stages (e.g., a pyramid computed lazily by a feature) are
+    excluded from those of the enclosing stages, so stage times add up.
+    tracemalloc keeps a single peak for the whole process, which each stage resets. So, peaks are only recorded for stages on the
+    thread that created the timer, and are zero for stages on other threads (e.g., reader threads, when prefetching). Allocations
+    made by other threads while a stage runs still count towards its peak. Only one timer that traces memory may be in use at a time.
+    A disabled timer records nothing, and its contexts cost next to nothing.
+    '''
+    def __init__(self, enabled: bool = True, trace_memory: bool = True) -> None:
+        self.enabled = enabled
+        self.trace_memory = enabled and trace_memory
+        # (frame_ind, stage, wall_time, cpu_time, peak_bytes), with frame_ind -1 for stages outside frames
+        self.records = []
+        self._local = threading.local()
+        self._started_tracing = False
+        self._memory_thread = threading.get_ident()
+
+    def _traces_memory(self) -> bool:
+        return self.trace_memory and threading.get_ident() == self._memory_thread
+
+    def _stack(self) -> List[Dict[str, int]]:
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    def frame(self, frame_ind: int):
+        '''
+        Context in which stages (including those timed by the module-level stage()) of this thread belong to frame frame_ind.
+        '''
+        if not self.enabled:
+            return _null_context
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+        return _Frame(self, frame_ind)
+
+    def stage(self, name: str):
+        if not self.enabled:
+            return _null_context
+        return _Stage(self, name)
+
+    def frames(self, items: Iterable[Any], decode_stage: str = 'decode', body_stage: Optional[str] = 'compute') -> Iterator[Tuple[int, Any]]:
+        '''
+        Same as enumerate(items), timing the production of each item (e.g., decoding a frame) as decode_stage and,
+        if body_stage is not None, the body of the caller's loop as body_stage.
+        '''
+        items = iter(items)
+        frame_ind = 0
+        while True:
+            with self.frame(frame_ind):
+                try:
+                    with self.stage(decode_stage):
+                        item = next(items)
+                except StopIteration:
+                    return
+                with self.stage(body_stage) if body_stage is not None else _null_context:
+                    yield frame_ind, item
+            frame_ind += 1
+
+    def stop(self) -> None:
+        '''
+        Stops tracing allocations, if this timer started it.
+        '''
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    def frame_table(self) -> Dict[str, Any]:
+        '''
+        Per-frame timings: stages (in order of first use), frame_inds (sorted), and arrays of shape (frames, stages) of the total
+        wall_time and cpu_time (in seconds) and of the maximum peak_bytes of each stage in each frame. Stages that did not run are zero.
+        '''
+        stages = list(dict.fromkeys([record[1] for record in self.records]))
+        frame_inds = sorted(set([record[0] for record in self.records]))
+        stage_inds = {name: ind for ind, name in enumerate(stages)}
+        row_inds = {frame_ind: ind for ind, frame_ind in enumerate(frame_inds)}
+        wall_time = np.zeros((len(frame_inds), len(stages)))
+        cpu_time = np.zeros((len(frame_inds), len(stages)))
+        peak_bytes = np.zeros((len(frame_inds), len(stages)), dtype=np.int64)
+        for frame_ind, name, wall, cpu, peak in self.records:
+            row, col = row_inds[frame_ind], stage_inds[name]
+            wall_time[row, col] += wall
+            cpu_time[row, col] += cpu
+            peak_bytes[row, col] = max(peak_bytes[row, col], peak)
+        return {'stages': stages, 'frame_inds': np.array(frame_inds, dtype=np.int64), 'wall_time': wall_time, 'cpu_time': cpu_time, 'peak_bytes': peak_bytes}
+
+    def attach(self, result: Any) -> Any:
+        '''
+        Stores the frame_table of an enabled timer as result.stage_timings, stops tracing allocations, and returns result.
+        '''
+        if self.enabled:
+            self.stop()
+            result.stage_timings = self.frame_table()
+        return result
+
+
+def summarize_timings(stage_timings: Dict[str, Any]) -> str:
+    '''
+    CSV summary of a frame_table: per stage, the number of frames in which it ran, its mean wall and CPU times per such frame
+    and its total wall time (in ms), and its largest peak allocation (in MB).
+    '''
+    lines = ['Stage,Frames,Mean wall (ms),Mean CPU (ms),Total wall (ms),Max peak (MB)']
+    for col, name in enumerate(stage_timings['stages']):
+        wall_time = stage_timings['wall_time'][:, col]
+        ran = wall_time > 0
+        frames = max(int(np.sum(ran)), 1)
+        lines.append(f'{name},{np.sum(ran)},{1e3*np.sum(wall_time)/frames:.3f},{1e3*np.sum(stage_timings["cpu_time"][:, col])/frames:.3f},{1e3*np.sum(wall_time):.1f},{np.max(stage_timings["peak_bytes"][:, col])/(1 << 20):.2f}')
+    return '\n'.join(lines)
+
+
+def save_timings(stage_timings: Dict[str, Any], path: str) -> None:
+    '''
+    Saves a frame_table to a MAT file.
+    '''
+    scipy.io.savemat(path, {**stage_timings, 'stages': np.array(stage_timings['stages'], dtype=object)})
@@ -0,0 +1,129 @@
+from typing import Any, Dict, List, Optional
+
+import os
+import json
+import hashlib
+import tempfile
+
+import numpy as np
+
+
+# Environment variable used as the default cache directory by the FUNQUE-family extractors.
+REF_CACHE_DIR_ENV = 'FUNQUE_REF_CACHE_DIR'
+
+
+def _flatten(tree: Any, arrays: List[np.ndarray]) -> Any:
+    # Replaces arrays in a nest of tuples, lists and dicts by their index into arrays.
+    if isinstance(tree, dict):
+        return {'dict': {key: _flatten(val, arrays) for key, val in tree.items()}}
+    elif isinstance(tree, (list, tuple)):
+        return {'tuple' if isinstance(tree, tuple) else 'list': [_flatten(val, arrays) for val in tree]}
+    elif tree is None:
+        return None
+    else:
+        arr = np.asarray(tree)
+        arrays.append(arr)
+        return {'array': len(arrays) - 1}
+
+
+def _unflatten(layout: Any, arrays: List[np.ndarray]) -> Any:
+    if layout is None:
+        return None
+    elif 'dict' in layout:
+        return {key: _unflatten(val, arrays) for key, val in layout['dict'].items()}
+    elif 'tuple' in layout:
+        return tuple([_unflatten(val, arrays) for val in layout['tuple']])
+    elif 'list' in layout:
+        return [_unflatten(val, arrays) for val in layout['list']]
+    else:
+        return arrays[layout['array']]
+
+
+class RefPyramidCache:
+    '''
+    On-disk cache of the reference-side work (resize, CSF, wavelet decomposition) of a FUNQUE-family extractor.
+    Entries are keyed by the reference file, the extractor configuration and the frame index, so that every
+    distorted version of a content reuses the pyramids computed for the first one.
+    Each frame is stored as one flat .npy file and read back as memory-mapped, read-only views.
+    '''
+    def __init__(self, cache_dir: str, ref_path: str, config: Dict[str, Any]) -> None:
+        ref_path = os.path.abspath(ref_path)
+        ref_stat = os.stat(ref_path)
+        key_dict = {'ref_path': ref_path, 'ref_size': ref_stat.st_size, 'ref_mtime': ref_stat.st_mtime_ns, 'config': config}
+        key = hashlib.sha1(json.dumps(key_dict, sort_keys=True, default=str).encode()).hexdigest()
+
+        self.cache_dir = os.path.join(cache_dir, key)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._layout = None
+
+        key_path = os.path.join(self.cache_dir, 'key.json')
+        if not os.path.isfile(key_path):
+            self._atomic_write(key_path, lambda f: f.write(json.dumps(key_dict, indent=4, default=str).encode()))
+
+    @classmethod
+    def from_asset(cls, cache_dir: Optional[str], asset_dict: Dict[str, Any], config: Dict[str, Any]) -> Optional['RefPyramidCache']:
+        '''
+        Returns None (no caching) if cache_dir is None.
+        '''
+        if cache_dir is None:
+            return None
+        config = dict(config)
+        config['width'] = asset_dict['width']
+        config['height'] = asset_dict['height']
+        config['ref_standard'] = asset_dict['ref_standard'].name
+        return cls(cache_dir, asset_dict['ref_path'], config)
+
+    def _frame_path(self, frame_ind: int) -> str:
+        return os.path.join(self.cache_dir, f'{frame_ind}.npy')
+
+    def _atomic_write(self, path: str, write_funct) -> None:
+        # Several processes may fill the same cache concurrently. Write to a temporary file and rename.
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                write_funct(f)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def _read_layout(self) -> Optional[Dict[str, Any]]:
+        if self._layout is None:
+            layout_path = os.path.join(self.cache_dir, 'layout.json')
+            if not os.path.isfile(layout_path):
+                return None
+            with open(layout_path, 'r') as f:
+                self._layout = json.load(f)
+        return self._layout
+
+    def get(self, frame_ind: int) -> Optional[Any]:
+        '''
+        Returns the cached pyramid(s) of the given frame, or None on a miss.
+        '''
+        frame_path = self._frame_path(frame_ind)
+        layout = self._read_layout()
+        if layout is None or not os.path.isfile(frame_path):
+            return None
+
+        flat = np.load(frame_path, mmap_mode='r')
+        arrays = []
+        offset = 0
+        for shape in layout['shapes']:
+            size = int(np.prod(shape))
+            arrays.append(flat[offset:offset+size].reshape(shape))
+            offset += size
+        return _unflatten(layout['tree'], arrays)
+
+    def put(self, frame_ind: int, pyr: Any) -> None:
+        arrays = []
+        tree = _flatten(pyr, arrays)
+        if self._read_layout() is None:
+            layout = {'tree': tree, 'shapes': [list(arr.shape) for arr in arrays], 'dtype': np.result_type(*arrays).str}
+            self._atomic_write(os.path.join(self.cache_dir, 'layout.json'), lambda f: f.write(json.dumps(layout).encode()))
+            self._layout = layout
+        elif tree != self._layout['tree'] or [list(arr.shape) for arr in arrays] != self._layout['shapes']:
+            raise ValueError('Pyramid structure does not match the layout of the cache')
+
+        flat = np.concatenate([arr.ravel() for arr in arrays]).astype(self._layout['dtype'], copy=False)
+        self._atomic_write(self._frame_path(frame_ind), lambda f: np.save(f, flat))
@@ -0,0 +1,255 @@
+from typing import Any, Dict, List, Optional, Tuple
+
+import os
+import json
+import time
+import tempfile
+import threading
+import concurrent.futures
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from .utils import get_standard
+from .feature_extractors import fex_modules
+
+
+# Output formats of scoring jobs: features as JSON, or the bytes of the MAT file written by Result.save.
+out_formats = ['json', 'mat']
+
+# Extractors constructed by this worker process, keyed by name, version and keyword arguments.
+_worker_fexs = {}
+
+
+class QueueFullError(Exception):
+    pass
+
+
+def _init_worker(warm_fex_name: Optional[str]) -> None:
+    # Imports (and, if warm_fex_name is given, constructing its default extractor) are paid once per worker process,
+    # instead of once per job
+    if warm_fex_name is not None:
+        _get_worker_fex(warm_fex_name, None, {})
+
+
+def _get_worker_fex(fex_name: str, fex_version: Optional[str], fex_kwargs: Dict[str, Any]) -> Tuple[Any, float]:
+    # Returns the warm extractor and the time spent constructing it (0 if it was already warm)
+    key = (fex_name, fex_version, json.dumps(fex_kwargs, sort_keys=True))
+    if key in _worker_fexs:
+        return _worker_fexs[key], 0.0
+    from .feature_extractors import get_fex
+    start = time.time()
+    _worker_fexs[key] = get_fex(fex_name, fex_version)(use_cache=False, **fex_kwargs)
+    return _worker_fexs[key], time.time() - start
+
+
+def _start_worker() -> None:
+    # No-op job, submitted only to make a pool start its worker processes
+    pass
+
+
+def job_asset_dict(job: Dict[str, Any]) -> Dict[str, Any]:
+    '''
+    Asset dict of a scoring job, in the format of extract_features.py.
+    '''
+    asset_dict = {}
+    asset_dict['dataset_name'] = None
+    asset_dict['ref_path'] = job['ref_path']
+    asset_dict['dis_path'] = job['dis_path']
+    asset_dict['ref_standard'] = get_standard(job.get('ref_standard', 'sRGB'))
+    asset_dict['dis_standard'] = get_standard(job.get('dis_standard', job.get('ref_standard', 'sRGB')))
+    asset_dict['content_id'] = 0
+    asset_dict['asset_id'] = 0
+    asset_dict['score'] = None
+    asset_dict['width'] = job.get('width')
+    asset_dict['height'] = job.get('height')
+    asset_dict['fps'] = job.get('framerate')
+    asset_dict['chroma_format'] = job.get('chroma_format', '420')
+    return asset_dict
+
+
+def _run_job(job: Dict[str, Any], out_format: str) -> Dict[str, Any]:
+    # Runs in a worker process. Times are wall-clock, so that the queueing time can be measured across processes.
+    start = time.time()
+    fex, setup_time = _get_worker_fex(job['fex_name'], job.get('fex_version'), job.get('fex_kwargs', {}))
+    extract_start = time.time()
+    result = fex(job_asset_dict(job))
+    output = {'start': start, 'setup_time': setup_time, 'extract_time': time.time() - extract_start}
+    if out_format == 'mat':
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            out_path = os.path.join(tmp_dir, 'result.mat')
+            result.save(out_path)
+            with open(out_path, 'rb') as out_file:
+                output['mat'] = out_file.read()
+    else:
+        output['feat_names'] = np.asarray(result.feat_names).flatten().tolist()
+        output['feats'] = np.asarray(result.feats).tolist()
+        output['agg_feats'] = np.asarray(result.agg_feats).flatten().tolist()
+    return output
+
+
+class ScoringService:
+    '''
+    Scores video pairs on pools of long-running worker processes, one pool of workers processes per feature extractor name.
+    Workers import the feature extractors once and keep every extractor they construct, so jobs only pay for feature extraction.
+    At most max_pending jobs per extractor may be queued or running. Further jobs raise QueueFullError until some finish,
+    so that clients back off instead of queueing unbounded work.
+    Only extractors in the registry (feature_extractors.fex_modules) are served. Workers of the extractors in warm_fex_names are
+    started up front, and construct the extractor (with default arguments) when they start.
+    '''
+    def __init__(self, workers: int = 1, max_pending: Optional[int] = None, warm_fex_names: Optional[List[str]] = None) -> None:
+        if workers < 1:
+            raise ValueError('workers must be positive')
+        self.workers = workers
+        self.max_pending = max_pending if max_pending is not None else 4*workers
+        self._pools = {}
+        self._stats = {}
+        self._lock = threading.Lock()
+        self.warm_fex_names = list(warm_fex_names or [])
+        for fex_name in self.warm_fex_names:
+            self._check_fex_name(fex_name)
+        # Workers warm themselves when they start (see _init_worker), so these jobs only start them up front
+        for fex_name in self.warm_fex_names:
+            pool = self._get_pool(fex_name)
+            for _ in range(workers):
+                pool.submit(_start_worker)
+
+    @staticmethod
+    def _check_fex_name(fex_name: Any) -> None:
+        # Pools are created per extractor name, so names must be checked before a pool is created for them
+        if not isinstance(fex_name, str) or fex_name not in fex_modules:
+            raise ValueError(f'Unknown feature extractor {fex_name}. Must be one of {list(fex_modules)}')
+
+    def _get_pool(self, fex_name: str) -> concurrent.futures.ProcessPoolExecutor:
+        with self._lock:
+            if fex_name not in self._pools:
+                warm_fex_name = fex_name if fex_name in self.warm_fex_names else None
+                self._pools[fex_name] = concurrent.futures.ProcessPoolExecutor(self.workers, initializer=_init_worker, initargs=(warm_fex_name,))
+                self._stats[fex_name] = {'pending': 0, 'completed': 0, 'failed': 0, 'rejected': 0, 'extract_time': 0.0}
+            return self._pools[fex_name]
+
+    def _job_done(self, fex_name: str, future: concurrent.futures.Future) -> None:
+        with self._lock:
+            stats = self._stats[fex_name]
+            stats['pending'] -= 1
+            if future.cancelled() or future.exception() is not None:
+                stats['failed'] += 1
+            else:
+                stats['completed'] += 1
+                stats['extract_time'] += future.result()['extract_time']
+
+    def submit(self, job: Dict[str, Any], out_format: str = 'json') -> concurrent.futures.Future:
+        '''
+        Queues a job, given as a dict with keys fex_name, ref_path and dis_path, and optionally fex_version, fex_kwargs,
+        ref_standard, dis_standard, width, height, framerate and chroma_format (as in extract_features.py).
+        The future resolves to a dict of timings and the features (feat_names, feats, agg_feats) or the bytes of a MAT file (mat).
+        '''
+        if out_format not in out_formats:
+            raise ValueError(f'Invalid output format {out_format}. Must be one of {out_formats}')
+        for key in ['fex_name', 'ref_path', 'dis_path']:
+            if key not in job:
+                raise ValueError(f'Job is missing {key}')
+        for key in ['ref_path', 'dis_path']:
+            if not os.path.isfile(job[key]):
+                raise ValueError(f'{key} {job[key]} does not exist')
+        self._check_fex_name(job['fex_name'])
+        job_asset_dict(job)  # Validates standards in the server instead of the worker
+
+        pool = self._get_pool(job['fex_name'])
+        with self._lock:
+            stats = self._stats[job['fex_name']]
+            if stats['pending'] >= self.max_pending:
+                stats['rejected'] += 1
+                raise QueueFullError(f'{stats["pending"]} jobs are pending for {job["fex_name"]}')
+            stats['pending'] += 1
+        submit_time = time.time()
+        future = pool.submit(_run_job, job, out_format)
+        future.submit_time = submit_time
+        future.add_done_callback(lambda done: self._job_done(job['fex_name'], done))
+        return future
+
+    def score(self, job: Dict[str, Any], out_format: str = 'json', timeout: Optional[float] = None) -> Dict[str, Any]:
+        '''
+        Runs a job (see submit) and waits for its output, to which the time spent in the queue and in total are added.
+        '''
+        future = self.submit(job, out_format)
+        output = future.result(timeout)
+        output['queue_time'] = output.pop('start') - future.submit_time
+        output['total_time'] = time.time() - future.submit_time
+        return output
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {fex_name: dict(stats) for fex_name, stats in self._stats.items()}
+
+    def close(self) -> None:
+        with self._lock:
+            pools = list(self._pools.values())
+            self._pools = {}
+        for pool in pools:
+            pool.shutdown(wait=True, cancel_futures=True)
+
+
+class ScoringRequestHandler(BaseHTTPRequestHandler):
+    '''
+    HTTP interface of the ScoringService of the server.
+    POST /score with a JSON job (see ScoringService.submit, plus an optional format) responds when the job is done.
+    Busy extractors respond with 503 and a Retry-After header. GET /status returns per-extractor job counts.
+    '''
+    def _send(self, code: int, body: bytes, content_type: str = 'application/json', headers: Optional[Dict[str, str]] = None) -> None:
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for key, val in (headers or {}).items():
+            self.send_header(key, val)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, code: int, obj: Any, headers: Optional[Dict[str, str]] = None) -> None:
+        self._send(code, json.dumps(obj).encode(), headers=headers)
+
+    def do_GET(self) -> None:
+        if self.path != '/status':
+            self._send_json(404, {'error': f'Unknown path {self.path}'})
+            return
+        self._send_json(200, {'workers': self.server.service.workers, 'max_pending': self.server.service.max_pending, 'extractors': self.server.service.stats()})
+
+    def do_POST(self) -> None:
+        if self.path != '/score':
+            self._send_json(404, {'error': f'Unknown path {self.path}'})
+            return
+        try:
+            job = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            out_format = job.pop('format', 'json')
+            output = self.server.service.score(job, out_format, self.server.job_timeout)
+        except QueueFullError as err:
+            self._send_json(503, {'error': str(err)}, headers={'Retry-After': '1'})
+            return
+        except (ValueError, KeyError) as err:
+            self._send_json(400, {'error': f'{type(err).__name__}: {err}'})
+            return
+        except concurrent.futures.TimeoutError:
+            self._send_json(504, {'error': f'Job did not finish in {self.server.job_timeout} s'})
+            return
+        except Exception as err:
+            self._send_json(500, {'error': f'{type(err).__name__}: {err}'})
+            return
+
+        timings = {key: output.pop(key) for key in ['queue_time', 'setup_time', 'extract_time', 'total_time']}
+        if out_format == 'mat':
+            self._send(200, output['mat'], 'application/octet-stream', headers={f'X-{key.replace("_", "-").title()}': f'{val:.6f}' for key, val in timings.items()})
+        else:
+            output['timing'] = timings
+            self._send_json(200, output)
+
+
+class ScoringServer(ThreadingHTTPServer):
+    '''
+    Threaded HTTP server that forwards scoring requests to a ScoringService. Jobs that take longer than job_timeout seconds fail with 504.
+    '''
+    daemon_threads = True
+
+    def __init__(self, address: Tuple[str, int], service: ScoringService, job_timeout: Optional[float] = None) -> None:
+        super().__init__(address, ScoringRequestHandler)
+        self.service = service
+        self.job_timeout = job_timeout
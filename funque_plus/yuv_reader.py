@@ -0,0 +1,106 @@
+from typing import Iterator, Tuple
+
+import os
+
+import numpy as np
+from videolib import standards
+
+
+# Chroma subsampling factors (vertical, horizontal) of the supported planar formats.
+chroma_formats = {'420': (2, 2), '422': (1, 2), '444': (1, 1)}
+
+
+def infer_chroma_format(luma_shape: Tuple[int, int], chroma_shape: Tuple[int, int]) -> str:
+    '''
+    Chroma format of planes having the given shapes.
+    '''
+    for chroma_format, (sub_y, sub_x) in chroma_formats.items():
+        if tuple(chroma_shape) == (-(-luma_shape[0] // sub_y), -(-luma_shape[1] // sub_x)):
+            return chroma_format
+    raise ValueError(f'Chroma planes of shape {tuple(chroma_shape)} do not match any chroma format for a luma plane of shape {tuple(luma_shape)}')
+
+
+class YuvFrame:
+    '''
+    One frame of a YuvReader. Planes are read-only views into the memory-mapped file, so nothing is read
+    from disk until a plane is used. Frames may also wrap planes held in memory, in which case chroma planes may be None.
+    '''
+    def __init__(self, planes: Tuple[np.ndarray, np.ndarray, np.ndarray], chroma_format: str) -> None:
+        self._planes = planes
+        self.chroma_format = chroma_format
+        self.height, self.width = planes[0].shape
+
+    def plane(self, channel_ind: int) -> np.ndarray:
+        '''
+        Plane of channel channel_ind (0 for Y, 1 for U, 2 for V) at its native resolution.
+        '''
+        return self._planes[channel_ind]
+
+    def full_plane(self, channel_ind: int) -> np.ndarray:
+        '''
+        Plane of channel channel_ind at the resolution of the luma plane. Subsampled chroma planes are upsampled by pixel repetition.
+        '''
+        plane = self._planes[channel_ind]
+        sub_y, sub_x = chroma_formats[self.chroma_format] if channel_ind else (1, 1)
+        if sub_y > 1:
+            plane = plane.repeat(sub_y, axis=0)[:self.height]
+        if sub_x > 1:
+            plane = plane.repeat(sub_x, axis=1)[:, :self.width]
+        return plane
+
+    @property
+    def yuv(self) -> np.ndarray:
+        # Same layout as a videolib Frame. Copies all three planes, so prefer plane() or full_plane().
+        return np.stack([self.full_plane(channel_ind) for channel_ind in range(3)], axis=-1)
+
+
+class YuvReader:
+    '''
+    Memory-mapped reader of raw planar YUV files (4:2:0, 4:2:2 or 4:4:4) that returns zero-copy views of each plane.
+    Samples are stored as standard.dtype, i.e. 8-bit videos as uint8 and 10-bit videos as little-endian 16-bit words.
+    Trailing bytes that do not form a whole frame are ignored.
+    '''
+    def __init__(self, path: str, width: int, height: int, standard: standards.Standard, chroma_format: str = '420') -> None:
+        if chroma_format not in chroma_formats:
+            raise ValueError(f'Invalid chroma format {chroma_format}. Must be one of {list(chroma_formats)}')
+        self.path = path
+        self.width = width
+        self.height = height
+        self.standard = standard
+        self.chroma_format = chroma_format
+        self.dtype = np.dtype(standard.dtype).newbyteorder('<')
+
+        sub_y, sub_x = chroma_formats[chroma_format]
+        self.chroma_shape = (-(-height // sub_y), -(-width // sub_x))
+        self._plane_shapes = [(height, width), self.chroma_shape, self.chroma_shape]
+        self._plane_offsets = np.cumsum([0] + [h*w for h, w in self._plane_shapes])
+        self.frame_size = int(self._plane_offsets[-1])
+
+        self.num_frames = os.path.getsize(path) // (self.frame_size * self.dtype.itemsize)
+        self._frames = None
+
+    def __enter__(self) -> 'YuvReader':
+        if self.num_frames > 0:
+            self._frames = np.memmap(self.path, dtype=self.dtype, mode='r', shape=(self.num_frames, self.frame_size))
+        else:
+            self._frames = np.empty((0, self.frame_size), dtype=self.dtype)  # Empty files cannot be memory-mapped
+        return self
+
+    def __exit__(self, *args) -> None:
+        self._frames = None
+
+    def __len__(self) -> int:
+        return self.num_frames
+
+    def __getitem__(self, frame_ind: int) -> YuvFrame:
+        if self._frames is None:
+            raise RuntimeError('YuvReader must be opened using a with statement before reading frames')
+        if not -self.num_frames <= frame_ind < self.num_frames:
+            raise IndexError(f'Frame index {frame_ind} out of range for video with {self.num_frames} frames')
+        frame = self._frames[frame_ind]
+        planes = tuple([frame[start:stop].reshape(shape) for start, stop, shape in zip(self._plane_offsets[:-1], self._plane_offsets[1:], self._plane_shapes)])
+        return YuvFrame(planes, self.chroma_format)
+
+    def __iter__(self) -> Iterator[YuvFrame]:
+        for frame_ind in range(self.num_frames):
+            yield self[frame_ind]
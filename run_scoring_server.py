@@ -0,0 +1,38 @@
+import os
+
+from funque_plus.scoring_service import ScoringService, ScoringServer
+from funque_plus.ref_cache import REF_CACHE_DIR_ENV
+
+import argparse
+
+def get_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description='Run a local server that scores video pairs using pools of warm feature extractors')
+    parser.add_argument('--host', help='Address on which to listen. Defaults to localhost only.', type=str, default='127.0.0.1')
+    parser.add_argument('--port', help='Port on which to listen', type=int, default=8765)
+    parser.add_argument('--workers', help='Number of worker processes per feature extractor', type=int, default=1)
+    parser.add_argument('--max_pending', help='Maximum number of queued and running jobs per feature extractor, beyond which jobs are rejected. (Optional, default 4 per worker)', type=int, default=None)
+    parser.add_argument('--warm_fex_names', help='Names of feature extractors whose workers are started and constructed up front. (Optional)', type=str, nargs='*', default=[])
+    parser.add_argument('--job_timeout', help='Time in seconds after which a request for a job fails. (Optional)', type=float, default=None)
+    parser.add_argument('--ref_cache_dir', help='Directory in which FUNQUE-family extractors cache reference-side pyramids, shared across distorted videos. (Optional)', type=str, default=None)
+    return parser
+
+
+def main():
+    args = get_parser().parse_args()
+    if args.ref_cache_dir is not None:
+        os.environ[REF_CACHE_DIR_ENV] = args.ref_cache_dir  # Inherited by the worker processes
+
+    service = ScoringService(args.workers, args.max_pending, args.warm_fex_names)
+    server = ScoringServer((args.host, args.port), service, args.job_timeout)
+    print(f'Listening on http://{args.host}:{args.port}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+
+
+if __name__ == '__main__':
+    main()